@@ -1,5 +1,5 @@
 import streamlit as st
-from pages._common_elements import load_css, init_session_state, display_chat_messages, handle_chat_input, create_sidebar
+from pages._common_elements import load_css, init_session_state, display_chat_messages, handle_chat_input, create_sidebar, cancel_generation
 
 # -- 页面配置 (可能不需要，因为主 app.py 已设置) --
 # st.set_page_config(page_title="普通问答", page_icon="💬", layout="wide")
@@ -16,6 +16,7 @@ st.header("💬 普通问答模式", divider='rainbow') # 使用原生标题和
 
 # -- 清空聊天记录按钮 (移到主页面) --
 if st.button("🗑️ 清空聊天记录", key="clear_normal_chat"):
+    cancel_generation("chat cleared") # 停止进行中的生成
     if 'messages' in st.session_state: st.session_state.messages = [] # 清空普通问答的消息
     st.success("聊天记录已清空！") # 显示成功信息
     st.rerun() # 刷新页面
@@ -1,8 +1,9 @@
 import streamlit as st
 import os # 导入os以处理文件
+from src.upload_cache import UploadCache
 from pages._common_elements import (
     load_css, init_session_state, display_chat_messages, 
-    handle_chat_input, create_sidebar, process_uploaded_file, logger # 导入所需函数，包括 process_uploaded_file 和 logger
+    handle_chat_input, create_sidebar, process_uploaded_file, cancel_generation, logger # 导入所需函数，包括 process_uploaded_file 和 logger
 )
 
 # -- 页面配置 --
@@ -19,6 +20,7 @@ st.header("📄 简历问答模式", divider='rainbow') # 使用原生标题和
 
 # -- 清空聊天记录按钮 (保持在主页面) --
 if st.button("🗑️ 清空简历问答记录", key="clear_resume_chat"):
+    cancel_generation("chat cleared") # 停止进行中的生成
     if 'resume_messages' in st.session_state: st.session_state.resume_messages = [] # 清空简历问答的消息
     st.success("简历问答记录已清空！") # 显示成功信息
     st.rerun() # 刷新页面
@@ -29,20 +31,41 @@ if 'resume_messages' not in st.session_state: # 初始化简历问答消息列
         {"role": "assistant", "content": "请先在侧边栏上传简历文件，然后在此提问。"} # 更新提示
     ]
 display_chat_messages(messages_key="resume_messages") # 显示聊天消息
-handle_chat_input(use_rag=True, messages_key="resume_messages") # 处理聊天输入 (RAG 模式)
+handle_chat_input(use_rag=True, messages_key="resume_messages", tenant_id=st.session_state.get('kb_tenant')) # 处理聊天输入 (RAG 模式, 检索本会话上传的简历)
+
+@st.fragment(run_every=1.0)
+def show_build_progress():
+    """知识库构建进度 (每秒单独刷新本片段, 不阻塞页面); 结束后整页刷新"""
+    job = st.session_state.get('kb_job')
+    if not job: return
+    status = st.session_state.system.get_upload_status(job["job_id"])
+    if status["status"] in ("queued", "running"):
+        st.progress(status["progress"], text=status["message"])
+        return
+    del st.session_state.kb_job
+    if status["status"] == "succeeded":
+        st.session_state.knowledge_base = job["name"] # 记录知识库名称
+        st.session_state.kb_tenant = job["tenant_id"] # 本会话后续查询只检索该简历
+    else: st.session_state.kb_error = f"{status['message']}: {status.get('error') or ''}"
+    st.rerun() # 构建结束后刷新整个页面
 
 # -- 侧边栏 --
 st.sidebar.markdown("### 📊 简历管理") # 添加侧边栏标题
 if 'system' not in st.session_state or st.session_state.system is None:
     st.sidebar.error("系统未初始化，请刷新页面")
 else:
-    if st.session_state.get('knowledge_base'): # 检查是否已加载知识库
+    if st.session_state.get('kb_job'): # 后台构建中: 只刷新进度片段, 构建期间仍可正常对话
+        with st.sidebar: show_build_progress()
+    elif st.session_state.get('kb_error'): # 上一次构建失败
+        st.sidebar.error(st.session_state.pop('kb_error')) # 显示失败消息
+    elif st.session_state.get('knowledge_base'): # 检查是否已加载知识库
         st.sidebar.success(f"✨ 当前使用: {st.session_state.knowledge_base}")
         if st.sidebar.button("🔄 移除简历", key="remove_resume_sidebar"):
             st.session_state.knowledge_base = None # 清除知识库状态
+            tenant_id = st.session_state.pop('kb_tenant', None) # 清除本会话的简历 ID
             if hasattr(st.session_state.system, 'reset_rag'):
                 st.sidebar.info("知识库已移除。")
-                st.session_state.system.reset_rag() # 重置 RAG (如果方法存在)
+                st.session_state.system.reset_rag(tenant_id) # 卸载本会话的简历知识库
             else:
                 st.sidebar.warning("无法完全重置 RAG 状态，但知识库引用已移除。")
             st.rerun() # 刷新页面
@@ -61,11 +84,11 @@ else:
                         content = process_uploaded_file(uploaded_file) # 调用通用处理函数
                         if isinstance(content, str) and not content.startswith("不支持") and not content.startswith("处理失败"):
                             st.sidebar.info(f"提取 {len(content)} 字符")
-                            result = st.session_state.system.upload_resume(content) # 调用上传简历方法
+                            tenant_id = UploadCache.file_hash(uploaded_file.getvalue())[:16] # 以文件内容哈希作为简历 ID (重复上传直接复用知识库)
+                            result = st.session_state.system.upload_resume(content, tenant_id=tenant_id) # 提交后台构建任务, 立即返回
                             if result["success"]:
-                                st.session_state.knowledge_base = uploaded_file.name # 记录知识库名称
-                                st.sidebar.success(result["message"]) # 显示成功消息
-                                st.rerun() # 成功后刷新
+                                st.session_state.kb_job = {"job_id": result["job_id"], "name": uploaded_file.name, "tenant_id": tenant_id}
+                                st.rerun() # 刷新后轮询构建进度
                             else: st.sidebar.error(result["message"]) # 显示失败消息
                         else:
                             st.sidebar.error(f"处理失败: {content}") # 显示处理失败信息
@@ -1,11 +1,10 @@
 import streamlit as st
-import json, time, io, sys, os
+import json, time, io, sys, os, tempfile
 from src.utils import Config, setup_logger # 保持对 utils 的依赖
-import pytesseract
-from pdf2image import convert_from_bytes
-from PIL import Image
+from src.document_loader import iter_pdf_pages
+from src.upload_cache import UploadCache
+from src.cancellation import CancellationToken
 import docx2txt
-import pdfplumber
 
 # 确保 src 目录在路径中 (可能需要，因为页面在 pages 目录下运行)
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # 获取项目根目录 (上两级)
@@ -330,6 +329,12 @@ def process_uploaded_file(uploaded_file): # 从 app.py 移动
     file_type = uploaded_file.name.split('.')[-1].lower()
     text = "" # 初始化text
     progress_bar = None # 初始化progress_bar
+    upload_cache = UploadCache()
+    file_hash = upload_cache.file_hash(uploaded_file.getvalue())
+    cached_text = upload_cache.get_text(file_hash) # 相同文件此前已解析过: 跳过解析与 OCR
+    if cached_text is not None:
+        st.sidebar.info("该文件此前已处理过, 直接使用缓存结果")
+        return cached_text
     try: # 使用try...finally确保进度条被清理
         if file_type in ['txt', 'md']:
             try:
@@ -339,33 +344,28 @@ def process_uploaded_file(uploaded_file): # 从 app.py 移动
                 uploaded_file.seek(0)
                 text = uploaded_file.read().decode('gbk', errors='ignore')
         elif file_type == 'pdf':
-            with pdfplumber.open(uploaded_file) as pdf:
-                total_pages = len(pdf.pages)
-                st.sidebar.info(f"处理PDF, 共 {total_pages} 页...")
+            fd, tmp_path = tempfile.mkstemp(suffix=".pdf") # OCR 子进程按路径渲染页面
+            try:
+                with os.fdopen(fd, 'wb') as f: f.write(uploaded_file.getvalue())
                 progress_text = "处理进度"
                 progress_bar = st.sidebar.progress(0, text=progress_text)
-                for i, page in enumerate(pdf.pages):
-                    text += page.extract_text() or ""
-                    progress_bar.progress((i + 1) / total_pages, text=f"{progress_text} {i+1}/{total_pages}")
-                progress_bar.empty() # 显式清空
-                progress_bar = None # 重置变量
-            if len(text.strip()) < 50:
-                st.sidebar.info("PDF可能是扫描件, 尝试OCR...")
-                uploaded_file.seek(0)
-                images = convert_from_bytes(uploaded_file.read())
-                total_images = len(images)
-                progress_text = "OCR进度"
-                progress_bar = st.sidebar.progress(0, text=progress_text)
-                for i, img in enumerate(images):
-                    text += pytesseract.image_to_string(img, lang='chi_sim+eng') + "\n"
-                    progress_bar.progress((i + 1) / total_images, text=f"{progress_text} {i+1}/{total_images}")
+                def update_progress(done, total): progress_bar.progress(done / total, text=f"{progress_text} {done}/{total}")
+                # 逐页路由: 文字页直接提取, 扫描页才 OCR (进程池并行, 按页序返回)
+                ocr_pages = []
+                for page in iter_pdf_pages(tmp_path, progress=update_progress):
+                    text += page["text"] + "\n"
+                    if page["ocr"]: ocr_pages.append(page["page"])
+                if ocr_pages: st.sidebar.info(f"PDF 共 {len(ocr_pages)} 页为扫描页, 已OCR识别")
                 progress_bar.empty() # 显式清空
                 progress_bar = None # 重置变量
+            finally:
+                os.remove(tmp_path)
         elif file_type == 'docx':
             text = docx2txt.process(io.BytesIO(uploaded_file.read()))
         else:
             st.sidebar.warning(f"不支持的文件类型: {file_type}")
             return f"不支持的文件类型: {file_type}" # 返回错误信息
+        if text.strip(): upload_cache.put_text(file_hash, text) # 缓存提取结果
         return text # 返回提取的文本
     except Exception as e:
         logger.error(f"文件处理失败 ({file_type}): {e}")
@@ -405,7 +405,7 @@ def init_session_state(): # 从 app.py 移动, 需要 QASystem
 
 def display_chat_messages(messages_key="messages"): # 新增通用聊天显示函数
     """显示聊天消息"""
-    for message in st.session_state.get(messages_key, []):
+    for index, message in enumerate(st.session_state.get(messages_key, [])):
         role = message["role"]
         content = message["content"]
         with st.chat_message(role):
@@ -423,11 +423,31 @@ def display_chat_messages(messages_key="messages"): # 新增通用聊天显示
                 elif isinstance(content, str): response_text = content
                 if rag_context_md:
                     with st.expander("📚 查看检索内容", expanded=False): st.markdown(rag_context_md)
+                elif isinstance(content, dict) and content.get("rag_query"): # 固定答案未做检索: 点击时再检索
+                    if st.button("📚 查看检索内容", key=f"rag_context_{messages_key}_{index}"):
+                        content["rag_context"] = st.session_state.system.get_rag_context(**content["rag_query"]) or "未找到相关内容"
+                        st.rerun()
                 st.markdown(response_text)
             else: st.markdown(content)
 
-def handle_chat_input(use_rag=False, messages_key="messages"): # 新增通用聊天输入处理函数
-    """处理用户输入并生成回复 (包含历史记录)"""
+def _session_alive():
+    """当前浏览器会话是否仍然存在 (会话关闭后进行中的生成随之取消)"""
+    try:
+        from streamlit.runtime import get_instance
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx, runtime = get_script_run_ctx(), get_instance()
+        if ctx is None or runtime is None: return lambda: True
+        session_id = ctx.session_id
+        return lambda: runtime.is_active_session(session_id)
+    except Exception: return lambda: True # 不同 Streamlit 版本的内部接口可能不同, 取不到时不做检查
+
+def cancel_generation(reason="cancelled"):
+    """取消本会话进行中的生成 (提交新问题、清空对话时调用)"""
+    token = st.session_state.get("generation_token")
+    if token is not None: token.cancel(reason)
+
+def handle_chat_input(use_rag=False, messages_key="messages", tenant_id=None): # 新增通用聊天输入处理函数
+    """处理用户输入并生成回复 (包含历史记录, tenant_id 指定检索的简历知识库)"""
     user_input = st.chat_input("请输入您的问题...")
     if user_input:
         # 1. 添加用户消息到状态
@@ -443,9 +463,15 @@ def handle_chat_input(use_rag=False, messages_key="messages"): # 新增通用聊
         history_to_pass = current_messages[-5:-1] 
         # logger.debug(f"传递的历史记录: {history_to_pass}") # 可选的调试日志
         
-        # 2. 获取助手回复 (传递历史)
+        # 2. 获取助手回复 (传递历史); 同一会话上一次未完成的生成不再需要, 先取消
+        cancel_generation("new input")
+        token = st.session_state.generation_token = CancellationToken(alive=_session_alive())
         final_response_content = None
         with st.chat_message("assistant"): 
+            queue_placeholder = st.empty() # 生成名额已满时显示排队位置
+            def show_queue_position(position):
+                if position: queue_placeholder.info(f"⏳ 当前使用人数较多，正在排队：第 {position} 位")
+                else: queue_placeholder.empty()
             with st.spinner("🤔 思考中..."): 
                 if 'system' not in st.session_state or st.session_state.system is None:
                     st.error("系统未初始化，请刷新页面。")
@@ -454,13 +480,24 @@ def handle_chat_input(use_rag=False, messages_key="messages"): # 新增通用聊
                 response = st.session_state.system.process_query(
                     user_input, 
                     history=history_to_pass, # 传递历史记录
-                    use_rag=use_rag
+                    use_rag=use_rag,
+                    tenant_id=tenant_id, # 当前会话上传的简历
+                    on_queue=show_queue_position,
+                    cancel_token=token
                 )
+                queue_placeholder.empty()
                 # --- 修改结束 ---
 
                 # 3. 处理并显示回复 (在助手气泡内)
                 display_text = ""
                 if isinstance(response, dict):
+                    if response.get("type") == "busy": # 排队已满: 提示稍后重试
+                        current_messages.pop() # 未处理的问题不计入对话历史
+                        st.warning(f"**⏳ {response['response']}**")
+                        st.stop()
+                    if response.get("type") == "cancelled": # 已被新问题或清空对话取代, 结果丢弃
+                        current_messages.pop()
+                        st.stop()
                     if "response" in response:
                         final_response_content = response
                         display_text = response["response"]
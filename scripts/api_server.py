@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""启动 OpenAI 兼容的本地 HTTP 接口 (/v1/chat/completions, /v1/retrieve, /v1/models, /health), 供非界面客户端与压测使用"""
+
+import os, sys, argparse
+# Add parent directory to sys.path to find src module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.utils import setup_logger
+from src.api_server import ApiServer
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="本地问答 HTTP 接口")
+    parser.add_argument("--host", type=str, default=None, help="监听地址 (默认 api_server.host)")
+    parser.add_argument("--port", type=int, default=None, help="端口 (默认 api_server.port)")
+    parser.add_argument("--workers", type=int, default=None, help="同时执行的问答请求数 (默认 api_server.workers)")
+    parser.add_argument("--max_queue", type=int, default=None, help="排队请求数上限 (默认 api_server.max_queue)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    logger = setup_logger('log')
+    overrides = {key: value for key, value in vars(args).items() if value is not None}
+    server = ApiServer(cfg=overrides)
+    try: server.serve_forever()
+    except KeyboardInterrupt: logger.info("HTTP 接口已停止")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""ANN 索引基准测试: 对比 flat / hnsw / ivfpq / sq8 / binary 的 recall@k、p50/p99 检索延迟与内存占用
+
+压缩索引 (ivfpq / sq8 / binary) 另外报告用原始向量精确重排后的 recall 与延迟 (与 VectorStore.search 的行为一致)。
+"""
+
+import os, sys, argparse
+# Add parent directory to sys.path to find src module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import numpy as np
+import faiss
+from src.utils import Config, setup_logger
+from src.vector_store import build_index, COMPRESSED_INDEX_TYPES
+from src.benchmark import Timer, summarize_latencies, save_report
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="ANN 索引 recall/延迟/内存 基准测试")
+    parser.add_argument("--num", type=int, default=20000, help="合成语料向量数 (模拟候选简历分块数)")
+    parser.add_argument("--dim", type=int, default=512, help="向量维度 (bge-small-zh 为 512)")
+    parser.add_argument("--queries", type=int, default=200, help="查询条数")
+    parser.add_argument("--k", type=int, default=10, help="recall@k 中的 k")
+    parser.add_argument("--types", type=str, default="flat,hnsw,ivfpq,sq8,binary", help="待测索引类型, 逗号分隔")
+    parser.add_argument("--ef_search", type=int, default=None, help="覆盖 HNSW efSearch")
+    parser.add_argument("--nprobe", type=int, default=None, help="覆盖 IVF nprobe")
+    parser.add_argument("--rescore_factor", type=int, default=None, help="覆盖压缩索引的重排倍数 (候选数 = k * 倍数)")
+    parser.add_argument("--threads", type=int, default=1, help="faiss OpenMP 线程数 (单查询延迟建议 1)")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--output", type=str, default=None, help="结果 JSON 输出路径")
+    return parser.parse_args()
+
+def make_corpus(num, dim, queries, seed):
+    """生成带聚类结构的合成向量 (比纯随机向量更接近真实嵌入分布)"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(num // 200, 8), dim)).astype('float32')
+    def sample(n):
+        return (centers[rng.integers(0, len(centers), n)] + 0.3 * rng.normal(size=(n, dim))).astype('float32')
+    return sample(num), sample(queries)
+
+def run_index(name, vectors, queries, k, index_cfg, ground_truth):
+    """构建并测试单个索引"""
+    with Timer() as build_timer:
+        index, effective_cfg = build_index(vectors, index_cfg)
+        index.add_with_ids(vectors, np.arange(len(vectors), dtype='int64'))
+    latencies, results = [], []
+    for q in queries:
+        with Timer() as t: _, ids = index.search(q.reshape(1, -1), k)
+        latencies.append(t.elapsed_ms)
+        results.append(ids[0])
+    recall_of = lambda found: float(np.mean([len(set(r) & set(gt)) / k for r, gt in zip(found, ground_truth)])) if ground_truth is not None else 1.0
+    index_bytes = faiss.serialize_index(index).nbytes
+    report = {
+        "type": name,
+        "effective_type": effective_cfg['type'],
+        "build_ms": round(build_timer.elapsed_ms, 1),
+        f"recall@{k}": round(recall_of(results), 4),
+        "latency": summarize_latencies(latencies),
+        "index_bytes": int(index_bytes),
+        "bytes_per_vector": round(index_bytes / len(vectors), 1),
+        "mb_per_million": round(index_bytes / len(vectors) * 1e6 / 1024 / 1024, 1) # 常驻内存 (不含 mmap 的原始向量)
+    }
+    factor = int(effective_cfg.get('rescore_factor', 0))
+    if effective_cfg['type'] in COMPRESSED_INDEX_TYPES and factor > 0:
+        rescored, rescore_latencies = [], []
+        for q in queries:
+            with Timer() as t:
+                _, ids = index.search(q.reshape(1, -1), k * factor)
+                candidates = ids[0][ids[0] != -1]
+                distances = ((vectors[candidates] - q) ** 2).sum(axis=1) # 对应从 mmap 的 vectors.npy 读取候选向量
+                found = candidates[np.argsort(distances)[:k]]
+            rescore_latencies.append(t.elapsed_ms)
+            rescored.append(found)
+        report.update({"rescore_factor": factor, f"recall@{k}_rescored": round(recall_of(rescored), 4),
+                       "latency_rescored": summarize_latencies(rescore_latencies),
+                       "rescore_bytes_per_query": k * factor * vectors.shape[1] * 4})
+        results = rescored
+    return report, results
+
+def main():
+    args = parse_args()
+    logger = setup_logger('log')
+    faiss.omp_set_num_threads(args.threads)
+    base_cfg = dict(Config().get('vector_db').get('index', {}))
+    if args.ef_search: base_cfg['ef_search'] = args.ef_search
+    if args.nprobe: base_cfg['nprobe'] = args.nprobe
+    if args.rescore_factor is not None: base_cfg['rescore_factor'] = args.rescore_factor
+    base_cfg.setdefault('rescore_factor', 4)
+    vectors, queries = make_corpus(args.num, args.dim, args.queries, args.seed)
+    logger.info(f"ANN 基准: {args.num} 条向量, {args.queries} 条查询, k={args.k}")
+
+    # 以 flat 精确检索结果为基准
+    flat_report, ground_truth = run_index("flat", vectors, queries, args.k, {**base_cfg, "type": "flat"}, None)
+    reports = [flat_report]
+    for index_type in [t.strip() for t in args.types.split(",") if t.strip() and t.strip() != "flat"]:
+        report, _ = run_index(index_type, vectors, queries, args.k, {**base_cfg, "type": index_type}, ground_truth)
+        reports.append(report)
+
+    flat_recall = reports[0][f'recall@{args.k}']
+    print(f"\n{'类型':<8}{'recall@'+str(args.k):>12}{'重排后':>10}{'差值':>9}{'p50(ms)':>10}{'p99(ms)':>10}{'内存(MB)':>10}{'B/向量':>10}{'MB/百万':>10}{'构建(ms)':>12}")
+    for r in reports:
+        recall = r.get(f'recall@{args.k}_rescored', r[f'recall@{args.k}'])
+        latency = r.get('latency_rescored', r['latency'])
+        r['recall_delta'] = round(recall - flat_recall, 4) # 相对 flat 精确检索 (重排后)
+        rescored = f"{r[f'recall@{args.k}_rescored']:>10.4f}" if f'recall@{args.k}_rescored' in r else f"{'-':>10}"
+        print(f"{r['type']:<8}{r[f'recall@{args.k}']:>12.4f}{rescored}{r['recall_delta']:>+9.4f}{latency['p50_ms']:>10.3f}{latency['p99_ms']:>10.3f}"
+              f"{r['index_bytes'] / 1024 / 1024:>10.1f}{r['bytes_per_vector']:>10.1f}{r['mb_per_million']:>10.1f}{r['build_ms']:>12.1f}")
+    if args.output:
+        save_report({"params": vars(args), "index_cfg": base_cfg, "results": reports}, args.output)
+        logger.info(f"结果已保存至: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""模型副本基准: 在本机上比较不同的 副本数 × 每副本线程数 组合, 选出吞吐最高的划分
+
+每种划分启动一个 ReplicaPool (每个副本绑定互不重叠的核), 以固定并发发送生成或嵌入请求,
+统计吞吐、p50/p99 延迟与各副本的常驻内存 (RSS/PSS); 最优划分可写入 config.json 的 replica_pool.replicas / threads_per_replica。
+"""
+
+import os, sys, json, argparse
+from concurrent.futures import ThreadPoolExecutor
+# Add parent directory to sys.path to find src module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.utils import setup_logger
+from src.benchmark import Timer, summarize_latencies, save_report
+from src.replica_pool import ReplicaPool, available_cores
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="模型副本数与线程划分基准")
+    parser.add_argument("--splits", type=str, default="auto", help="副本数x线程数, 逗号分隔 (如 1x8,2x4,4x2); auto 为 1,2,4... 个副本均分全部可用核")
+    parser.add_argument("--kind", type=str, default="generate", choices=["generate", "embed"], help="请求类型")
+    parser.add_argument("--requests", type=int, default=16, help="每种划分的计时请求数")
+    parser.add_argument("--concurrency", type=int, default=0, help="并发客户端数, 0 表示副本数 × 2")
+    parser.add_argument("--max_new_tokens", type=int, default=64, help="生成请求的最大新 token 数")
+    parser.add_argument("--embed_batch", type=int, default=8, help="每个嵌入请求的文本数")
+    parser.add_argument("--dataset", type=str, default=os.path.join("data", "dataset", "resume_dataset.json"), help="请求文本来源")
+    parser.add_argument("--output", type=str, default=None, help="结果 JSON 输出路径")
+    return parser.parse_args()
+
+def candidate_splits(spec, cores):
+    """[(副本数, 每副本线程数)]"""
+    if spec != "auto": return [tuple(int(n) for n in item.lower().split("x")) for item in spec.split(",") if item.strip()]
+    splits, replicas = [], 1
+    while replicas <= cores:
+        splits.append((replicas, cores // replicas))
+        replicas *= 2
+    return splits
+
+def load_queries(path):
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f: queries = [item["input"] for item in json.load(f) if item.get("input")]
+        if queries: return queries
+    return ["介绍一下你自己", "你做过哪些项目？", "你的技术栈是什么？", "你的教育背景如何？"]
+
+def process_memory_mb(pid):
+    """读取进程的常驻内存 RSS 与按比例分摊共享页后的 PSS (MB); 不支持 /proc 的平台返回 None"""
+    memory = {"rss_mb": None, "pss_mb": None}
+    for path, field, key in ((f"/proc/{pid}/status", "VmRSS:", "rss_mb"), (f"/proc/{pid}/smaps_rollup", "Pss:", "pss_mb")):
+        try:
+            with open(path, 'r') as f:
+                for line in f:
+                    if line.startswith(field):
+                        memory[key] = round(int(line.split()[1]) / 1024, 1) # kB
+                        break
+        except (OSError, ValueError): pass
+    return memory
+
+def run_split(replicas, threads, args, queries):
+    """启动一种划分的副本池并计时, 返回结果"""
+    with Timer() as startup:
+        pool = ReplicaPool({"enabled": True, "replicas": replicas, "threads_per_replica": threads, "embedding": args.kind == "embed"})
+    try:
+        def request(i):
+            if args.kind == "embed":
+                texts = [queries[(i * args.embed_batch + j) % len(queries)] for j in range(args.embed_batch)]
+                call = lambda: pool.embed_documents(texts)
+            else: call = lambda: pool.generate(queries[i % len(queries)], history=[], max_length=args.max_new_tokens)
+            with Timer() as timer: call()
+            return timer.elapsed_ms
+        concurrency = args.concurrency or replicas * 2
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(request, range(replicas))) # 预热: 每个副本一次
+            with Timer() as wall: latencies = list(executor.map(request, range(args.requests)))
+        per_replica = [{**replica, **process_memory_mb(replica["pid"])} for replica in pool.stats()] # 关闭前读取, 此时模型已加载
+        rss = [replica["rss_mb"] for replica in per_replica if replica["rss_mb"] is not None]
+        return {"replicas": replicas, "threads_per_replica": threads, "concurrency": concurrency, "startup_s": round(startup.elapsed_ms / 1000, 1),
+                "throughput_rps": round(args.requests / (wall.elapsed_ms / 1000), 3), **summarize_latencies(latencies),
+                "total_rss_mb": round(sum(rss), 1) if rss else None, "per_replica": per_replica}
+    finally:
+        pool.close()
+
+def main():
+    args = parse_args()
+    logger = setup_logger('log')
+    cores = len(available_cores())
+    queries = load_queries(args.dataset)
+    results = []
+    for replicas, threads in candidate_splits(args.splits, cores):
+        if replicas * threads > cores:
+            logger.warning(f"跳过 {replicas}x{threads}: 超过可用核数 {cores}")
+            continue
+        logger.info(f"测试划分 {replicas}x{threads} ({args.kind}, {args.requests} 个请求)")
+        try: results.append(run_split(replicas, threads, args, queries))
+        except Exception as e: logger.error(f"划分 {replicas}x{threads} 测试失败: {e}", exc_info=True)
+    if not results: return False
+
+    print(f"\n可用核数: {cores}, 请求类型: {args.kind}")
+    print(f"{'划分':>8} {'并发':>4} {'吞吐(req/s)':>12} {'p50(ms)':>10} {'p99(ms)':>10} {'启动(s)':>8} {'总RSS(MB)':>10}")
+    for r in results:
+        total_rss = f"{r['total_rss_mb']:.0f}" if r['total_rss_mb'] is not None else "-"
+        print(f"{r['replicas']}x{r['threads_per_replica']:<6} {r['concurrency']:>4} {r['throughput_rps']:>12.3f} {r['p50_ms']:>10.1f} {r['p99_ms']:>10.1f} {r['startup_s']:>8.1f} {total_rss:>10}")
+        for replica in r["per_replica"]:
+            print(f"    副本 {replica['index']} (pid={replica['pid']}, cores={replica['cores']}): RSS {replica['rss_mb']} MB, PSS {replica['pss_mb']} MB")
+    best = max(results, key=lambda r: r["throughput_rps"])
+    print(f"\n最优划分: replicas={best['replicas']}, threads_per_replica={best['threads_per_replica']} ({best['throughput_rps']:.3f} req/s)")
+    if args.output:
+        save_report({"cores": cores, "kind": args.kind, "requests": args.requests, "results": results,
+                     "best": {"replicas": best["replicas"], "threads_per_replica": best["threads_per_replica"]}}, args.output)
+        logger.info(f"结果已保存至: {args.output}")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
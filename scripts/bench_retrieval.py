@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""检索评测与延迟基准: 以 resume_dataset.json 的问答对为标注集, 评测 RAG.md 知识库的 recall@k、MRR、上下文 token 数
+以及嵌入、向量检索和完整 ResumeRAG.search() 的 p50/p99 延迟
+
+每个问题的相关分块按参考答案与分块的字符 bigram 覆盖率自动标注 (覆盖率 ≥ --relevance 的分块, 至少取覆盖率最高的一个)。
+知识库构建在临时目录中, 不影响已有数据; 切分与索引参数可通过命令行覆盖, 结果保存为 JSON 便于跨版本对比。
+"""
+
+import os, sys, json, shutil, argparse, tempfile
+# Add parent directory to sys.path to find src module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.utils import Config, setup_logger
+from src.benchmark import Timer, summarize_latencies, save_report, recall_at_k, reciprocal_rank
+from src.fixed_qa_index import normalize, char_ngrams
+
+BENCH_TENANT = "bench_retrieval"
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="ResumeRAG 检索评测与延迟基准")
+    parser.add_argument("--dataset", type=str, default=os.path.join("data", "dataset", "resume_dataset.json"), help="问答标注集")
+    parser.add_argument("--resume", type=str, default=os.path.join("data", "文本简历", "RAG.md"), help="被检索的简历文件")
+    parser.add_argument("--k", type=str, default="1,3,5", help="recall@k 的 k, 逗号分隔")
+    parser.add_argument("--context_k", type=int, default=3, help="统计上下文 token 数时的检索条数 (与问答默认 rag_k 一致)")
+    parser.add_argument("--relevance", type=float, default=0.5, help="参考答案 bigram 覆盖率达到该值的分块视为相关")
+    parser.add_argument("--repeat", type=int, default=3, help="每个问题的计时重复次数")
+    parser.add_argument("--warmup", type=int, default=3, help="预热查询数 (不计时)")
+    parser.add_argument("--chunk_size", type=int, default=None, help="覆盖 embedding.chunk_size")
+    parser.add_argument("--chunk_overlap", type=int, default=None, help="覆盖 embedding.chunk_overlap")
+    parser.add_argument("--chunker", type=str, default=None, help="覆盖 embedding.chunker (markdown / recursive)")
+    parser.add_argument("--embedding_model", type=str, default=None, help="覆盖 embedding.model_name")
+    parser.add_argument("--embedding_backend", type=str, default=None, help="覆盖 embedding.backend (torch / onnx)")
+    parser.add_argument("--index_type", type=str, default=None, help="覆盖 vector_db.index.type (flat / hnsw / ivfpq)")
+    parser.add_argument("--tokenizer", type=str, default=None, help="统计 token 数的分词器 (默认 model.path, 加载失败时按字符数统计)")
+    parser.add_argument("--output", type=str, default=None, help="结果 JSON 输出路径")
+    return parser.parse_args()
+
+def load_gold_set(path):
+    """读取问答对 (问题, 参考答案)"""
+    with open(path, 'r', encoding='utf-8') as f: data = json.load(f)
+    return [(item["input"], item["output"]) for item in data if item.get("input") and item.get("output")]
+
+def label_relevant(answer, chunks, threshold):
+    """参考答案的字符 bigram 被分块覆盖的比例 ≥ threshold 的分块下标 (至少包含覆盖率最高的分块)"""
+    answer_grams = set(char_ngrams(normalize(answer), 2))
+    if not answer_grams: return set()
+    coverage = [len(answer_grams & set(char_ngrams(normalize(chunk), 2))) / len(answer_grams) for chunk in chunks]
+    best = max(range(len(chunks)), key=coverage.__getitem__)
+    return {i for i, c in enumerate(coverage) if c >= threshold} | {best}
+
+def make_token_counter(name):
+    """返回 (计数函数, 分词器名称); 分词器不可用时按字符数统计"""
+    try:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(name)
+        return (lambda text: len(tokenizer.encode(text, add_special_tokens=False))), name
+    except Exception:
+        return len, "chars"
+
+def main():
+    args = parse_args()
+    logger = setup_logger('log')
+    ks = sorted({int(k) for k in args.k.split(",") if k.strip()})
+    max_k = max(ks + [args.context_k])
+
+    # 覆盖配置后再初始化 ResumeRAG, 知识库写入临时目录
+    cfg = Config().get()
+    tmp_root = tempfile.mkdtemp(prefix="bench_retrieval_")
+    cfg['vector_db']['tenants_dir'] = tmp_root
+    if args.chunk_size: cfg['embedding']['chunk_size'] = args.chunk_size
+    if args.chunk_overlap is not None: cfg['embedding']['chunk_overlap'] = args.chunk_overlap
+    if args.chunker: cfg['embedding']['chunker'] = args.chunker
+    if args.embedding_model: cfg['embedding']['model_name'] = args.embedding_model
+    if args.embedding_backend: cfg['embedding']['backend'] = args.embedding_backend
+    if args.index_type: cfg['vector_db'].setdefault('index', {})['type'] = args.index_type
+    cfg.setdefault('upload_cache', {})['enabled'] = False # 每次都实际切分和嵌入
+
+    from src.resume_rag import ResumeRAG
+    from src.chunking import split_text
+    rag = None
+    try:
+        rag = ResumeRAG()
+        with open(args.resume, 'r', encoding='utf-8') as f: text = f.read()
+        with Timer() as build_timer:
+            if not rag.build_knowledge_base(text, tenant_id=BENCH_TENANT): raise RuntimeError("知识库构建失败")
+        store = rag.registry.get(BENCH_TENANT, rag.embeddings)
+        chunks = [doc.page_content for doc in split_text(text, embedding_cfg=rag.embedding_cfg)] # 与构建时相同的切分
+        chunk_ids = {content: i for i, content in enumerate(chunks)}
+        gold = load_gold_set(args.dataset)
+        count_tokens, tokenizer_name = make_token_counter(args.tokenizer or cfg['model']['path'])
+        logger.info(f"检索评测: {len(gold)} 个问题, {len(chunks)} 个分块, k={ks}, 分词器={tokenizer_name}")
+
+        for question, _ in gold[:args.warmup]: rag.search(question, k=max_k, tenant_id=BENCH_TENANT)
+
+        embed_ms, search_ms, full_ms = [], [], []
+        recalls = {k: [] for k in ks}
+        rr, context_tokens, relevant_counts, per_query = [], [], [], []
+        for question, answer in gold:
+            relevant = label_relevant(answer, chunks, args.relevance)
+            for _ in range(max(1, args.repeat)):
+                with Timer() as t: vector = rag.embed_query(question)
+                embed_ms.append(t.elapsed_ms)
+                with Timer() as t: results = store.search(vector, k=max_k)
+                search_ms.append(t.elapsed_ms)
+                with Timer() as t: rag.search(question, k=max_k, tenant_id=BENCH_TENANT)
+                full_ms.append(t.elapsed_ms)
+            retrieved = [chunk_ids.get(doc.page_content, -1) for doc, _ in results]
+            for k in ks: recalls[k].append(recall_at_k(retrieved, relevant, k))
+            rr.append(reciprocal_rank(retrieved, relevant))
+            context_tokens.append(count_tokens("\n".join(doc.page_content for doc, _ in results[:args.context_k])))
+            relevant_counts.append(len(relevant))
+            per_query.append({"question": question, "relevant": sorted(relevant), "retrieved": retrieved})
+
+        mean = lambda values: round(sum(values) / len(values), 4) if values else 0.0
+        report = {
+            "params": vars(args),
+            "embedding": rag.embedding_cfg,
+            "index": store.meta.get("index", rag.index_cfg),
+            "chunks": len(chunks),
+            "questions": len(gold),
+            "build_ms": round(build_timer.elapsed_ms, 1),
+            "quality": {**{f"recall@{k}": mean(recalls[k]) for k in ks}, "mrr": mean(rr), "relevant_per_query": mean(relevant_counts)},
+            "context_tokens": {"tokenizer": tokenizer_name, "k": args.context_k, "mean": mean(context_tokens),
+                               "max": max(context_tokens) if context_tokens else 0},
+            "latency": {"embed": summarize_latencies(embed_ms), "search": summarize_latencies(search_ms), "full_search": summarize_latencies(full_ms)},
+            "embedding_service": rag.embeddings.stats(),
+            "per_query": per_query
+        }
+    finally:
+        if rag is not None: rag.registry.evict(BENCH_TENANT)
+        shutil.rmtree(tmp_root, ignore_errors=True)
+
+    print(f"\n分块: {report['chunks']}, 问题: {report['questions']}, 每题相关分块: {report['quality']['relevant_per_query']}")
+    print("  ".join(f"recall@{k}={report['quality'][f'recall@{k}']:.4f}" for k in ks) + f"  MRR={report['quality']['mrr']:.4f}")
+    print(f"上下文 token (top-{args.context_k}, {tokenizer_name}): 平均 {report['context_tokens']['mean']}, 最大 {report['context_tokens']['max']}")
+    print(f"{'阶段':<14}{'p50(ms)':>10}{'p99(ms)':>10}{'平均(ms)':>10}")
+    for name, stats in report["latency"].items():
+        print(f"{name:<14}{stats['p50_ms']:>10.3f}{stats['p99_ms']:>10.3f}{stats['mean_ms']:>10.3f}")
+    if args.output:
+        save_report(report, args.output)
+        logger.info(f"结果已保存至: {args.output}")
+
+if __name__ == "__main__":
+    main()
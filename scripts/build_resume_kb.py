@@ -1,83 +1,28 @@
-import os
-import json
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""手动构建简历知识库 (基于 data/文本简历/RAG.md, 写入默认向量库)"""
+
+import os, sys, argparse
 # Add parent directory to sys.path to find src module
-import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from src.utils import Config, setup_logger
-from langchain.retrievers import BM25Retriever, EnsembleRetriever
-
-# 初始化配置和日志
-cfg = Config()
-logger = setup_logger('log')
-
-# 读取简历内容 (adjust path relative to parent dir)
-resume_file_path = os.path.join("..", "RAG.md")
-with open(resume_file_path, "r", encoding="utf-8") as f:
-    resume_text = f.read()
-
-# 文本分块
-text_splitter = CharacterTextSplitter(
-    separator="\n## ",  # 按大标题分割
-    chunk_size=500,
-    chunk_overlap=100,
-    length_function=len
-)
-
-# 一级分割
-main_chunks = text_splitter.split_text("## " + resume_text)
-
-# 细粒度分割
-text_splitter = CharacterTextSplitter(
-    separator="\n",
-    chunk_size=200,
-    chunk_overlap=50,
-    length_function=len
-)
-chunks = []
-for chunk in main_chunks:
-    chunks.extend(text_splitter.split_text(chunk))
-
-logger.info(f"简历共分割为 {len(chunks)} 个文本块")
-
-# 嵌入向量化
-embeddings = HuggingFaceEmbeddings(
-    model_name=cfg.get('embedding')['model_name'],
-    model_kwargs={'device': 'cpu'}
-)
-
-# 创建向量存储库 (adjust path relative to parent dir)
-vector_store_path_relative = cfg.get('vector_db')['path']
-vector_store_path = os.path.join("..", vector_store_path_relative)
-os.makedirs(vector_store_path, exist_ok=True)
-
-# 构建向量索引
-vector_store = FAISS.from_texts(chunks, embeddings)
-vector_store.save_local(vector_store_path)
-
-# 保存原始文本块以便跟踪
-with open(os.path.join(vector_store_path, "resume_chunks.json"), "w", encoding="utf-8") as f:
-    json.dump(chunks, f, ensure_ascii=False, indent=2)
-
-logger.info(f"简历知识库已创建并保存到 {vector_store_path}")
-
-# 在检索时混合使用关键词和向量检索
-
-# 关键词检索器
-bm25_retriever = BM25Retriever.from_texts(chunks)
-bm25_retriever.k = 5
-
-# 向量检索器
-vector_retriever = vector_store.as_retriever(search_kwargs={"k": 5})
+from src.ingest import IngestPipeline
 
-# 混合检索器
-ensemble_retriever = EnsembleRetriever(
-    retrievers=[bm25_retriever, vector_retriever],
-    weights=[0.3, 0.7]
-)
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="构建简历知识库")
+    parser.add_argument("--resume", type=str, default=os.path.join("data", "文本简历", "RAG.md"), help="简历 Markdown 文件路径")
+    parser.add_argument("--output", type=str, default=None, help="向量库输出目录 (默认 vector_db.path)")
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
     logger = setup_logger('log')
-    logger.info("开始构建简历知识库")
\ No newline at end of file
+    logger.info("开始构建简历知识库")
+    output = args.output or Config().get('vector_db')['path']
+    store = IngestPipeline(output, workers=1).run([args.resume], fresh=True)
+    if store: logger.info(f"简历知识库已创建并保存到 {output}")
+    return store is not None
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
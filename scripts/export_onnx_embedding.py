@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""导出嵌入模型为 ONNX (int8 动态量化) 并与 PyTorch 输出做一致性校验
+
+校验文本为简历分块与问答集中的问题; 最小余弦相似度低于 --min_cosine 时返回非零退出码。
+导出产物缓存在 embedding.onnx_dir 下, config.json 中设置 embedding.backend 为 "onnx" 后运行时直接使用。
+"""
+
+import os, sys, json, argparse
+# Add parent directory to sys.path to find src module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.utils import Config, setup_logger
+from src.benchmark import save_report
+from src.chunking import split_text
+from src.onnx_embeddings import OnnxEmbeddings, export_onnx, artifact_dir, parity_check
+
+def parse_args():
+    """解析命令行参数"""
+    embedding_cfg = Config().get('embedding')
+    parser = argparse.ArgumentParser(description="导出 ONNX int8 嵌入模型并校验一致性")
+    parser.add_argument("--model", type=str, default=embedding_cfg['model_name'], help="嵌入模型 (默认 embedding.model_name)")
+    parser.add_argument("--output_dir", type=str, default=embedding_cfg.get('onnx_dir', 'models/onnx'), help="产物缓存根目录")
+    parser.add_argument("--no_quantize", action="store_true", help="只导出 fp32 ONNX, 不做 int8 量化")
+    parser.add_argument("--force", action="store_true", help="已有产物时也重新导出")
+    parser.add_argument("--resume", type=str, default=os.path.join("data", "文本简历", "RAG.md"), help="校验用的简历文件")
+    parser.add_argument("--dataset", type=str, default=os.path.join("data", "dataset", "resume_dataset.json"), help="校验用的问答集")
+    parser.add_argument("--min_cosine", type=float, default=0.99, help="允许的最小余弦相似度")
+    parser.add_argument("--output", type=str, default=None, help="校验结果 JSON 输出路径")
+    return parser.parse_args()
+
+def load_texts(resume_path, dataset_path):
+    """校验文本: 简历分块 + 问题"""
+    texts = []
+    if os.path.exists(resume_path):
+        with open(resume_path, 'r', encoding='utf-8') as f: texts.extend(doc.page_content for doc in split_text(f.read()))
+    if os.path.exists(dataset_path):
+        with open(dataset_path, 'r', encoding='utf-8') as f: texts.extend(item["input"] for item in json.load(f) if item.get("input"))
+    return texts or ["简历知识库一致性校验"]
+
+def main():
+    args = parse_args()
+    logger = setup_logger('log')
+    path = artifact_dir(args.model, args.output_dir)
+    quantize = not args.no_quantize
+    if args.force: export_onnx(args.model, path, quantize=quantize)
+    candidate = OnnxEmbeddings.load_or_export(args.model, args.output_dir, quantize=quantize)
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+    reference = HuggingFaceEmbeddings(model_name=args.model, model_kwargs={'device': 'cpu'})
+    texts = load_texts(args.resume, args.dataset)
+    reference.embed_documents(texts[:4]) # 预热
+    candidate.embed_documents(texts[:4])
+    report = {"model": args.model, "artifact": path, **candidate.meta, **parity_check(reference, candidate, texts)}
+    sizes = {name: os.path.getsize(os.path.join(path, name)) for name in ("model.onnx", "model.int8.onnx") if os.path.exists(os.path.join(path, name))}
+    report["size_mb"] = {name: round(size / 1024 / 1024, 1) for name, size in sizes.items()}
+
+    print(f"\n产物: {path} ({report['file']}, {', '.join(f'{k}={v}MB' for k, v in report['size_mb'].items())})")
+    print(f"文本数: {report['texts']}, 最小余弦相似度: {report['min_cosine']:.6f}, 平均: {report['mean_cosine']:.6f}")
+    print(f"耗时: PyTorch {report['reference_ms']:.1f}ms, ONNX {report['candidate_ms']:.1f}ms, 加速 {report['speedup']:.2f}x")
+    if args.output:
+        save_report(report, args.output)
+        logger.info(f"结果已保存至: {args.output}")
+    if report["min_cosine"] < args.min_cosine:
+        logger.error(f"一致性校验未通过: 最小余弦相似度 {report['min_cosine']:.6f} < {args.min_cosine}")
+        return False
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""批量流式入库脚本: 从目录或数据集文件构建简历向量库 (支持断点续传)"""
+
+import os, sys, argparse
+# Add parent directory to sys.path to find src module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.utils import Config, setup_logger
+from src.ingest import IngestPipeline
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="简历语料批量入库")
+    parser.add_argument("sources", nargs="+", help="数据源: 目录 (txt/md/pdf/docx) 或 data/dataset/resume_dataset.{csv,json}")
+    parser.add_argument("--output", type=str, default=None, help="向量库输出目录 (默认 vector_db.path)")
+    parser.add_argument("--batch_docs", type=int, default=64, help="每批解析的文档数")
+    parser.add_argument("--workers", type=int, default=None, help="解析进程数 (默认 CPU 核数)")
+    parser.add_argument("--embed_batch_size", type=int, default=32, help="每次提交给嵌入服务的分块数 (单次前向的批大小由 embedding_service.max_batch_size 决定)")
+    parser.add_argument("--shard_chunks", type=int, default=5000, help="每个分片的分块数 (断点粒度)")
+    parser.add_argument("--fresh", action="store_true", help="忽略已有断点, 重新入库")
+    parser.add_argument("--keep_shards", action="store_true", help="合并后保留分片与断点目录")
+    return parser.parse_args()
+
+def main():
+    """主函数"""
+    args = parse_args()
+    logger = setup_logger('log')
+    output = args.output or Config().get('vector_db')['path']
+    logger.info(f"开始批量入库: {args.sources} -> {output}")
+    pipeline = IngestPipeline(
+        output, batch_docs=args.batch_docs, workers=args.workers,
+        shard_chunks=args.shard_chunks, embed_batch_size=args.embed_batch_size
+    )
+    store = pipeline.run(args.sources, fresh=args.fresh, keep_shards=args.keep_shards)
+    return store is not None
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
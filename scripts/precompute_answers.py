@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""离线预计算常见问题的回答 (来源见 config.json 的 answer_store.sources)"""
+
+import os, sys, argparse
+# Add parent directory to sys.path to find src module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.utils import setup_logger
+from src.qa_system import QASystem
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="预计算常见问题的回答")
+    parser.add_argument("--force", action="store_true", help="模型与知识库未变化时也重新生成")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    logger = setup_logger('log')
+    system = QASystem()
+    logger.info("开始预计算常见问题的回答")
+    return system.answers.precompute(system, progress=lambda fraction, message="": logger.info(f"[{fraction:.0%}] {message}"), force=args.force)
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""启动独立的检索服务: 本进程持有嵌入模型与向量库, 应用进程在 config.json 中启用 retrieval_service 后通过本地 socket 检索"""
+
+import os, sys, argparse
+# Add parent directory to sys.path to find src module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.utils import setup_logger
+from src.retrieval_service import RetrievalServer
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="ResumeRAG 检索服务")
+    parser.add_argument("--address", type=str, default=None, help="监听地址, host:port 或 unix:<socket 路径> (默认 retrieval_service.address)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    logger = setup_logger('log')
+    server = RetrievalServer(args.address)
+    try: server.serve_forever()
+    except KeyboardInterrupt: logger.info("检索服务已停止")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,157 @@
+import time, heapq, itertools, threading, contextvars
+from contextlib import contextmanager
+from typing import Optional, Dict, List, Callable, Iterator, Any
+from src.utils import Config, setup_logger
+from src.cancellation import CancellationToken, current_token
+
+DEFAULT_ADMISSION_CFG = {
+    "enabled": True,
+    "max_concurrent": 2,   # 同时执行的模型生成数 (共享同一个本地模型, 过多并发只会让每个请求都变慢)
+    "max_queue": 8,        # 排队等待的生成请求上限, 超出时立即返回繁忙
+    "queue_timeout": 60    # 排队等待的最长时间 (秒), 超时按繁忙处理
+}
+
+# 优先级 (数值小的先执行): 短回答 (天气提示等) 在前, 长 RAG 回答在后, 后台任务 (预计算回答) 最后
+PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW, PRIORITY_BACKGROUND = 0, 1, 2, 3
+
+class ServerBusyError(Exception):
+    """执行与排队名额已满 (或排队超时)，请求被拒绝"""
+
+    def __init__(self, message: str = "当前使用人数较多，请稍后重试", retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+_request_options: "contextvars.ContextVar[Dict[str, Any]]" = contextvars.ContextVar("admission_request_options", default={})
+
+@contextmanager
+def request_options(**options: Any) -> Iterator[None]:
+    """为当前调用链上的生成请求设置排队选项
+
+    on_position: 排队位置回调 (位置从 1 开始, 获得执行名额时回调 0); priority: 覆盖默认优先级;
+    shed: False 时队列已满也继续等待 (后台任务使用)。
+    """
+    token = _request_options.set({**_request_options.get(), **{key: value for key, value in options.items() if value is not None}})
+    try: yield
+    finally: _request_options.reset(token)
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "granted")
+
+    def __init__(self, priority: int, seq: int):
+        self.priority, self.seq, self.granted = priority, seq, False
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class AdmissionController:
+    """并发上限 + 有界优先级队列: 执行名额已满的请求按优先级 (同级按到达顺序) 排队, 队列已满时立即拒绝
+
+    名额释放时直接交给队首请求, 新到达的请求不能插队; 被接纳的请求延迟可预期, 而不是所有人一起变慢。
+    AdmissionController.shared() 返回按 admission 配置创建的进程内共享实例 (模型生成使用), 未启用时为 None。
+    """
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: Optional[float] = None):
+        self.max_concurrent, self.max_queue = max(1, int(max_concurrent)), max(0, int(max_queue))
+        self.queue_timeout = float(queue_timeout) if queue_timeout else None
+        self.logger = setup_logger('log')
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._stats = {"admitted": 0, "waited": 0, "rejected": 0, "timeouts": 0, "wait_s": 0.0}
+
+    @classmethod
+    def shared(cls) -> Optional["AdmissionController"]:
+        with cls._shared_lock:
+            if cls._shared is None:
+                cfg = {**DEFAULT_ADMISSION_CFG, **(Config().get().get('admission') or {})}
+                if not cfg['enabled']: return None
+                cls._shared = cls(cfg['max_concurrent'], cfg['max_queue'], cfg['queue_timeout'])
+            return cls._shared
+
+    def saturated(self) -> bool:
+        """执行名额与排队名额都已满 (新请求会被拒绝), 用于在检索等前置工作之前提前拒绝"""
+        with self._cond: return self._active >= self.max_concurrent and len(self._waiting) >= self.max_queue
+
+    def acquire(self, priority: int = PRIORITY_NORMAL, timeout: Optional[float] = None, on_position: Optional[Callable[[int], None]] = None,
+                shed: bool = True, cancel_token: Optional[CancellationToken] = None) -> None:
+        """获取执行名额, 需要排队时阻塞; 队列已满或等待超时抛出 ServerBusyError (shed=False 时不拒绝也不超时)
+
+        排队期间 cancel_token 被取消或超过截止时间时离开队列, 抛出 GenerationCancelled / DeadlineExceeded。
+        """
+        timeout = self.queue_timeout if timeout is None else timeout
+        with self._cond:
+            if self._active < self.max_concurrent and not self._waiting:
+                self._active += 1
+                self._stats["admitted"] += 1
+                return
+            if shed and len(self._waiting) >= self.max_queue:
+                self._stats["rejected"] += 1
+                raise ServerBusyError()
+            waiter = _Waiter(priority, next(self._seq))
+            heapq.heappush(self._waiting, waiter)
+        remove = cancel_token.on_cancel(self._wake) if cancel_token is not None else (lambda: None)
+        start, last_position = time.monotonic(), None
+        deadline = start + timeout if timeout and shed else None
+        try:
+            while True:
+                with self._cond:
+                    if waiter.granted: break
+                    remaining = deadline - time.monotonic() if deadline else None
+                    if remaining is not None and remaining <= 0:
+                        self._leave(waiter)
+                        self._stats["timeouts"] += 1
+                        raise ServerBusyError("排队等待超时，请稍后重试")
+                    if cancel_token is not None and cancel_token.should_stop():
+                        self._leave(waiter)
+                        cancel_token.raise_if_stopped()
+                    position = 1 + sum(1 for other in self._waiting if other < waiter)
+                    if position == last_position or on_position is None:
+                        self._cond.wait(min(remaining, 1.0) if remaining is not None else 1.0)
+                        continue
+                last_position = position
+                self._notify(on_position, position) # 在锁外回调 (界面渲染可能较慢)
+        finally: remove() # 离开队列后注销唤醒回调
+        with self._cond:
+            self._stats["waited"] += 1
+            self._stats["wait_s"] += time.monotonic() - start
+        if on_position: self._notify(on_position, 0)
+
+    def _leave(self, waiter: _Waiter) -> None:
+        self._waiting.remove(waiter)
+        heapq.heapify(self._waiting)
+
+    def _wake(self) -> None:
+        with self._cond: self._cond.notify_all()
+
+    def release(self) -> None:
+        """释放执行名额: 有请求排队时直接交给优先级最高的请求"""
+        with self._cond:
+            if self._waiting:
+                heapq.heappop(self._waiting).granted = True
+                self._stats["admitted"] += 1
+                self._cond.notify_all()
+            else: self._active -= 1
+
+    @contextmanager
+    def admit(self, priority: int = PRIORITY_NORMAL) -> Iterator[None]:
+        """在执行名额内运行 (排队选项取自 request_options, 取消令牌取自 cancellation_scope)"""
+        options = _request_options.get()
+        self.acquire(options.get("priority", priority), on_position=options.get("on_position"), shed=options.get("shed", True), cancel_token=current_token())
+        try: yield
+        finally: self.release()
+
+    def _notify(self, callback: Callable[[int], None], position: int) -> None:
+        try: callback(position)
+        except Exception as e: self.logger.error(f"排队位置回调失败: {e}", exc_info=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = dict(self._stats)
+            active, queued = self._active, len(self._waiting)
+        waited = stats["waited"]
+        return {"active": active, "queued": queued, "max_concurrent": self.max_concurrent, "max_queue": self.max_queue,
+                **{key: stats[key] for key in ("admitted", "waited", "rejected", "timeouts")},
+                "avg_queue_wait_ms": round(stats["wait_s"] * 1000 / waited, 3) if waited > 0 else 0.0}
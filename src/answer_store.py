@@ -0,0 +1,218 @@
+import os, json, time, hashlib, threading
+from typing import Optional, Dict, List, Tuple, Callable, Any
+from src.utils import Config, setup_logger
+from src.fixed_qa_index import normalize
+from src.admission import request_options, PRIORITY_BACKGROUND
+
+DEFAULT_ANSWER_STORE_CFG = {
+    "enabled": True,
+    "path": "data/answer_store/answers.json",
+    "threshold": 0.92,          # 问题向量余弦相似度阈值
+    "rag_k": 3,                 # 预计算 RAG 回答时的检索条数
+    "tenant_id": None,          # 预计算回答对应的知识库 (默认知识库)
+    "auto_regenerate": True,    # 模型或知识库变化后在后台任务中重新生成
+    "check_interval": 1.0,      # 检查文件是否变化的最小间隔 (秒)
+    "sources": {                # 问题来源 → 回答方式 (rag: 检索后生成, general: 通用生成, fixed: 使用固定答案)
+        "data/dataset/resume_dataset.json": "rag",
+        "data/train_examples.json": "general",
+        "src/fixed_qa.json": "fixed"
+    }
+}
+
+def _is_tool_call(output: Any) -> bool:
+    """训练样例的输出是否为工具调用 (如天气查询, 结果随时间变化, 不能预计算)"""
+    try: return isinstance(output, str) and "function" in json.loads(output)
+    except (ValueError, TypeError): return False
+
+def questions_key(questions: List[Tuple[str, str, Optional[str]]]) -> str:
+    """问题集合 (含模式与固定答案) 的摘要, 问题来源变化时改变"""
+    return hashlib.sha256(json.dumps(questions, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def collect_questions(sources: Dict[str, str]) -> List[Tuple[str, str, Optional[str]]]:
+    """从问题来源收集 (问题, 模式, 固定答案)，按归一化问题去重 (先出现的优先)"""
+    questions, seen = [], set()
+    def add(question: str, mode: str, answer: Optional[str] = None) -> None:
+        norm = normalize(question or "")
+        if norm and norm not in seen:
+            seen.add(norm)
+            questions.append((question, mode, answer))
+    for path, mode in sources.items():
+        if not os.path.exists(path): continue
+        with open(path, 'r', encoding='utf-8') as f: data = json.load(f)
+        if mode == "fixed":
+            for item in data.get("fixed_answers", []):
+                for question in item.get("questions", []): add(question, mode, item.get("answer"))
+        else:
+            for example in data:
+                if mode == "general" and _is_tool_call(example.get("output")): continue
+                add(example.get("input"), mode)
+    return questions
+
+class AnswerStore:
+    """离线预计算回答: 对已知的常见问题批量生成回答并保存问题向量，查询时按向量近邻直接返回
+
+    回答记录生成时的模型路径、嵌入模型和知识库内容版本 (指纹)。通用回答只依赖模型, RAG 回答还依赖知识库版本;
+    依赖变化后相应的回答不再使用, 并提交后台任务只重新生成这部分 (其余回答沿用)。
+    RAG 回答只用于无对话历史的查询; 固定答案只在 RAG 模式下返回 (通用问答不返回简历内容)。
+    """
+
+    def __init__(self, cfg: Optional[Dict[str, Any]] = None, embeddings: Any = None):
+        self.cfg = {**DEFAULT_ANSWER_STORE_CFG, **(cfg or {})}
+        self.path = self.cfg["path"]
+        self.tenant_id = self.cfg["tenant_id"]
+        self.embeddings = embeddings
+        self.logger = setup_logger('log')
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self._state = None # (指纹, 条目列表, 精确查找表, 问题向量, 问题集合摘要), 重新加载时整体替换
+        self._submitted = None # 最近一次提交重新生成时的指纹, 避免重复提交
+        if self.cfg["enabled"]: self.reload()
+
+    def __len__(self) -> int:
+        return len(self._state[1]) if self._state else 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.cfg["enabled"]) and self._state is not None
+
+    def reload(self) -> bool:
+        """从磁盘加载预计算回答，返回是否成功"""
+        try:
+            if not os.path.exists(self.path):
+                self._state, self._mtime = None, None
+                return False
+            import numpy as np
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, 'r', encoding='utf-8') as f: data = json.load(f)
+            entries = data.get("answers", [])
+            exact = {}
+            for i, entry in enumerate(entries): exact.setdefault(normalize(entry["question"]), i)
+            vectors = np.asarray([entry["vector"] for entry in entries], dtype='float32') if entries else None
+            for entry in entries: del entry["vector"] # 向量只保留在矩阵中
+            self._state, self._mtime = (data.get("fingerprint", {}), entries, exact, vectors, data.get("questions_key")), mtime
+            self.logger.info(f"成功加载预计算回答: {self.path}, {len(entries)} 条")
+            return True
+        except Exception as e:
+            self.logger.error(f"加载预计算回答失败: {e}", exc_info=True)
+            return False
+
+    def _maybe_reload(self) -> None:
+        """距上次检查超过 check_interval 且文件 mtime 变化时重新加载"""
+        now = time.monotonic()
+        if now - self._checked_at < float(self.cfg["check_interval"]): return
+        with self._lock:
+            if now - self._checked_at < float(self.cfg["check_interval"]): return
+            self._checked_at = now
+            try: mtime = os.path.getmtime(self.path)
+            except OSError: mtime = None
+            if mtime != self._mtime: self.reload()
+
+    # --- 指纹 ---
+    @staticmethod
+    def fingerprint(system: Any, tenant_id: Optional[str] = None) -> Dict[str, Any]:
+        """当前模型路径、嵌入模型与知识库内容版本"""
+        cfg = Config()
+        return {"model": cfg.get('model').get('path'), "embedding": cfg.get('embedding').get('model_name'),
+                "generation": system.resume_rag.generation(tenant_id)}
+
+    @staticmethod
+    def _usable(fingerprint: Dict[str, Any], mode: str, current: Dict[str, Any]) -> bool:
+        """固定答案始终可用; 通用回答要求模型一致; RAG 回答还要求知识库版本一致"""
+        if mode == "fixed": return True
+        if fingerprint.get("model") != current["model"]: return False
+        return mode == "general" or fingerprint.get("generation") == current["generation"]
+
+    def is_stale(self, current: Dict[str, Any]) -> bool:
+        """有回答因依赖变化而不可用: 模型或嵌入模型变化; 或知识库版本变化且有 RAG 问题来源 (与 _usable 的规则一致)"""
+        state = self._state
+        if state is None: return False
+        saved = state[0]
+        if saved.get("model") != current["model"] or saved.get("embedding") != current["embedding"]: return True
+        return saved.get("generation") != current["generation"] and "rag" in self.cfg["sources"].values()
+
+    def schedule_refresh(self, system: Any, current: Dict[str, Any]) -> Optional[str]:
+        """指纹变化后提交后台重新生成任务 (同一指纹只提交一次)，返回 job_id"""
+        if not self.cfg["auto_regenerate"] or current == self._submitted: return None
+        from src.kb_jobs import KnowledgeBaseJobQueue
+        self._submitted = current
+        self.logger.info(f"预计算回答已过期 (当前: {current})，提交后台重新生成")
+        return KnowledgeBaseJobQueue().submit(self.tenant_id, lambda progress: self.precompute(system, progress=progress),
+                                              description="等待重新生成预计算回答", kind="answers")
+
+    # --- 查询 ---
+    def match(self, query: str, mode: str, current: Dict[str, Any], query_vector: Any = None) -> Optional[Dict[str, Any]]:
+        """匹配预计算回答 (mode: rag / general)，返回 {"answer", "question", "score"}，未命中或已过期返回 None
+
+        先按归一化问题精确查找; 给出 query_vector 时再做向量近邻匹配 (要求嵌入模型与生成时一致)。
+        """
+        self._maybe_reload()
+        state = self._state
+        if not state or state[3] is None: return None
+        fingerprint, entries, exact, vectors, _ = state
+        modes = (mode, "fixed") if mode == "rag" else (mode,) # 固定答案是简历内容, 只用于 RAG 模式
+        qid = exact.get(normalize(query))
+        score = 1.0
+        if qid is None:
+            if query_vector is None or fingerprint.get("embedding") != current["embedding"]: return None
+            import numpy as np
+            vector = np.asarray(query_vector, dtype='float32')
+            similarities = vectors @ (vector / max(float(np.linalg.norm(vector)), 1e-12))
+            for i in similarities.argsort()[::-1]: # 按相似度取第一个模式相符且未过期的条目
+                if similarities[i] < float(self.cfg["threshold"]): return None
+                if entries[i]["mode"] in modes and self._usable(fingerprint, entries[i]["mode"], current):
+                    qid, score = int(i), float(similarities[i])
+                    break
+            if qid is None: return None
+        entry = entries[qid]
+        if entry["mode"] not in modes or not self._usable(fingerprint, entry["mode"], current): return None
+        return {"answer": entry["answer"], "question": entry["question"], "score": score}
+
+    # --- 离线生成 ---
+    def precompute(self, system: Any, progress: Optional[Callable[[float, str], None]] = None, force: bool = False) -> bool:
+        """对所有来源的问题生成回答并写入磁盘 (force 强制全部重新生成)
+
+        依赖未变化的已有回答直接沿用 (如知识库增量更新后只重新生成 RAG 回答); 问题来源与依赖都未变化时跳过。
+        """
+        report = progress or (lambda fraction, message="": None)
+        try:
+            current = self.fingerprint(system, self.tenant_id)
+            questions = collect_questions(self.cfg["sources"])
+            key, state = questions_key(questions), self._state
+            if not force and state and state[4] == key and not self.is_stale(current):
+                self.logger.info("预计算回答已是最新，跳过")
+                return True
+            reusable = {} if force or not state else {(normalize(entry["question"]), entry["mode"]): entry["answer"] for entry in state[1]
+                                                      if entry["mode"] != "fixed" and self._usable(state[0], entry["mode"], current)}
+            self.logger.info(f"开始预计算回答: {len(questions)} 个问题 (沿用 {len(reusable)} 条), 指纹 {current}")
+            embeddings = self.embeddings or system.resume_rag.embeddings
+            import numpy as np
+            vectors = np.asarray(embeddings.embed_documents([q for q, _, _ in questions]), dtype='float32')
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            entries = []
+            with request_options(priority=PRIORITY_BACKGROUND, shed=False): # 排在在线请求之后, 队列已满时继续等待
+                for i, ((question, mode, fixed_answer), vector) in enumerate(zip(questions, vectors)):
+                    report(0.05 + 0.9 * i / max(1, len(questions)), f"生成回答 {i + 1}/{len(questions)}")
+                    if mode == "fixed": answer = {"response": fixed_answer, "type": "fixed_answer"}
+                    elif (normalize(question), mode) in reusable: answer = reusable[(normalize(question), mode)]
+                    else:
+                        answer = system.pipeline.generate(question, use_rag=mode == "rag", rag_k=int(self.cfg["rag_k"]),
+                                                          tenant_id=self.tenant_id, query_vector=vector.tolist())
+                        if mode == "rag" and not answer.get("rag_context"): continue # 未检索到内容, 不保存
+                    if answer.get("type") == "error" or answer.get("function"): continue # 出错或需要工具/知识库的回答不保存
+                    entries.append({"question": question, "mode": mode, "answer": answer, "vector": vector.tolist()})
+            self._save({"fingerprint": current, "questions_key": key, "created_at": time.time(), "answers": entries})
+            self.reload()
+            report(1.0, f"已生成 {len(entries)} 条预计算回答")
+            self.logger.info(f"预计算回答已保存至: {self.path}, {len(entries)} 条")
+            return True
+        except Exception as e:
+            self.logger.error(f"预计算回答失败: {e}", exc_info=True)
+            return False
+
+    def _save(self, data: Dict[str, Any]) -> None:
+        """先写临时文件再原子替换，查询不会读到写了一半的文件"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
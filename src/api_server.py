@@ -0,0 +1,239 @@
+import os, json, time, uuid, queue
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional, Dict, List, Tuple, Callable, Any
+from src.utils import Config, setup_logger
+from src.admission import AdmissionController, ServerBusyError
+from src.cancellation import CancellationToken
+
+DEFAULT_API_SERVER_CFG = {
+    "host": "127.0.0.1",
+    "port": 8000,
+    "workers": 2,            # 同时执行的问答请求数 (共享同一个本地模型)
+    "max_queue": 16,         # 排队等待的请求数上限, 超出时返回 503
+    "request_timeout": 300,  # 单个请求排队与等待结果的最长时间 (秒), 排队超时返回 503, 执行超时返回 504
+    "max_body_bytes": 1048576 # 请求体大小上限 (字节), 超出返回 413
+}
+
+def message_text(content: Any) -> str:
+    """OpenAI 消息内容 (字符串或 [{"type": "text", "text": ...}] 列表) → 文本"""
+    if isinstance(content, list): return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return "" if content is None else str(content)
+
+def split_messages(messages: List[Dict[str, Any]]) -> Tuple[str, List[Dict[str, Any]]]:
+    """最后一条用户消息作为查询, 之前的用户/助手消息作为对话历史 (system 消息忽略, 使用本地模型内置的系统提示)"""
+    turns = [{"role": m.get("role"), "content": message_text(m.get("content"))} for m in messages if m.get("role") in ("user", "assistant")]
+    if not turns or turns[-1]["role"] != "user": raise ValueError("messages 的最后一条必须是 user 消息")
+    return turns[-1]["content"], turns[:-1]
+
+def response_text(result: Any) -> str:
+    """QASystem 回答 → 文本 (需要切换模式的提示等回答取其 message)"""
+    if isinstance(result, dict): return str(result.get("response") or result.get("message") or "")
+    return "" if result is None else str(result)
+
+class ApiServer:
+    """OpenAI 兼容的本地 HTTP 接口 (基于 QASystem, 只使用本地模型)
+
+    - POST /v1/chat/completions: 问答 (stream=true 时以 SSE 逐段返回); 扩展参数 use_rag / rag_k / tenant_id
+    - POST /v1/retrieve: 只检索, 返回分块内容与元数据
+    - GET /v1/models, GET /health
+    问答在 workers 个线程中执行, 准入由 AdmissionController 控制: 超过 workers + max_queue 个在途请求时直接返回 503,
+    供负载均衡器切换实例; 内部生成名额已满 (QASystem 返回 busy) 时同样返回 503。
+    """
+
+    def __init__(self, system: Any = None, cfg: Optional[Dict[str, Any]] = None):
+        self.cfg = {**DEFAULT_API_SERVER_CFG, **(Config().get().get('api_server') or {}), **(cfg or {})}
+        self.logger = setup_logger('log')
+        if system is None:
+            from src.qa_system import QASystem
+            system = QASystem()
+        self.system = system
+        self.model_name = os.path.basename(str(Config().get('model').get('path', 'local'))) or "local"
+        self.workers = max(1, int(self.cfg["workers"]))
+        self.admission = AdmissionController(self.workers, int(self.cfg["max_queue"]), float(self.cfg["request_timeout"]))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="api-worker")
+        self._server = None
+
+    # --- 执行池 ---
+    def submit(self, fn: Callable, *args: Any, **kwargs: Any) -> Any:
+        """获取执行名额后提交到问答执行池 (名额已满时在请求线程中排队, 队列已满或排队超时抛出 ServerBusyError)"""
+        self.admission.acquire()
+        try: future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self.admission.release()
+            raise
+        future.add_done_callback(lambda _: self.admission.release())
+        return future
+
+    def health(self) -> Dict[str, Any]:
+        stats = self.admission.stats()
+        generation = AdmissionController.shared()
+        return {"status": "ok", "model": self.model_name, "workers": self.workers, "active": stats["active"], "queued": stats["queued"],
+                "max_queue": stats["max_queue"], "rejected": stats["rejected"], "generation": generation.stats() if generation else None}
+
+    @staticmethod
+    def _check_busy(result: Any) -> Any:
+        """QASystem 因生成名额已满拒绝的回答 → ServerBusyError (返回 503)"""
+        if isinstance(result, dict) and result.get("type") == "busy": raise ServerBusyError(str(result.get("response")), float(result.get("retry_after", 1)))
+        return result
+
+    # --- 接口 ---
+    def _query_kwargs(self, body: Dict[str, Any], cancel_token: CancellationToken) -> Dict[str, Any]:
+        query, history = split_messages(body.get("messages") or [])
+        return {"query": query, "history": history, "use_rag": bool(body.get("use_rag", True)),
+                "rag_k": int(body.get("rag_k", 3)), "tenant_id": body.get("tenant_id"), "cancel_token": cancel_token}
+
+    def completion(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """非流式问答，返回 chat.completion 对象 (等待超时后停止生成)"""
+        token = CancellationToken()
+        try: result = self.submit(self.system.process_query, **self._query_kwargs(body, token)).result(timeout=float(self.cfg["request_timeout"]))
+        except BaseException:
+            token.cancel("request aborted")
+            raise
+        return self._completion_object(self._check_busy(result))
+
+    def _completion_object(self, result: Any) -> Dict[str, Any]:
+        extra = {key: result[key] for key in ("type", "timings", "rag_context", "cached", "precomputed") if isinstance(result, dict) and key in result}
+        return {"id": f"chatcmpl-{uuid.uuid4().hex[:24]}", "object": "chat.completion", "created": int(time.time()), "model": self.model_name,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": response_text(result)}, "finish_reason": "stop"}],
+                "metadata": extra}
+
+    def stream_completion(self, body: Dict[str, Any], write: Callable[[Dict[str, Any]], None]) -> None:
+        """流式问答: RAG 生成时逐段写出 chat.completion.chunk，其他情况 (固定问答、缓存等) 一次写出完整回答
+
+        客户端断开或等待超时时取消令牌, 生成在下一个解码步停止。
+        """
+        token = CancellationToken()
+        try: self._stream_chunks(body, write, token)
+        except BaseException:
+            token.cancel("client disconnected")
+            raise
+
+    def _stream_chunks(self, body: Dict[str, Any], write: Callable[[Dict[str, Any]], None], token: CancellationToken) -> None:
+        chunks: "queue.Queue[Optional[str]]" = queue.Queue()
+        future = self.submit(self.system.process_query, on_text=chunks.put, **self._query_kwargs(body, token))
+        future.add_done_callback(lambda _: chunks.put(None))
+        chunk_id, created = f"chatcmpl-{uuid.uuid4().hex[:24]}", int(time.time())
+        def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None, **extra: Any) -> Dict[str, Any]:
+            return {"id": chunk_id, "object": "chat.completion.chunk", "created": created, "model": self.model_name,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}], **extra}
+        deadline = time.monotonic() + float(self.cfg["request_timeout"])
+        text = chunks.get(timeout=max(0.0, deadline - time.monotonic()))
+        if text is None: self._check_busy(future.result(timeout=0)) # 尚未写出任何内容, 繁忙时仍可返回 503
+        write(chunk({"role": "assistant"}))
+        streamed = text is not None
+        while text is not None:
+            write(chunk({"content": text}))
+            text = chunks.get(timeout=max(0.0, deadline - time.monotonic()))
+        result = future.result(timeout=0)
+        if not streamed: write(chunk({"content": response_text(result)}))
+        write(chunk({}, "stop", metadata=self._completion_object(result)["metadata"]))
+
+    def retrieve(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        query = body.get("query") or body.get("input")
+        if not isinstance(query, str) or not query.strip(): raise ValueError("缺少 query")
+        docs = self.system.resume_rag.search(query, k=int(body.get("k", 3)), tenant_id=body.get("tenant_id"), filters=body.get("filters"))
+        return {"object": "list", "data": [{"index": i, "content": doc.page_content, "metadata": doc.metadata} for i, doc in enumerate(docs)]}
+
+    # --- 运行 ---
+    def serve_forever(self) -> None:
+        self._server = ThreadingHTTPServer((self.cfg["host"], int(self.cfg["port"])), _ApiHandler)
+        self._server.daemon_threads = True
+        self._server.api = self
+        self.logger.info(f"HTTP 接口已启动: http://{self.cfg['host']}:{self._server.server_port} (workers={self.workers}, max_queue={self.admission.max_queue})")
+        try: self._server.serve_forever()
+        finally: self._server.server_close()
+
+    def shutdown(self) -> None:
+        if self._server: self._server.shutdown()
+
+class _ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # 非流式响应可复用连接 (负载均衡器的长连接)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        self.server.api.logger.info(f"{self.address_string()} {format % args}")
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items(): self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status: int, message: str, error_type: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self._send_json(status, {"error": {"message": message, "type": error_type, "code": status}}, headers)
+
+    def _read_body(self) -> Optional[Dict[str, Any]]:
+        """读取 JSON 请求体; Content-Length 缺失 (411)、不合法 (400) 或超过 max_body_bytes (413) 时返回错误并关闭连接 (请求体未读取)"""
+        header = self.headers.get("Content-Length")
+        try: length = int(header) if header is not None else None
+        except ValueError: length = -1
+        error = None
+        if length is None: error = (411, "缺少 Content-Length 请求头")
+        elif length < 0: error = (400, f"Content-Length 不合法: {header}")
+        elif length > int(self.server.api.cfg["max_body_bytes"]): error = (413, "请求体过大")
+        if error is not None:
+            self.close_connection = True
+            self._send_error(*error, "invalid_request_error")
+            return None
+        try: body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_error(400, "请求体不是合法的 JSON", "invalid_request_error")
+            return None
+        if not isinstance(body, dict):
+            self._send_error(400, "请求体必须是 JSON 对象", "invalid_request_error")
+            return None
+        return body
+
+    def do_GET(self) -> None:
+        api = self.server.api
+        path = self.path.split("?", 1)[0]
+        if path == "/health": self._send_json(200, api.health())
+        elif path == "/v1/models": self._send_json(200, {"object": "list", "data": [{"id": api.model_name, "object": "model", "owned_by": "local"}]})
+        else: self._send_error(404, f"未知路径: {path}", "not_found")
+
+    def do_POST(self) -> None:
+        api = self.server.api
+        path = self.path.split("?", 1)[0]
+        if path not in ("/v1/chat/completions", "/v1/retrieve"):
+            self._send_error(404, f"未知路径: {path}", "not_found")
+            return
+        body = self._read_body()
+        if body is None: return
+        try:
+            if path == "/v1/retrieve": self._send_json(200, api.retrieve(body))
+            elif body.get("stream"): self._stream(body)
+            else: self._send_json(200, api.completion(body))
+        except ServerBusyError as e: self._send_error(503, str(e), "server_busy", {"Retry-After": str(max(1, round(e.retry_after)))})
+        except (FutureTimeout, queue.Empty): self._send_error(504, "请求处理超时", "timeout")
+        except (ValueError, TypeError) as e: self._send_error(400, str(e), "invalid_request_error")
+        except Exception as e:
+            api.logger.error(f"HTTP 请求处理失败: {e}", exc_info=True)
+            self._send_error(500, str(e), "server_error")
+
+    def _stream(self, body: Dict[str, Any]) -> None:
+        """SSE: 每个 chunk 一行 data: <json>, 以 data: [DONE] 结束"""
+        started = False
+        def write(payload: Dict[str, Any]) -> None:
+            nonlocal started
+            if not started:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                started = True
+            self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False, default=str)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.close_connection = True
+        try:
+            self.server.api.stream_completion(body, write)
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError): self.server.api.logger.info("客户端已断开流式连接")
+        except Exception as e:
+            if not started: raise # 尚未开始写出时按普通错误响应返回
+            self.server.api.logger.error(f"流式响应失败: {e}", exc_info=True)
+            try: self.wfile.write(f"data: {json.dumps({'error': {'message': str(e), 'type': 'server_error'}}, ensure_ascii=False)}\n\n".encode('utf-8'))
+            except OSError: pass
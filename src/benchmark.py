@@ -0,0 +1,45 @@
+import time, json, os
+from typing import Dict, List, Set, Any
+
+def percentile(values: List[float], p: float) -> float:
+    """计算百分位数 (线性插值)"""
+    if not values: return 0.0
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * p / 100.0
+    lower = int(pos)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (pos - lower)
+
+def summarize_latencies(latencies_ms: List[float]) -> Dict[str, float]:
+    """汇总延迟样本 (毫秒)"""
+    return {
+        "count": len(latencies_ms),
+        "mean_ms": round(sum(latencies_ms) / len(latencies_ms), 3) if latencies_ms else 0.0,
+        "p50_ms": round(percentile(latencies_ms, 50), 3),
+        "p99_ms": round(percentile(latencies_ms, 99), 3)
+    }
+
+def recall_at_k(retrieved: List[Any], relevant: Set[Any], k: int) -> float:
+    """前 k 个结果覆盖的相关项比例"""
+    if not relevant: return 0.0
+    return len(set(retrieved[:k]) & relevant) / len(relevant)
+
+def reciprocal_rank(retrieved: List[Any], relevant: Set[Any]) -> float:
+    """第一个相关结果排名的倒数 (未命中为 0)"""
+    for rank, item in enumerate(retrieved, 1):
+        if item in relevant: return 1.0 / rank
+    return 0.0
+
+class Timer:
+    """计时上下文管理器，elapsed_ms 记录耗时"""
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed_ms = (time.perf_counter() - self.start) * 1000
+
+def save_report(report: Dict[str, Any], output_path: str) -> None:
+    """将基准测试结果保存为 JSON，便于跨版本对比"""
+    if os.path.dirname(output_path): os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f: json.dump(report, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,100 @@
+import time, threading, contextvars
+from contextlib import contextmanager
+from typing import Optional, List, Callable, Iterator
+
+DEFAULT_CANCELLATION_CFG = {
+    "deadline": 120,           # 单次查询生成的截止时间 (秒), 0 表示不限制; 超时返回已生成的部分或固定问答兜底
+    "fallback_threshold": 0.5  # 超时且没有部分回答时, 固定问答字符匹配的相似度阈值 (低于正常匹配)
+}
+
+class GenerationCancelled(Exception):
+    """生成被取消 (会话关闭、用户提交了新问题或清空了对话)，结果已无人使用"""
+
+    def __init__(self, reason: str = "cancelled"):
+        super().__init__(reason)
+        self.reason = reason
+
+class DeadlineExceeded(GenerationCancelled):
+    """生成超过截止时间被停止, partial 为已生成的部分回答"""
+
+    def __init__(self, partial: str = ""):
+        super().__init__("deadline")
+        self.partial = partial
+
+class CancellationToken:
+    """协作式取消令牌: 生成的每个解码步检查 should_stop()，取消或超过截止时间后尽快停止
+
+    alive 为可选的存活检查 (如 Streamlit 会话是否仍在)，返回 False 时视为取消。可在任意线程调用 cancel。
+    """
+
+    def __init__(self, timeout: Optional[float] = None, alive: Optional[Callable[[], bool]] = None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.alive = alive
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        with self._lock:
+            if self._event.is_set(): return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks: callback()
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """注册取消回调 (已取消时立即执行)，返回注销函数; 回调不再需要时应注销, 避免长期存在的令牌上回调不断累积"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove_callback(callback)
+        callback()
+        return lambda: None
+
+    def _remove_callback(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            try: self._callbacks.remove(callback)
+            except ValueError: pass # 已执行或已注销
+
+    def limit(self, timeout: Optional[float]) -> "CancellationToken":
+        """把截止时间收紧到 timeout 秒后 (已有更早的截止时间时不变)"""
+        if timeout:
+            deadline = time.monotonic() + timeout
+            if self.deadline is None or deadline < self.deadline: self.deadline = deadline
+        return self
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._event.is_set() and self.alive is not None:
+            try: alive = self.alive()
+            except Exception: alive = True
+            if not alive: self.cancel("session closed")
+        return self._event.is_set()
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+
+    def should_stop(self) -> bool:
+        return self.cancelled or self.expired()
+
+    def raise_if_stopped(self, partial: str = "") -> None:
+        """已取消抛出 GenerationCancelled, 超过截止时间抛出 DeadlineExceeded (携带部分回答)"""
+        if self.cancelled: raise GenerationCancelled(self.reason or "cancelled")
+        if self.expired(): raise DeadlineExceeded(partial)
+
+_current_token: "contextvars.ContextVar[Optional[CancellationToken]]" = contextvars.ContextVar("cancellation_token", default=None)
+
+def current_token() -> Optional[CancellationToken]:
+    """当前调用链上的取消令牌 (没有时为 None)"""
+    return _current_token.get()
+
+@contextmanager
+def cancellation_scope(token: Optional[CancellationToken]) -> Iterator[Optional[CancellationToken]]:
+    """在此范围内的生成 (含排队) 都受 token 控制"""
+    reset = _current_token.set(token)
+    try: yield token
+    finally: _current_token.reset(reset)
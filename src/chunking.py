@@ -0,0 +1,156 @@
+import re
+from typing import Optional, Dict, List, Tuple, Any
+from langchain_core.documents import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from src.utils import Config
+
+CHUNKER_VERSION = 3 # 切分逻辑或分块元数据变化时递增 (上传缓存的内容键包含该值)
+
+# 标题关键词 → 段落类别 (按顺序匹配, "项目经历" 归为 projects 而不是 work)
+SECTION_KEYWORDS = (
+    ("projects", ("项目", "project")),
+    ("education", ("教育", "学历", "学校", "education")),
+    ("work", ("工作", "实习", "任职", "experience", "employment")),
+    ("skills", ("技能", "能力", "技术栈", "skill")),
+    ("awards", ("获奖", "荣誉", "证书", "award")),
+    ("summary", ("评价", "总结", "简介", "summary")),
+    ("basic", ("基本信息", "个人信息", "联系方式", "contact")),
+)
+
+# 技能标签词表 (匹配时不区分大小写, 英文词要求词边界)
+SKILL_KEYWORDS = (
+    "Python", "Java", "C++", "C#", "Go", "JavaScript", "TypeScript", "SQL", "MySQL", "Redis", "MongoDB", "Linux", "Docker",
+    "Kubernetes", "Git", "PyTorch", "TensorFlow", "Transformers", "LangChain", "LlamaIndex", "RAG", "FAISS", "LoRA", "Prompt",
+    "Agent", "NLP", "OCR", "YOLO", "Streamlit", "Flask", "Django", "FastAPI", "Vue", "React", "Spark", "Hadoop", "Pandas",
+    "爬虫", "数据分析", "机器学习", "深度学习", "大模型", "微调", "知识库", "计算机视觉"
+)
+_SKILL_PATTERNS = [(skill, re.compile((r'(?<![A-Za-z0-9])' + re.escape(skill) + r'(?![A-Za-z0-9+#])') if skill.isascii() else re.escape(skill), re.IGNORECASE))
+                   for skill in SKILL_KEYWORDS]
+_HEADING = re.compile(r'^(#{1,6})\s+(.+?)\s*#*\s*$')
+_LIST_ITEM = re.compile(r'^\s*(?:[-*+]|\d+[.)、])\s+')
+_FENCE = re.compile(r'^\s*(```|~~~)')
+
+def classify_section(heading: str) -> str:
+    """标题 → 段落类别 (education / work / projects / skills / awards / summary / basic / other)"""
+    text = heading.lower()
+    for section, keywords in SECTION_KEYWORDS:
+        if any(keyword in text for keyword in keywords): return section
+    return "other"
+
+def extract_skills(text: str) -> List[str]:
+    """分块文本中出现的技能标签"""
+    return [skill for skill, pattern in _SKILL_PATTERNS if pattern.search(text)]
+
+def _clean_heading(text: str) -> str:
+    return re.sub(r'[*_`]+', '', text).strip()
+
+class MarkdownResumeChunker:
+    """按 Markdown 标题层级切分简历
+
+    - 每个标题下的正文为一个段落, 分块前缀为标题路径 (如 "简历 > 工作经历 > 某公司")，分块脱离上下文也能看懂
+    - 列表项 (含缩进的子项与续行) 与段落作为不可拆分的块，按 chunk_size 贪心合并，段落之间不重叠
+    - 单个块超过 chunk_size 时才退回按字符切分 (带 chunk_overlap)
+    - 元数据: section (段落类别), section_path (标题路径), skills (技能标签)
+    没有标题的纯文本 (如 OCR 结果) 按空行分段后同样合并。
+    """
+
+    def __init__(self, chunk_size: int = 300, chunk_overlap: int = 50):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def sections(self, text: str) -> List[Tuple[List[str], str]]:
+        """(标题路径, 正文) 列表; 代码块中的 # 不视为标题"""
+        sections, path, body, in_fence = [], [], [], False
+        for line in text.splitlines():
+            if _FENCE.match(line): in_fence = not in_fence
+            match = None if in_fence else _HEADING.match(line)
+            if not match:
+                body.append(line)
+                continue
+            sections.append((list(path), "\n".join(body)))
+            level = len(match.group(1))
+            path = [(heading_level, heading) for heading_level, heading in path if heading_level < level] + [(level, _clean_heading(match.group(2)))]
+            body = []
+        sections.append((list(path), "\n".join(body)))
+        return [([heading for _, heading in section_path], section_body) for section_path, section_body in sections if section_body.strip()]
+
+    @staticmethod
+    def blocks(body: str) -> List[str]:
+        """正文 → 不可拆分的块: 列表项连同缩进的子项/续行, 或以空行分隔的段落"""
+        blocks, current, blank = [], [], False
+        for line in body.splitlines():
+            if not line.strip():
+                blank = True
+                continue
+            indented = len(line) - len(line.lstrip()) > 0
+            is_item = bool(_LIST_ITEM.match(line))
+            if current and indented: current.append(line) # 子列表或续行
+            elif current and not blank and not is_item and not _LIST_ITEM.match(current[0]): current.append(line) # 段落续行
+            else:
+                if current: blocks.append("\n".join(current))
+                current = [line]
+            blank = False
+        if current: blocks.append("\n".join(current))
+        return blocks
+
+    def _pack(self, blocks: List[str], budget: int) -> List[str]:
+        """按预算贪心合并块; 超长的块单独按字符切分"""
+        pieces, current = [], ""
+        for block in blocks:
+            if len(block) > budget:
+                if current: pieces.append(current)
+                current = ""
+                splitter = RecursiveCharacterTextSplitter(chunk_size=budget, chunk_overlap=min(self.chunk_overlap, budget // 2))
+                pieces.extend(splitter.split_text(block))
+            elif current and len(current) + 1 + len(block) > budget:
+                pieces.append(current)
+                current = block
+            else: current = f"{current}\n{block}" if current else block
+        if current: pieces.append(current)
+        return pieces
+
+    def split(self, text: str, metadata: Optional[Dict[str, Any]] = None) -> List[Document]:
+        """切分为带标题路径前缀的分块; 同一上级标题下相邻的短小节 (如多段短的工作经历) 合并为一个分块"""
+        chunks = [] # [标题路径, 正文, 段落类别, 可继续合并的上级路径]
+        for path, body in self.sections(text):
+            prefix = " > ".join(path)
+            budget = max(self.chunk_size - len(prefix) - 1, self.chunk_size // 2) # 标题路径也计入分块长度
+            section = next((category for category in map(classify_section, reversed(path)) if category != "other"), "other")
+            pieces = self._pack(self.blocks(body), budget)
+            last = chunks[-1] if chunks else None
+            if (len(pieces) == 1 and len(path) > 1 and last and last[3] == path[:-1] and last[2] == section
+                    and len(last[0]) + len(last[1]) + len(path[-1]) + len(pieces[0]) + 3 <= self.chunk_size):
+                if last[0] != " > ".join(path[:-1]): # 第一次合并: 前缀改为上级路径, 原小节标题移入正文
+                    last[1] = f"{last[0].rsplit(' > ', 1)[-1]}\n{last[1]}"
+                    last[0] = " > ".join(path[:-1])
+                last[1] = f"{last[1]}\n{path[-1]}\n{pieces[0]}"
+                continue
+            chunks.extend([prefix, piece, section, path[:-1] if len(pieces) == 1 and len(path) > 1 else None] for piece in pieces)
+        docs = []
+        for prefix, body, section, _ in chunks:
+            docs.append(Document(page_content=f"{prefix}\n{body}" if prefix else body,
+                                 metadata={**(metadata or {}), "section": section, "section_path": prefix,
+                                           "skills": extract_skills(f"{prefix.rsplit(' > ', 1)[-1] if ' > ' in prefix else ''}\n{body}")}))
+        return docs
+
+def split_text(text: str, metadata: Optional[Dict[str, Any]] = None, embedding_cfg: Optional[Dict[str, Any]] = None) -> List[Document]:
+    """按 embedding 配置切分文本 (运行时上传与离线构建共用)
+
+    默认使用 MarkdownResumeChunker; embedding.chunker 为 "recursive" 时按字符递归切分 (无结构信息, 仅用于对比)。
+    每个分块的元数据附带段落类别 section 与技能标签 skills (用于检索时过滤)。
+    """
+    cfg = embedding_cfg or Config().get('embedding')
+    if cfg.get('chunker', 'markdown') == 'markdown':
+        return MarkdownResumeChunker(cfg['chunk_size'], cfg['chunk_overlap']).split(text, metadata)
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=cfg['chunk_size'],
+        chunk_overlap=cfg['chunk_overlap'],
+        add_start_index=True
+    )
+    docs = text_splitter.create_documents([text], metadatas=[dict(metadata or {})])
+    headings = [(match.start(), classify_section(match.group(2))) for match in re.finditer(_HEADING.pattern, text, re.MULTILINE)]
+    for doc in docs:
+        start = doc.metadata.pop('start_index', 0)
+        doc.metadata['section'] = next((section for position, section in reversed(headings) if position <= start and section != "other"), "other")
+        doc.metadata['skills'] = extract_skills(doc.page_content)
+    return docs
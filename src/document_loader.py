@@ -0,0 +1,138 @@
+import os, io, csv, json, tempfile
+from collections import deque
+from typing import Optional, Dict, Callable, Iterator, Any
+
+SUPPORTED_EXTENSIONS = ('.txt', '.md', '.pdf', '.docx')
+
+def read_text_file(data: bytes) -> str:
+    """解码文本文件 (utf-8 失败时回退 gbk)"""
+    try: return data.decode('utf-8')
+    except UnicodeDecodeError: return data.decode('gbk', errors='ignore')
+
+def iter_pdf_pages(pdf_path: str, ocr: Any = None, parallel: bool = True,
+                   progress: Optional[Callable[[int, int], None]] = None) -> Iterator[Dict[str, Any]]:
+    """逐页处理 PDF: 文字足够的页面直接提取, 文字稀疏且含图片的页面才 OCR
+
+    页面以流的方式处理并按页序产出 {"page", "text", "ocr"}，已处理页面的缓存随即释放，内存占用与页数无关。
+    parallel=True 时 OCR 页面提交到进程池，与后续页面的文字提取重叠进行；否则在当前进程内识别。
+    """
+    import pdfplumber
+    from src.ocr import OCREngine
+    engine = ocr or OCREngine()
+    min_chars = int(engine.opts.get("min_page_chars", 30))
+    pending = deque() # (页码, 文本或 Future, 是否 OCR), 保持页序
+    inflight, done = 0, 0
+    with pdfplumber.open(pdf_path) as pdf:
+        total = len(pdf.pages)
+        def pop_ready():
+            nonlocal inflight, done
+            page_number, item, is_ocr = pending.popleft()
+            if not isinstance(item, str):
+                inflight -= 1
+                try: item = item.result()
+                except Exception as e:
+                    engine.logger.error(f"第 {page_number} 页 OCR 失败: {e}", exc_info=True)
+                    item = ""
+            done += 1
+            if progress: progress(done, total)
+            return {"page": page_number, "text": item, "ocr": is_ocr}
+        for page_number, page in enumerate(pdf.pages, start=1):
+            text = page.extract_text() or ""
+            needs_ocr = len(text.strip()) < min_chars and bool(page.images)
+            page.flush_cache() # 释放已处理页面的缓存
+            if needs_ocr and parallel:
+                pending.append((page_number, engine.submit_pdf_page(pdf_path, page_number), True))
+                inflight += 1
+            elif needs_ocr: pending.append((page_number, engine.ocr_pdf_page(pdf_path, page_number), True))
+            else: pending.append((page_number, text, False))
+            # 按页序产出已就绪的页面; 在途 OCR 页面达到上限时阻塞等待最早的一页
+            while pending and (isinstance(pending[0][1], str) or pending[0][1].done() or inflight >= engine.max_inflight):
+                yield pop_ready()
+        while pending: yield pop_ready()
+
+def extract_pdf_text(pdf_path: str, parallel: bool = True, progress: Optional[Callable[[int, int], None]] = None) -> str:
+    """提取 PDF 全文 (按页路由文字提取或 OCR)"""
+    return "\n".join(page["text"] for page in iter_pdf_pages(pdf_path, parallel=parallel, progress=progress))
+
+def extract_text(data: bytes, file_name: str, parallel: bool = True) -> str:
+    """按扩展名从文件内容中提取文本"""
+    ext = os.path.splitext(file_name)[1].lower()
+    if ext in ('.txt', '.md'): return read_text_file(data)
+    if ext == '.pdf':
+        fd, tmp_path = tempfile.mkstemp(suffix=".pdf") # OCR 子进程按路径渲染页面
+        try:
+            with os.fdopen(fd, 'wb') as f: f.write(data)
+            return extract_pdf_text(tmp_path, parallel=parallel)
+        finally: os.remove(tmp_path)
+    if ext == '.docx':
+        import docx2txt
+        return docx2txt.process(io.BytesIO(data))
+    raise ValueError(f"不支持的文件类型: {ext}")
+
+def load_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    """解析一条待入库记录 (可在子进程中执行): 带 path 的记录读取文件并提取文本"""
+    if record.get('text') is None:
+        try:
+            path = record['path']
+            if path.lower().endswith('.pdf'): record['text'] = extract_pdf_text(path, parallel=False) # 已在解析进程中, OCR 不再另开进程池
+            else:
+                with open(path, 'rb') as f: record['text'] = extract_text(f.read(), path)
+        except Exception as e:
+            record['text'], record['error'] = "", str(e)
+    return record
+
+def _iter_json_array(path: str, buffer_size: int = 1 << 16) -> Iterator[Any]:
+    """流式读取 JSON 数组中的元素, 不一次性载入整个文件"""
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer, started = "", False
+        while True:
+            chunk = f.read(buffer_size)
+            buffer += chunk
+            if not started:
+                buffer = buffer.lstrip()
+                if not buffer:
+                    if not chunk: return
+                    continue
+                if buffer[0] != '[': raise ValueError(f"{path} 不是 JSON 数组")
+                buffer, started = buffer[1:], True
+            while True:
+                buffer = buffer.lstrip().lstrip(',').lstrip()
+                if not buffer or buffer[0] == ']': break
+                try: item, end = decoder.raw_decode(buffer)
+                except json.JSONDecodeError: break # 元素不完整, 继续读取
+                if end == len(buffer) and chunk: break # 数字等标量可能被截断, 读取更多后再解析
+                yield item
+                buffer = buffer[end:]
+            if not chunk:
+                if buffer.strip() not in ("", "]"): raise ValueError(f"{path} JSON 数组不完整")
+                return
+
+def _qa_text(row: Dict[str, Any]) -> str:
+    """将数据集中的问答样本拼接为可检索文本"""
+    question, answer = (row.get('input') or "").strip(), (row.get('output') or "").strip()
+    return f"问题: {question}\n回答: {answer}" if question else answer
+
+def iter_source_records(source: str) -> Iterator[Dict[str, Any]]:
+    """按确定顺序流式产出待入库记录: 目录 (txt/md/pdf/docx)、数据集 csv 或 json 数组
+
+    每条记录: {"doc_id", "source", "text"} 或 {"doc_id", "source", "path"} (文件由解析进程读取)
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort() # 保证遍历顺序稳定, 便于断点续传
+            for name in sorted(files):
+                if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    yield {"doc_id": os.path.relpath(path, source), "source": path, "path": path}
+    elif source.lower().endswith('.csv'):
+        with open(source, 'r', encoding='utf-8', newline='') as f:
+            for i, row in enumerate(csv.DictReader(f)):
+                yield {"doc_id": f"{os.path.basename(source)}#{i}", "source": source, "text": _qa_text(row)}
+    elif source.lower().endswith('.json'):
+        for i, row in enumerate(_iter_json_array(source)):
+            yield {"doc_id": f"{os.path.basename(source)}#{i}", "source": source, "text": _qa_text(row) if isinstance(row, dict) else str(row)}
+    elif source.lower().endswith(SUPPORTED_EXTENSIONS):
+        yield {"doc_id": os.path.basename(source), "source": source, "path": source}
+    else:
+        raise ValueError(f"不支持的数据源: {source}")
@@ -0,0 +1,168 @@
+import os, time, queue, asyncio, threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Dict, List, Tuple, Any
+from langchain_core.embeddings import Embeddings
+from src.utils import Config, setup_logger
+
+DEFAULT_EMBEDDING_SERVICE_CFG = {
+    "batch_window_ms": 2,  # 收集并发请求的最长等待时间 (单个请求最多因此多等这么久), 0 表示不等待
+    "max_batch_size": 32,  # 一次前向计算的最大文本数, 更大的请求拆分后与查询交替执行
+    "workers": 1,          # 推理线程数
+    "torch_threads": 0     # 每个推理线程分到的计算线程数 (进程内总数为 torch_threads × workers), 0 表示 CPU 核数 / workers
+}
+
+def create_embedding_model(embedding_cfg: Dict[str, Any], threads: int = 0, batch_size: int = 32) -> Embeddings:
+    """embedding.backend: torch (默认, HuggingFaceEmbeddings) / onnx (导出并 int8 量化后用 onnxruntime 推理, 产物缓存在 onnx_dir)"""
+    if embedding_cfg.get('backend', 'torch') == 'onnx':
+        try:
+            from src.onnx_embeddings import OnnxEmbeddings
+            return OnnxEmbeddings.load_or_export(embedding_cfg['model_name'], embedding_cfg.get('onnx_dir', 'models/onnx'),
+                                                 quantize=bool(embedding_cfg.get('onnx_quantize', True)), threads=threads, batch_size=batch_size)
+        except ImportError as e:
+            setup_logger('log').warning(f"ONNX 后端依赖缺失 ({e})，改用 PyTorch 后端 (pip install onnxruntime sentence-transformers)")
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(
+        model_name=embedding_cfg['model_name'],
+        model_kwargs={'device': embedding_cfg.get('device', 'cpu')},
+        encode_kwargs={'batch_size': batch_size}
+    )
+
+class EmbeddingService(Embeddings):
+    """进程级共享的嵌入服务 (单例): 持有唯一的嵌入模型实例，把并发请求合并成批次前向计算
+
+    - embed_query / embed_documents 把文本放入请求队列并等待结果，可在任意线程调用
+    - 调度线程在推理线程空闲时取出队列中的请求，短时间窗口内继续收集，合并为一批 (不超过 max_batch_size)
+    - 推理在独立线程池中执行，计算线程总数受控，多个会话的查询共享前向计算而不是争抢 CPU
+    - 实现 LangChain Embeddings 接口，可直接替代 HuggingFaceEmbeddings
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._instance_lock:
+            if cls._instance is None: cls._instance = super().__new__(cls) # 单例模式 (进程内共享)
+        return cls._instance
+
+    def __init__(self):
+        if not hasattr(self, 'initialized'):
+            cfg = {**DEFAULT_EMBEDDING_SERVICE_CFG, **(Config().get().get('embedding_service') or {})}
+            self.embedding_cfg = Config().get('embedding')
+            self.logger = setup_logger('log')
+            self.batch_window = max(0.0, float(cfg['batch_window_ms']) / 1000)
+            self.max_batch_size = max(1, int(cfg['max_batch_size']))
+            self.workers = max(1, int(cfg['workers']))
+            self.torch_threads = int(cfg['torch_threads']) or max(1, (os.cpu_count() or 1) // self.workers)
+            self.model = self._create_model()
+            self._queue: "queue.Queue[Tuple[List[str], Future, float]]" = queue.Queue()
+            self._slots = threading.Semaphore(self.workers) # 空闲的推理线程数, 推理线程忙时请求留在队列中继续累积
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="embedding")
+            self._stats_lock = threading.Lock()
+            self._stats = {"requests": 0, "texts": 0, "batches": 0, "errors": 0, "max_batch": 0, "busy_s": 0.0, "wait_s": 0.0}
+            self._started_at = time.monotonic()
+            threading.Thread(target=self._dispatch_loop, name="embedding-batcher", daemon=True).start()
+            self.initialized = True
+
+    def _create_model(self) -> Any:
+        device = self.embedding_cfg.get('device', 'cpu')
+        self.logger.info(f"嵌入服务加载模型: {self.embedding_cfg['model_name']} on device: {device}, backend={self.embedding_cfg.get('backend', 'torch')}, "
+                         f"workers={self.workers}, torch_threads={self.torch_threads}, max_batch_size={self.max_batch_size}")
+        pool_cfg = Config().get().get('replica_pool') or {}
+        if pool_cfg.get('enabled') and pool_cfg.get('embedding', True):
+            from src.replica_pool import ReplicaPool, ReplicaEmbeddings
+            self.logger.info("嵌入计算由模型副本进程执行")
+            return ReplicaEmbeddings(ReplicaPool.shared())
+        self._set_torch_threads(self.torch_threads * self.workers)
+        return create_embedding_model(self.embedding_cfg, threads=self.torch_threads * self.workers, batch_size=self.max_batch_size) # onnx 会话的线程池由各推理线程共享
+
+    def _set_torch_threads(self, threads: int) -> None:
+        """服务启动时设置一次 torch 计算线程数: set_num_threads 作用于整个进程 (各推理线程共享同一个线程池), 不能按线程设置"""
+        try:
+            import torch
+            torch.set_num_threads(threads)
+        except ImportError: pass
+
+    # --- 请求 ---
+    def _submit(self, texts: List[str]) -> Future:
+        future = Future()
+        self._queue.put((texts, future, time.monotonic()))
+        return future
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """批量嵌入; 超过 max_batch_size 的请求拆分提交，与其他查询交替执行而不独占推理线程"""
+        texts = list(texts)
+        futures = [self._submit(texts[i:i + self.max_batch_size]) for i in range(0, len(texts), self.max_batch_size)]
+        return [vector for future in futures for vector in future.result()]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._submit([text]).result()[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """异步批量嵌入: 不占用事件循环线程; 调用方取消时尚未开始计算的请求不再参与前向"""
+        texts = list(texts)
+        futures = [asyncio.wrap_future(self._submit(texts[i:i + self.max_batch_size])) for i in range(0, len(texts), self.max_batch_size)]
+        return [vector for result in await asyncio.gather(*futures) for vector in result]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await asyncio.wrap_future(self._submit([text])))[0]
+
+    # --- 调度与推理 ---
+    def _dispatch_loop(self) -> None:
+        while True:
+            self._slots.acquire() # 等待空闲的推理线程
+            batch = [self._queue.get()]
+            size, deadline = len(batch[0][0]), time.monotonic() + self.batch_window
+            while size < self.max_batch_size:
+                try: item = self._queue.get_nowait() # 已在排队的请求直接合并
+                except queue.Empty:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0: break
+                    try: item = self._queue.get(timeout=remaining)
+                    except queue.Empty: break
+                if size + len(item[0]) > self.max_batch_size:
+                    self._executor.submit(self._run_batch, batch) # 放不下的请求留给下一批
+                    self._slots.acquire()
+                    batch, size = [], 0
+                batch.append(item)
+                size += len(item[0])
+            self._executor.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch: List[Tuple[List[str], Future, float]]) -> None:
+        try:
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()] # 跳过已被调用方取消的请求
+            if not batch: return
+            texts = [text for request_texts, _, _ in batch for text in request_texts]
+            start = time.monotonic()
+            try: vectors = self.model.embed_documents(texts)
+            except Exception as e:
+                self.logger.error(f"嵌入计算失败: {e}", exc_info=True)
+                with self._stats_lock: self._stats["errors"] += len(batch)
+                for _, future, _ in batch: future.set_exception(e)
+                return
+            elapsed, offset = time.monotonic() - start, 0
+            for request_texts, future, _ in batch:
+                future.set_result(vectors[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+            with self._stats_lock:
+                stats = self._stats
+                stats["requests"] += len(batch)
+                stats["texts"] += len(texts)
+                stats["batches"] += 1
+                stats["max_batch"] = max(stats["max_batch"], len(texts))
+                stats["busy_s"] += elapsed
+                stats["wait_s"] += sum(start - enqueued_at for _, _, enqueued_at in batch)
+        finally:
+            self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """吞吐指标: 请求数、文本数、前向次数、平均批大小、平均排队时间与每秒处理的文本数"""
+        with self._stats_lock: stats = dict(self._stats)
+        uptime = time.monotonic() - self._started_at
+        return {
+            **{key: stats[key] for key in ("requests", "texts", "batches", "errors", "max_batch")},
+            "avg_batch": round(stats["texts"] / stats["batches"], 2) if stats["batches"] else 0.0,
+            "avg_wait_ms": round(stats["wait_s"] * 1000 / stats["requests"], 3) if stats["requests"] else 0.0,
+            "busy_s": round(stats["busy_s"], 3),
+            "texts_per_s": round(stats["texts"] / stats["busy_s"], 2) if stats["busy_s"] else 0.0, # 推理吞吐
+            "utilization": round(stats["busy_s"] / (uptime * self.workers), 4) if uptime > 0 else 0.0,
+            "queued": self._queue.qsize()
+        }
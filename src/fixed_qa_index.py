@@ -0,0 +1,150 @@
+import os, json, time, difflib, threading
+from collections import Counter
+from typing import Optional, Dict, List, Tuple, Any
+from src.utils import setup_logger
+
+DEFAULT_FIXED_QA_CFG = {
+    "path": "src/fixed_qa.json",
+    "threshold": 0.7,            # SequenceMatcher 相似度阈值
+    "ngram": 2,                  # 倒排索引的字符 n-gram 长度
+    "shortlist": 50,             # 进入精确比对的候选问题数上限
+    "embedding": False,          # 是否启用向量近邻匹配 (识别同义改写)
+    "embedding_threshold": 0.88, # 余弦相似度阈值
+    "check_interval": 1.0        # 检查 JSON 文件是否变化的最小间隔 (秒)
+}
+
+def normalize(text: str) -> str:
+    """只保留字母数字并转小写 (与原线性扫描的归一化一致)"""
+    return ''.join(filter(str.isalnum, text)).lower()
+
+def char_ngrams(text: str, n: int = 2) -> List[str]:
+    """字符 n-gram (短于 n 的文本整体作为一个 gram)"""
+    if len(text) <= n: return [text] if text else []
+    return [text[i:i + n] for i in range(len(text) - n + 1)]
+
+class FixedQAIndex:
+    """固定问答索引: 加载时预计算归一化问题与字符 n-gram 倒排索引
+
+    查询时先按归一化文本精确查找，再由倒排索引按共享 n-gram 数筛选候选，只对候选计算 SequenceMatcher；
+    可选地用问题向量做近邻匹配以识别同义改写。JSON 文件修改后自动重新加载。
+    """
+
+    def __init__(self, cfg: Optional[Dict[str, Any]] = None, embeddings: Any = None):
+        self.cfg = {**DEFAULT_FIXED_QA_CFG, **(cfg or {})}
+        self.path = self.cfg["path"]
+        self.n = int(self.cfg["ngram"])
+        self.embeddings = embeddings if self.cfg["embedding"] else None
+        self.logger = setup_logger('log')
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self._state = None # (问题列表, 精确查找表, 倒排索引, 问题向量), 重新加载时整体替换
+        self.reload()
+
+    def __len__(self) -> int:
+        return len(self._state[0]) if self._state else 0
+
+    def reload(self) -> bool:
+        """重新加载 JSON 并重建索引，返回是否成功"""
+        try:
+            if not os.path.exists(self.path):
+                self.logger.warning(f"固定问答文件未找到: {self.path}")
+                self._state, self._mtime = None, None
+                return False
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, 'r', encoding='utf-8') as f: items = json.load(f).get("fixed_answers", [])
+            questions = [] # (原问题, 归一化问题, 答案)
+            for item in items:
+                for question in item.get("questions", []):
+                    questions.append((question, normalize(question), item.get("answer")))
+            exact, inverted = {}, {}
+            for qid, (_, norm, _) in enumerate(questions):
+                exact.setdefault(norm, qid)
+                for gram in set(char_ngrams(norm, self.n)): inverted.setdefault(gram, []).append(qid)
+            vectors = self._embed_questions(questions)
+            self._state, self._mtime = (questions, exact, inverted, vectors), mtime
+            self.logger.info(f"成功加载固定问答数据: {self.path}, {len(items)} 条答案, {len(questions)} 个问题")
+            return True
+        except Exception as e:
+            self.logger.error(f"加载固定问答数据失败: {e}", exc_info=True)
+            return False
+
+    def _embed_questions(self, questions: List[Tuple[str, str, Any]]) -> Any:
+        if self.embeddings is None or not questions: return None
+        import numpy as np
+        vectors = np.asarray(self.embeddings.embed_documents([q for q, _, _ in questions]), dtype='float32')
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def _maybe_reload(self) -> None:
+        """距上次检查超过 check_interval 且文件 mtime 变化时重新加载"""
+        now = time.monotonic()
+        if now - self._checked_at < float(self.cfg["check_interval"]): return
+        with self._lock:
+            if now - self._checked_at < float(self.cfg["check_interval"]): return
+            self._checked_at = now
+            try: mtime = os.path.getmtime(self.path)
+            except OSError: mtime = None
+            if mtime != self._mtime:
+                self.logger.info(f"固定问答文件已变化，重新加载: {self.path}")
+                self.reload()
+
+    def _shortlist(self, norm: str, inverted: Dict[str, List[int]]) -> List[int]:
+        """按共享 n-gram 数从多到少取候选问题"""
+        counts = Counter()
+        for gram in set(char_ngrams(norm, self.n)): counts.update(inverted.get(gram, ()))
+        return [qid for qid, _ in counts.most_common(int(self.cfg["shortlist"]))]
+
+    @property
+    def uses_embedding(self) -> bool:
+        return self._state is not None and self._state[3] is not None
+
+    def match_exact(self, query: str) -> Optional[Dict[str, Any]]:
+        """归一化后完全相同的问题 (O(1) 查找)"""
+        self._maybe_reload()
+        state, norm = self._state, normalize(query)
+        if not state or norm not in state[1]: return None
+        question, _, answer = state[0][state[1][norm]]
+        return {"answer": answer, "question": question, "score": 1.0, "method": "exact"}
+
+    def match_text(self, query: str, threshold: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """字符匹配: 精确查找, 再对 n-gram 候选计算 SequenceMatcher"""
+        match = self.match_exact(query)
+        state = self._state
+        if match or not state: return match
+        questions, _, inverted, _ = state
+        threshold = float(self.cfg["threshold"] if threshold is None else threshold)
+        norm = normalize(query)
+        if not norm: return None
+        best_qid, best_score = None, 0.0
+        matcher = difflib.SequenceMatcher(None, b=norm) # b 端的预处理只做一次
+        for qid in self._shortlist(norm, inverted):
+            matcher.set_seq1(questions[qid][1])
+            if matcher.real_quick_ratio() <= best_score or matcher.quick_ratio() <= best_score: continue # 上界不超过当前最优时跳过
+            score = matcher.ratio()
+            if score > best_score: best_qid, best_score = qid, score
+        if best_qid is not None and best_score >= threshold:
+            question, _, answer = questions[best_qid]
+            return {"answer": answer, "question": question, "score": best_score, "method": "ngram"}
+        return None
+
+    def match_vector(self, query_vector: Any) -> Optional[Dict[str, Any]]:
+        """向量近邻匹配 (未启用 embedding 时返回 None)"""
+        state = self._state
+        if not state or state[3] is None: return None
+        import numpy as np
+        questions, vectors = state[0], state[3]
+        vector = np.asarray(query_vector, dtype='float32')
+        similarities = vectors @ (vector / max(float(np.linalg.norm(vector)), 1e-12))
+        qid = int(similarities.argmax())
+        if similarities[qid] < float(self.cfg["embedding_threshold"]): return None
+        question, _, answer = questions[qid]
+        return {"answer": answer, "question": question, "score": float(similarities[qid]), "method": "embedding"}
+
+    def match(self, query: str, threshold: Optional[float] = None, query_vector: Any = None) -> Optional[Dict[str, Any]]:
+        """匹配固定问答，返回 {"answer", "question", "score", "method"}，未命中返回 None
+
+        字符匹配未命中且启用了向量匹配时，使用 query_vector (与检索共用，避免重复嵌入) 或现场嵌入查询。
+        """
+        match = self.match_text(query, threshold)
+        if match or not self.uses_embedding: return match
+        return self.match_vector(query_vector if query_vector is not None else self.embeddings.embed_query(query))
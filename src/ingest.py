@@ -0,0 +1,136 @@
+import os, json, shutil, itertools, multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Dict, List, Iterator, Any
+import numpy as np
+from langchain_core.documents import Document
+from src.utils import Config, setup_logger
+from src.chunking import split_text, CHUNKER_VERSION
+from src.document_loader import iter_source_records, load_record
+from src.vector_store import VectorStore, SQLiteDocstore, new_version_path, publish_version
+
+def _batched(iterable: Iterator[Any], size: int) -> Iterator[List[Any]]:
+    """将迭代器按固定大小分批"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch: return
+        yield batch
+
+class IngestPipeline:
+    """流式批量入库: 多进程解析 → 切分 → 批量嵌入 → 分片落盘 (带断点) → 合并为一个向量库
+
+    工作目录 (<output>.ingest/) 中保存 checkpoint.json 与 shards/，中断后重新运行会从最后一个完成的分片继续。
+    """
+    CHECKPOINT_FILE = "checkpoint.json"
+
+    def __init__(self, output_path: str, work_dir: Optional[str] = None, batch_docs: int = 64, workers: Optional[int] = None,
+                 shard_chunks: int = 5000, embed_batch_size: int = 32, index_cfg: Optional[Dict[str, Any]] = None, embeddings: Any = None):
+        self.cfg = Config()
+        self.logger = setup_logger('log')
+        self.output_path = output_path
+        self.work_dir = work_dir or output_path.rstrip('/\\') + ".ingest"
+        self.shards_dir = os.path.join(self.work_dir, "shards")
+        self.batch_docs = batch_docs
+        self.workers = workers or os.cpu_count() or 1
+        self.shard_chunks = shard_chunks
+        self.embed_batch_size = embed_batch_size
+        self.index_cfg = index_cfg if index_cfg is not None else self.cfg.get('vector_db').get('index', {})
+        self.embeddings = embeddings or self._create_embeddings()
+        self._docs: List[Document] = [] # 当前分片待写入的分块
+        self._vectors: List[Any] = []    # 与 _docs 对应的向量批次
+
+    def _create_embeddings(self):
+        from src.embedding_service import EmbeddingService
+        return EmbeddingService() # 与运行时共用同一个模型实例
+
+    # --- 断点 ---
+    def _signature(self, sources: List[str]) -> Dict[str, Any]:
+        embedding_cfg = self.cfg.get('embedding')
+        return {"sources": [os.path.abspath(s) for s in sources], "model_name": embedding_cfg['model_name'],
+                "backend": [embedding_cfg.get('backend', 'torch'), embedding_cfg.get('onnx_quantize', True)],
+                "chunk_size": embedding_cfg['chunk_size'], "chunk_overlap": embedding_cfg['chunk_overlap'],
+                "chunker": [embedding_cfg.get('chunker', 'markdown'), CHUNKER_VERSION]}
+
+    def _load_checkpoint(self, sources: List[str], fresh: bool) -> Dict[str, Any]:
+        path = os.path.join(self.work_dir, self.CHECKPOINT_FILE)
+        signature = self._signature(sources)
+        if not fresh and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f: checkpoint = json.load(f)
+            if checkpoint.get('signature') == signature:
+                self.logger.info(f"从断点继续: 已处理 {checkpoint['processed']} 条记录, {len(checkpoint['shards'])} 个分片")
+                return checkpoint
+            self.logger.warning("数据源或切分配置已变化，忽略旧断点重新入库")
+        if os.path.exists(self.work_dir): shutil.rmtree(self.work_dir)
+        os.makedirs(self.shards_dir, exist_ok=True)
+        return {"signature": signature, "processed": 0, "chunks": 0, "shards": []}
+
+    def _save_checkpoint(self, checkpoint: Dict[str, Any]) -> None:
+        path = os.path.join(self.work_dir, self.CHECKPOINT_FILE)
+        with open(path + ".tmp", 'w', encoding='utf-8') as f: json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+        os.replace(path + ".tmp", path) # 原子替换, 中断时不会留下损坏的断点
+
+    # --- 处理 ---
+    def _consume(self, records: List[Dict[str, Any]]) -> None:
+        """切分并嵌入一批已解析的记录"""
+        docs = []
+        for record in records:
+            if record.get('error'): self.logger.warning(f"解析失败, 跳过 {record['doc_id']}: {record['error']}")
+            if not (record.get('text') or "").strip(): continue
+            docs.extend(split_text(record['text'], {"source": record['source'], "doc_id": record['doc_id'], "candidate_id": record['doc_id']}))
+        for batch in _batched(docs, self.embed_batch_size):
+            self._vectors.append(np.asarray(self.embeddings.embed_documents([d.page_content for d in batch]), dtype='float32'))
+            self._docs.extend(batch)
+
+    def _flush_shard(self, checkpoint: Dict[str, Any], processed: int) -> None:
+        """将当前缓冲写为一个分片并推进断点"""
+        name = f"shard_{len(checkpoint['shards']):05d}"
+        shard_dir = os.path.join(self.shards_dir, name)
+        if os.path.exists(shard_dir): shutil.rmtree(shard_dir) # 上次中断时写了一半的分片
+        os.makedirs(shard_dir)
+        if self._docs:
+            docstore = SQLiteDocstore(os.path.join(shard_dir, VectorStore.DOCSTORE_FILE))
+            docstore.add(self._docs)
+            docstore.close()
+            np.save(os.path.join(shard_dir, "vectors.npy"), np.concatenate(self._vectors))
+            checkpoint['shards'].append(name)
+        checkpoint['chunks'] += len(self._docs)
+        checkpoint['processed'] = processed
+        self._save_checkpoint(checkpoint)
+        self.logger.info(f"分片 {name} 已写入: {len(self._docs)} 个分块, 累计处理 {processed} 条记录")
+        self._docs, self._vectors = [], []
+
+    def run(self, sources: List[str], fresh: bool = False, keep_shards: bool = False) -> Optional[VectorStore]:
+        """执行入库，返回合并后的向量库"""
+        checkpoint = self._load_checkpoint(sources, fresh)
+        processed = checkpoint['processed']
+        records = itertools.islice(itertools.chain.from_iterable(iter_source_records(s) for s in sources), processed, None)
+        # spawn: 嵌入服务 / 模型已在本进程中启动线程, fork 出的解析进程可能继承被占用的锁而死锁
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            inflight = deque() # 最多预取一批, 解析与嵌入重叠进行且内存有界
+            for batch in _batched(records, self.batch_docs):
+                inflight.append((len(batch), pool.map(load_record, batch)))
+                if len(inflight) < 2: continue
+                count, parsed = inflight.popleft()
+                self._consume(list(parsed))
+                processed += count
+                if len(self._docs) >= self.shard_chunks: self._flush_shard(checkpoint, processed)
+            while inflight:
+                count, parsed = inflight.popleft()
+                self._consume(list(parsed))
+                processed += count
+        if self._docs or processed != checkpoint['processed']: self._flush_shard(checkpoint, processed)
+        if not checkpoint['shards']:
+            self.logger.warning("没有可入库的内容")
+            return None
+        self.logger.info(f"开始合并 {len(checkpoint['shards'])} 个分片, 共 {checkpoint['chunks']} 个分块")
+        # 写入新的版本目录后原子切换 CURRENT, 在线服务在下次检查时切换到新版本, 期间继续使用旧版本
+        version, version_path = new_version_path(self.output_path)
+        try: store = VectorStore.build_from_shards(version_path, [os.path.join(self.shards_dir, s) for s in checkpoint['shards']], self.index_cfg)
+        except Exception:
+            shutil.rmtree(version_path, ignore_errors=True)
+            raise
+        publish_version(self.output_path, version, int(self.cfg.get('vector_db').get('keep_versions', 2)))
+        if not keep_shards: shutil.rmtree(self.work_dir, ignore_errors=True)
+        self.logger.info(f"入库完成: {self.output_path} (版本 {version}), 共 {store.ntotal} 个向量")
+        return store
@@ -0,0 +1,117 @@
+import time, uuid, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Tuple, Callable, Any
+from src.utils import Config, setup_logger
+
+class KnowledgeBaseJobQueue:
+    """后台知识库构建任务队列 (进程级单例)
+
+    任务在独立线程池中执行，提交后立即返回 job_id，调用方通过 status() 轮询进度。
+    同一租户的同类 (kind) 任务依次执行: 与进行中的任务内容键 (content_key) 相同时直接返回该任务;
+    否则作为后续任务排队, 在进行中的任务结束后执行, 排队中内容键相同的任务只保留一个。
+    content_key 为 None 表示 "执行时的最新状态" (如合并), 不与进行中的任务合并, 排队中只保留一个。
+    任务函数签名: fn(progress) -> bool，progress(比例 0~1, 说明文字) 用于上报进度。
+    """
+    QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._instance_lock:
+            if cls._instance is None: cls._instance = super().__new__(cls) # 单例模式 (进程内共享)
+        return cls._instance
+
+    def __init__(self):
+        if not hasattr(self, 'initialized'):
+            cfg = Config().get().get('jobs') or {}
+            self.logger = setup_logger('log')
+            self.max_history = int(cfg.get('max_history', 100)) # 保留的已结束任务数
+            self._executor = ThreadPoolExecutor(max_workers=max(1, int(cfg.get('workers', 1))), thread_name_prefix="kb-job")
+            self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+            self._active: Dict[Tuple[str, str], str] = {} # (租户, 任务类型) → 进行中的 job_id
+            self._followups: Dict[Tuple[str, str], "OrderedDict[Optional[str], Tuple[str, Callable]]"] = {} # 等待进行中任务结束的后续任务 (内容键 → job_id, fn)
+            self._lock = threading.Lock()
+            self.initialized = True
+
+    def submit(self, tenant_id: Optional[str], fn: Callable[[Callable[[float, str], None]], bool], description: str = "", kind: str = "build",
+               content_key: Optional[str] = None) -> str:
+        """提交任务 (kind: build 构建 / compact 合并 / answers 预计算回答)，返回 job_id"""
+        tenant = tenant_id or "default"
+        key = (tenant, kind)
+        with self._lock:
+            active_id = self._active.get(key)
+            if active_id and content_key is not None and self._jobs[active_id]["content_key"] == content_key:
+                self.logger.info(f"租户 {tenant} 已有内容相同的进行中 {kind} 任务 {active_id}，不重复提交")
+                return active_id
+            followups = self._followups.setdefault(key, OrderedDict())
+            if active_id and content_key in followups:
+                self.logger.info(f"租户 {tenant} 已有排队中的 {kind} 后续任务 {followups[content_key][0]}，不重复提交")
+                return followups[content_key][0]
+            job_id = uuid.uuid4().hex[:12]
+            self._jobs[job_id] = {"job_id": job_id, "tenant_id": tenant, "kind": kind, "content_key": content_key, "status": self.QUEUED, "progress": 0.0,
+                                  "message": description or "排队中", "error": None, "created_at": time.time(), "finished_at": None}
+            self._trim()
+            if active_id: # 同类任务进行中: 结束后再执行 (同一知识库的写入不能并发)
+                followups[content_key] = (job_id, fn)
+                self.logger.info(f"已提交知识库 {kind} 任务 {job_id}: tenant={tenant}, 等待任务 {active_id} 结束")
+                return job_id
+            self._active[key] = job_id
+        self._executor.submit(self._run, job_id, fn)
+        self.logger.info(f"已提交知识库 {kind} 任务 {job_id}: tenant={tenant}")
+        return job_id
+
+    def _update(self, job_id: str, **fields: Any) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job: job.update(fields)
+
+    def _run(self, job_id: str, fn: Callable[[Callable[[float, str], None]], bool]) -> None:
+        self._update(job_id, status=self.RUNNING, message="构建中")
+        def progress(fraction: float, message: str = "") -> None:
+            self._update(job_id, progress=max(0.0, min(1.0, float(fraction))), **({"message": message} if message else {}))
+        try:
+            success = fn(progress)
+            if success: self._update(job_id, status=self.SUCCEEDED, progress=1.0, message="知识库已构建并发布")
+            else: self._update(job_id, status=self.FAILED, message="知识库构建失败")
+        except Exception as e:
+            self.logger.error(f"知识库构建任务 {job_id} 失败: {e}", exc_info=True)
+            self._update(job_id, status=self.FAILED, message="知识库构建失败", error=str(e))
+        finally:
+            self._finish(job_id)
+
+    def _finish(self, job_id: str) -> None:
+        """任务结束: 有排队的后续任务时按提交顺序启动下一个"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job: job["finished_at"] = time.time()
+            key = next((key for key, active_id in self._active.items() if active_id == job_id), None)
+            if key is None: return
+            followups = self._followups.get(key)
+            if not followups:
+                del self._active[key]
+                self._followups.pop(key, None)
+                return
+            _, (next_id, fn) = followups.popitem(last=False)
+            self._active[key] = next_id
+        self._executor.submit(self._run, next_id, fn)
+
+    def _trim(self) -> None:
+        """只保留最近的若干个已结束任务"""
+        finished = [job_id for job_id, job in self._jobs.items() if job["status"] in (self.SUCCEEDED, self.FAILED)]
+        for job_id in finished[:max(0, len(finished) - self.max_history)]: del self._jobs[job_id]
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """任务状态快照 (不存在返回 None)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def wait(self, job_id: str, timeout: Optional[float] = None, interval: float = 0.2) -> Optional[Dict[str, Any]]:
+        """阻塞等待任务结束 (脚本与测试使用)"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.status(job_id)
+            if job is None or job["status"] in (self.SUCCEEDED, self.FAILED): return job
+            if deadline is not None and time.monotonic() >= deadline: return job
+            time.sleep(interval)
@@ -0,0 +1,192 @@
+import os, re, time, shutil, hashlib, threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional, Dict, List, Tuple, Iterator, Any
+from src.utils import Config, setup_logger
+from src.vector_store import VectorStore, read_current_version, resolve_store_path, new_version_path, publish_version
+
+class KnowledgeBaseRegistry:
+    """进程级知识库注册表: 每个租户/简历 ID 一个独立的向量库目录, 内存中只保留最近使用的若干个 (LRU)
+
+    - 租户 None 或 "default" 对应 vector_db.path (原全局知识库)
+    - 其他租户位于 vector_db.tenants_dir/<tenant_id>/
+    - 每次重建写入新的版本目录, 完成后原子切换 CURRENT 指针; 查询始终使用已发布的完整版本, 不等待也看不到重建过程
+    - 冷租户在首次查询时按 mmap 方式惰性加载
+    - 增量写入与合并持有租户构建锁, 查询不获取该锁
+    - 被淘汰或被新版本替换的实例在最后一个使用方 (lease) 结束后关闭, 释放文档存储连接与文件句柄
+    """
+    DEFAULT_TENANT = "default"
+    VERSION_CHECK_INTERVAL = 1.0 # 秒, 检查其他进程是否发布了新版本的最小间隔
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._instance_lock:
+            if cls._instance is None: cls._instance = super().__new__(cls) # 单例模式 (进程内共享)
+        return cls._instance
+
+    def __init__(self):
+        if not hasattr(self, 'initialized'):
+            cfg = Config().get('vector_db')
+            self.logger = setup_logger('log')
+            self.default_path = cfg['path']
+            self.tenants_dir = cfg.get('tenants_dir', 'data/tenants')
+            self.max_loaded = max(1, int(cfg.get('max_loaded', 8)))
+            self.keep_versions = max(1, int(cfg.get('keep_versions', 2)))
+            self.index_cfg = cfg.get('index', {})
+            self._stores: "OrderedDict[str, Tuple[VectorStore, float]]" = OrderedDict() # 已加载的向量库及上次版本检查时间, 按最近使用排序
+            self._lock = threading.Lock() # 保护 LRU 结构
+            self._load_locks: Dict[str, threading.Lock] = {} # 每租户加载锁, 避免重复加载
+            self._build_locks: Dict[str, threading.RLock] = {} # 每租户构建锁, 串行化重建 (查询不获取)
+            self._readers: Dict[VectorStore, int] = {} # 正在使用 (lease) 的实例 → 使用方数量
+            self._retired = set() # 已移出注册表、等待使用方结束后关闭的实例
+            self.initialized = True
+
+    def _key(self, tenant_id: Optional[str]) -> str:
+        return self.DEFAULT_TENANT if tenant_id in (None, "", self.DEFAULT_TENANT) else str(tenant_id)
+
+    @staticmethod
+    def tenant_dirname(key: str) -> str:
+        """租户 ID → 目录名 (一一对应): 小写字母数字、_ 与 - 组成且不超过 64 字符的 ID 原样使用 (如界面的内容哈希 ID),
+        其他 ID 使用 "h." + sha256 (含 ".", 不会与原样使用的 ID 冲突; 不区分大小写的文件系统上也不冲突)"""
+        if re.fullmatch(r'[0-9a-z_\-]{1,64}', key): return key
+        return "h." + hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def tenant_path(self, tenant_id: Optional[str]) -> str:
+        """租户知识库根目录"""
+        key = self._key(tenant_id)
+        if key == self.DEFAULT_TENANT: return self.default_path
+        return os.path.join(self.tenants_dir, self.tenant_dirname(key))
+
+    def tenant_lock(self, tenant_id: Optional[str]) -> threading.RLock:
+        """获取租户构建锁 (重建时持有, 查询不受影响)"""
+        key = self._key(tenant_id)
+        with self._lock: return self._build_locks.setdefault(key, threading.RLock())
+
+    def _load_lock(self, key: str) -> threading.Lock:
+        with self._lock: return self._load_locks.setdefault(key, threading.Lock())
+
+    def exists(self, tenant_id: Optional[str]) -> bool:
+        root = self.tenant_path(tenant_id)
+        return VectorStore.exists(resolve_store_path(root)) or VectorStore.has_legacy(root)
+
+    def _is_stale(self, key: str, store: VectorStore) -> bool:
+        """其他进程 (如离线入库) 是否已发布了更新的版本"""
+        current = read_current_version(self.tenant_path(key))
+        return current is not None and current != store.version
+
+    def get(self, tenant_id: Optional[str] = None, embeddings: Any = None) -> Optional[VectorStore]:
+        """取得租户当前版本的向量库，未加载时惰性加载；不存在返回 None"""
+        key = self._key(tenant_id)
+        with self._lock:
+            entry = self._stores.get(key)
+            if entry is not None:
+                self._stores.move_to_end(key)
+                store, checked_at = entry
+                if time.monotonic() - checked_at < self.VERSION_CHECK_INTERVAL: return store
+                self._stores[key] = (store, time.monotonic())
+        if entry is not None and not self._is_stale(key, entry[0]): return entry[0]
+        with self._load_lock(key): # 同一租户只加载一次, 其他租户不受影响
+            with self._lock:
+                entry = self._stores.get(key)
+            if entry is not None and not self._is_stale(key, entry[0]): return entry[0]
+            root = self.tenant_path(key)
+            store_path = resolve_store_path(root)
+            if VectorStore.exists(store_path):
+                self.logger.info(f"加载租户 {key} 的向量库: {store_path}")
+                store = VectorStore.load(store_path, index_cfg=self.index_cfg)
+            elif VectorStore.has_legacy(root) and embeddings is not None:
+                self.logger.info(f"检测到旧格式向量库 (index.pkl)，转换为 mmap 格式: {root}")
+                version, version_path = new_version_path(root)
+                store = VectorStore.migrate_legacy(root, embeddings, self.index_cfg, target_path=version_path)
+                publish_version(root, version, self.keep_versions)
+            else:
+                return None
+            self._put(key, store)
+            return store
+
+    @contextmanager
+    def lease(self, tenant_id: Optional[str] = None, embeddings: Any = None) -> Iterator[Optional[VectorStore]]:
+        """取得租户当前版本的向量库并在 with 块内持有: 期间被淘汰或替换的实例等块结束后才关闭; 不存在时为 None"""
+        key = self._key(tenant_id)
+        while True:
+            store = self.get(key, embeddings)
+            if store is None:
+                yield None
+                return
+            with self._lock:
+                entry = self._stores.get(key)
+                if entry is not None and entry[0] is store: # 仍在注册表中 (未被并发淘汰), 登记后不会被关闭
+                    self._readers[store] = self._readers.get(store, 0) + 1
+                    break
+        try: yield store
+        finally:
+            with self._lock:
+                self._readers[store] -= 1
+                idle = self._readers[store] == 0
+                if idle: del self._readers[store]
+                closing = idle and store in self._retired
+                if closing: self._retired.discard(store)
+            if closing: self._close(store)
+
+    def _retire(self, store: VectorStore) -> List[VectorStore]:
+        """(持有 _lock 时调用) 实例移出注册表: 没有使用方时返回以便立即关闭, 否则等最后一个使用方结束"""
+        if self._readers.get(store):
+            self._retired.add(store)
+            return []
+        return [store]
+
+    def _close(self, store: VectorStore) -> None:
+        try: store.close()
+        except Exception as e: self.logger.warning(f"关闭向量库失败: {store.path}, {e}")
+
+    def _put(self, key: str, store: VectorStore) -> None:
+        """登记 (或替换) 租户的向量库实例，超出容量时淘汰最久未使用的租户; 移出的实例在使用方结束后关闭"""
+        with self._lock:
+            previous = self._stores.get(key)
+            closing = self._retire(previous[0]) if previous is not None and previous[0] is not store else []
+            self._stores[key] = (store, time.monotonic())
+            self._stores.move_to_end(key)
+            while len(self._stores) > self.max_loaded:
+                evicted, (evicted_store, _) = self._stores.popitem(last=False)
+                self.logger.info(f"LRU 淘汰租户向量库: {evicted}")
+                closing += self._retire(evicted_store)
+        for old in closing: self._close(old)
+
+    def new_version(self, tenant_id: Optional[str]) -> Tuple[str, str]:
+        """为租户分配新的版本目录, 返回 (版本号, 目录)"""
+        return new_version_path(self.tenant_path(tenant_id))
+
+    def publish(self, tenant_id: Optional[str], version: str, store: VectorStore) -> None:
+        """发布构建完成的新版本: 原子切换 CURRENT 指针, 并替换内存中的实例 (旧实例的持有者不受影响)"""
+        key = self._key(tenant_id)
+        publish_version(self.tenant_path(key), version, self.keep_versions)
+        self._put(key, store)
+        self.logger.info(f"租户 {key} 已切换到新版本: {version}")
+
+    def compact(self, tenant_id: Optional[str]) -> Optional[VectorStore]:
+        """合并租户向量库 (物理删除已删除分块、并入增量向量) 并作为新版本发布; 期间查询继续使用当前版本"""
+        key = self._key(tenant_id)
+        with self.tenant_lock(key), self.lease(key) as store: # 与增量写入互斥, 合并期间的写入不会丢失
+            if store is None: return None
+            version, version_path = self.new_version(key)
+            try: compacted = store.compact(version_path, self.index_cfg)
+            except Exception:
+                shutil.rmtree(version_path, ignore_errors=True)
+                raise
+            self.publish(key, version, compacted)
+            return compacted
+
+    def evict(self, tenant_id: Optional[str]) -> None:
+        """从内存中移除租户向量库 (磁盘数据保留), 实例在使用方结束后关闭"""
+        with self._lock:
+            entry = self._stores.pop(self._key(tenant_id), None)
+            closing = self._retire(entry[0]) if entry is not None else []
+        for store in closing: self._close(store)
+
+    def current_version(self, tenant_id: Optional[str]) -> Optional[str]:
+        """租户当前发布的版本号 (未版本化时为 None)"""
+        return read_current_version(self.tenant_path(tenant_id))
+
+    def loaded_tenants(self):
+        with self._lock: return list(self._stores.keys())
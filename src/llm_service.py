@@ -1,8 +1,31 @@
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer, TextStreamer, StoppingCriteria, StoppingCriteriaList
 from src.utils import Config, setup_logger
+from src.admission import AdmissionController, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from src.cancellation import GenerationCancelled, current_token
+from src.singleflight import DEFAULT_SINGLEFLIGHT_CFG, SingleFlight, flight_key
 from datetime import datetime
-from typing import Optional, Dict, List, Tuple, Any # 增加类型提示
+from typing import Optional, Dict, List, Tuple, Callable, Any # 增加类型提示
+
+class _CallbackStreamer(TextStreamer):
+    """生成过程中把逐段解码的文本交给回调 (流式输出)"""
+    def __init__(self, tokenizer: Any, callback: Callable[[str], None]):
+        super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        self.callback = callback
+
+    def on_finalized_text(self, text: str, stream_end: bool = False) -> None:
+        if text: self.callback(text)
+
+class GenerationError(Exception):
+    """模型生成失败 (模型未加载、推理出错等); 由上层返回 type 为 error 的回答, 不会被缓存"""
+
+class _TokenStoppingCriteria(StoppingCriteria):
+    """每个解码步检查取消令牌, 取消或超过截止时间时停止生成"""
+    def __init__(self, token: Any):
+        self.token = token
+
+    def __call__(self, input_ids: Any, scores: Any, **kwargs: Any) -> Any:
+        return torch.full((input_ids.shape[0],), self.token.should_stop(), dtype=torch.bool, device=input_ids.device)
 
 class LLMService:
     # --- 定义常量 ---
@@ -17,7 +40,8 @@ class LLMService:
     PROMPT_TYPE_WEATHER_TIP = "weather_tip"
     # --- 常量定义结束 ---
 
-    def __init__(self):
+    def __init__(self, use_replicas: bool = True):
+        """replica_pool.enabled 时生成在模型副本进程中执行, 本进程不加载模型 (副本进程内以 use_replicas=False 加载)"""
         self.cfg: Dict[str, Any] = Config().get('model')
         self.logger = setup_logger('log')
         self.tokenizer: Optional[AutoTokenizer] = None
@@ -26,7 +50,14 @@ class LLMService:
         # 使用 device_map="auto" 后，此变量主要用于日志记录偏好
         self.target_device_preference: str = self.cfg.get('device', 'cuda' if torch.cuda.is_available() else 'cpu')
         self.logger.info(f"设备偏好设置: {self.target_device_preference} (实际由 device_map='auto' 决定)")
-        self.load_model()
+        self.admission = AdmissionController.shared() if use_replicas else None # 生成并发上限与排队 (副本进程内不再限制)
+        flight_cfg = {**DEFAULT_SINGLEFLIGHT_CFG, **(Config().get().get('singleflight') or {})}
+        self.flights = SingleFlight() if use_replicas and flight_cfg['enabled'] and flight_cfg['generation'] else None # 相同的 RAG 生成合并
+        self.replicas = None
+        if use_replicas and (Config().get().get('replica_pool') or {}).get('enabled'):
+            from src.replica_pool import ReplicaPool
+            self.replicas = ReplicaPool.shared()
+        else: self.load_model()
 
     def load_model(self) -> None:
         """加载模型和分词器 (使用 device_map='auto')"""
@@ -107,11 +138,35 @@ class LLMService:
         # self.logger.debug(f"Formatted Prompt:\n{formatted_prompt}")
         return formatted_prompt
 
-    def generate_response(self, query: str, history: Optional[List[Dict[str, Any]]] = None, max_length: Optional[int] = None, temperature: Optional[float] = None, prompt_type: str = PROMPT_TYPE_GENERAL, context: Optional[str] = None) -> str:
-        """生成回复 (包含历史记录)"""
+    def generate_response(self, query: str, history: Optional[List[Dict[str, Any]]] = None, max_length: Optional[int] = None, temperature: Optional[float] = None, prompt_type: str = PROMPT_TYPE_GENERAL, context: Optional[str] = None, on_text: Optional[Callable[[str], None]] = None) -> str:
+        """生成回复 (包含历史记录); on_text 为流式回调, 生成过程中逐段收到新解码的文本
+
+        启用 admission 时先获取执行名额: 天气提示优先, RAG 长回答排在后面; 名额与队列都已满时抛出 ServerBusyError。
+        当前调用链上有取消令牌 (见 cancellation.py) 时每个解码步检查一次: 取消抛出 GenerationCancelled,
+        超过截止时间抛出 DeadlineExceeded (携带已生成的部分回答); 模型未加载或推理出错时抛出 GenerationError。
+        RAG 生成不采样 (do_sample=False), 输入相同的并发调用只生成一次并共享结果与流式文本, 跟随者不占用执行名额。
+        """
+        args = (query, history, max_length, temperature, prompt_type, context)
+        if self.flights is None or prompt_type != self.PROMPT_TYPE_RAG: return self._admitted_response(*args, on_text)
+        key = flight_key(prompt_type, query, context, max_length, [(m.get("role"), str(m.get("content"))) for m in history or []])
+        return self.flights.do(key, lambda publish: self._admitted_response(*args, publish), on_text)
+
+    def _admitted_response(self, *args: Any) -> str:
+        if self.admission is None: return self._generate_response(*args)
+        prompt_type = args[4]
+        priority = {self.PROMPT_TYPE_WEATHER_TIP: PRIORITY_HIGH, self.PROMPT_TYPE_RAG: PRIORITY_LOW}.get(prompt_type, PRIORITY_NORMAL)
+        with self.admission.admit(priority): return self._generate_response(*args)
+
+    def _generate_response(self, query: str, history: Optional[List[Dict[str, Any]]], max_length: Optional[int], temperature: Optional[float],
+                           prompt_type: str, context: Optional[str], on_text: Optional[Callable[[str], None]]) -> str:
+        token = current_token()
+        if token is not None: token.raise_if_stopped() # 排队期间已被取消或超时
+        if self.replicas is not None:
+            return self.replicas.generate(query, history=history, max_length=max_length, temperature=temperature, prompt_type=prompt_type, context=context,
+                                          on_text=on_text, cancel_token=token)
         if self.model is None or self.tokenizer is None:
              self.logger.error("模型或分词器未加载...")
-             return "错误：模型或分词器未初始化。"
+             raise GenerationError("模型或分词器未初始化")
         history = history or []
         try:
             max_tokens = max_length or self.cfg.get('max_length', 2048)
@@ -132,6 +187,8 @@ class LLMService:
                 if current_do_sample:
                     gen_kwargs["temperature"] = temp
                     gen_kwargs["top_p"] = self.cfg.get('top_p', 0.8)
+                if on_text: gen_kwargs["streamer"] = _CallbackStreamer(self.tokenizer, on_text)
+                if token is not None: gen_kwargs["stopping_criteria"] = StoppingCriteriaList([_TokenStoppingCriteria(token)])
                 outputs = self.model.generate(**inputs, **gen_kwargs)
             response_ids = outputs[0][inputs.input_ids.shape[1]:]
             response = self.tokenizer.decode(response_ids, skip_special_tokens=True)
@@ -139,10 +196,12 @@ class LLMService:
             response = response.replace("<|endoftext|>", "").replace(self.IM_END, "").strip()
             if response.lower().endswith("riott"):
                 response = response[:-5].rstrip() # Remove "riott" and any trailing whitespace before it
+            if token is not None: token.raise_if_stopped(partial=response) # 被令牌提前停止
             return response
+        except GenerationCancelled: raise
         except Exception as e:
             self.logger.error(f"生成回复失败: {e}", exc_info=True)
-            return f"生成回复时出错: {str(e)}"
+            raise GenerationError(f"生成回复时出错: {e}") from e
     
     def _extract_weather_params(self, query: str) -> Optional[Dict[str, Any]]:
         """从查询中提取天气参数"""
@@ -179,7 +238,7 @@ class LLMService:
         context_for_tool = f"你刚刚调用了工具 '{tool_name}'，得到结果如下：\n---\n{tool_result}\n---\n现在请根据这个结果回答用户最初的问题：'{query}'"
         return self.generate_response(query=context_for_tool, history=history, prompt_type=self.PROMPT_TYPE_GENERAL)
     
-    def process_rag_query(self, query: str, context: str, history: Optional[List[Dict[str, Any]]] = None) -> str:
+    def process_rag_query(self, query: str, context: str, history: Optional[List[Dict[str, Any]]] = None, on_text: Optional[Callable[[str], None]] = None) -> str:
         """处理带知识库上下文的查询 (包含历史)"""
         history = history or []
-        return self.generate_response(query, history=history, prompt_type=self.PROMPT_TYPE_RAG, context=context) 
\ No newline at end of file
+        return self.generate_response(query, history=history, prompt_type=self.PROMPT_TYPE_RAG, context=context, on_text=on_text) 
\ No newline at end of file
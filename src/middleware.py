@@ -5,15 +5,26 @@ from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnablePassthrough
 from langchain_core.tools import tool
 from src.utils import Config, setup_logger
-from src.tools import get_weather
+from src.tools import get_weather, aget_weather
 from typing import List, Dict, Any, Optional
 import logging
-from src.llm_service import LLMService
-import re
+from src.llm_service import LLMService, GenerationError
+from src.admission import ServerBusyError
+from src.cancellation import GenerationCancelled
+import re, asyncio, threading, contextvars
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+# 非 RAG 模式下的意图关键词
+RAG_KEYWORDS = ["经历", "经验", "项目", "工作", "职业", "技能", "能力", "学习", "教育",
+                "做过", "参与", "负责", "开发", "设计", "实现", "完成", "成果"]
+WEATHER_KEYWORDS = ["天气", "气温", "温度", "下雨", "下雪","热","冷","出门","宅家","防晒","保暖"]
+NEED_RAG_RESPONSE = {"function": "need_rag", "message": "这个问题可能需要查询知识库获取准确信息，请尝试在简历问答模式下提问。"}
+
 class LangchainMiddleware:
     """中间件处理用户查询和工具调用"""
+    _generation_executor = None # 异步路径中执行模型生成的线程池 (进程内共享)
+    _generation_lock = threading.Lock()
     
     def __init__(self, llm_service):
         self.llm_service = llm_service
@@ -27,8 +38,11 @@ class LangchainMiddleware:
                 return tool
         return None
         
-    def process_query(self, query, history=None, rag_context=None):
-        """处理用户查询，调用对应的工具并生成回复 (优先处理RAG, 包含历史)"""
+    def process_query(self, query, history=None, rag_context=None, on_text=None):
+        """处理用户查询，调用对应的工具并生成回复 (优先处理RAG, 包含历史)
+
+        on_text 为流式回调, 只用于 RAG 生成 (其他路径的模型输出还要经过意图判断, 以最终结果为准)。
+        """
         self.logger.info(f"中间件处理查询: {query}, history_len={len(history) if history else 0}, rag_context_present={rag_context is not None}")
         history = history or [] # 确保 history 是列表
 
@@ -37,7 +51,7 @@ class LangchainMiddleware:
             if rag_context:
                 self.logger.info("检测到 RAG 上下文，直接使用 RAG 处理查询 (传递历史)")
                 # --- 修改：将 history 传递给 process_rag_query ---
-                return self.llm_service.process_rag_query(query, history=history, context=rag_context)
+                return self.llm_service.process_rag_query(query, history=history, context=rag_context, on_text=on_text)
                 # --- 修改结束 ---
 
             # 如果没有 RAG 上下文，再执行原来的逻辑：
@@ -52,26 +66,105 @@ class LangchainMiddleware:
                     # 天气查询通常不严重依赖历史，但可以传递以防万一
                     return self._handle_weather_query(query, history=history, params=response.get("data"))
                 elif response.get("function") == "need_rag":
-                    return {"function": "need_rag", "message": "这个问题可能需要查询知识库获取准确信息，请尝试在简历问答模式下提问。"}
+                    return dict(NEED_RAG_RESPONSE)
 
             # 3. 关键词检查 (判断是否需要 RAG - 在非 RAG 模式下)
-            if any(keyword in query for keyword in [
-                "经历", "经验", "项目", "工作", "职业", "技能", "能力", "学习", "教育",
-                "做过", "参与", "负责", "开发", "设计", "实现", "完成", "成果"
-            ]):
-                return {"function": "need_rag", "message": "这个问题可能需要查询知识库获取准确信息，请尝试在简历问答模式下提问。"}
+            if any(keyword in query for keyword in RAG_KEYWORDS):
+                return dict(NEED_RAG_RESPONSE)
 
             # 4. 天气查询处理（后备检查 - 在非 RAG 模式下）
-            if any(keyword in query for keyword in ["天气", "气温", "温度", "下雨", "下雪","热","冷","出门","宅家","防晒","保暖"]):
+            if any(keyword in query for keyword in WEATHER_KEYWORDS):
                 return self._handle_weather_query(query, history=history)
 
             # 5. 返回模型的通用回复
             return response
 
+        except (ServerBusyError, GenerationCancelled): raise # 生成名额已满或已取消/超时, 由上层处理
         except Exception as e:
             self.logger.error(f"处理查询失败: {e}", exc_info=True)
-            return f"处理您的请求时出现错误: {str(e)}"
+            return self._error_response(e, f"处理您的请求时出现错误: {str(e)}")
     
+    # --- 异步路径 ---
+    @classmethod
+    def _get_generation_executor(cls) -> ThreadPoolExecutor:
+        with cls._generation_lock:
+            if cls._generation_executor is None:
+                workers = int((Config().get().get('query_pipeline') or {}).get('generation_workers', 1))
+                cls._generation_executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="generation")
+            return cls._generation_executor
+
+    async def _run_generation(self, fn, *args, **kwargs):
+        """在生成线程池中执行模型调用 (CPU 密集, 不阻塞事件循环); 复制上下文, 使排队选项随请求传递"""
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._get_generation_executor(), lambda: context.run(fn, *args, **kwargs))
+
+    async def aprocess_query(self, query, history=None, rag_context=None, on_text=None):
+        """process_query 的异步版本: 模型生成在生成线程池中执行, 天气查询使用异步网络请求
+
+        generate_response 只返回文本, 非 RAG 模式下命中关键词时同步路径会丢弃通用回复, 这里先判断关键词, 省去一次生成。
+        """
+        self.logger.info(f"中间件处理查询 (async): {query}, history_len={len(history) if history else 0}, rag_context_present={rag_context is not None}")
+        history = history or []
+        try:
+            if rag_context:
+                return await self._run_generation(self.llm_service.process_rag_query, query, history=history, context=rag_context, on_text=on_text)
+            if any(keyword in query for keyword in RAG_KEYWORDS): return dict(NEED_RAG_RESPONSE)
+            if any(keyword in query for keyword in WEATHER_KEYWORDS): return await self._ahandle_weather_query(query, history=history)
+            return await self._run_generation(self.llm_service.generate_response, query, history=history, prompt_type="general")
+        except (asyncio.CancelledError, ServerBusyError, GenerationCancelled): raise
+        except Exception as e:
+            self.logger.error(f"处理查询失败: {e}", exc_info=True)
+            return self._error_response(e, f"处理您的请求时出现错误: {str(e)}")
+
+    @staticmethod
+    def _error_response(error, message):
+        """处理失败的回答 (type 为 error, 流水线不会缓存)"""
+        return {"type": "error", "error": str(error), "response": message}
+
+    # --- 天气查询 ---
+    @staticmethod
+    def _parse_weather_result(tool_result):
+        """天气工具结果 → (天气, 温度, 风力)"""
+        # 尝试匹配温度范围（最低温~最高温）
+        temp_range_match = re.search(r'温度(-?\d+)~(-?\d+)℃', tool_result)
+        if temp_range_match:
+            temp_min = temp_range_match.group(1)
+            temp_max = temp_range_match.group(2)
+            temp = f"{temp_min}~{temp_max}"
+        else:
+            # 如果没有温度范围，尝试匹配单个温度
+            temp_match = re.search(r'温度(-?\d+)℃', tool_result)
+            temp = temp_match.group(1) if temp_match else "未知"
+
+        weather_conditions = ["晴", "阴", "多云", "雨", "雪"]
+        weather = next((w for w in weather_conditions if w in tool_result), "未知")
+
+        wind_match = re.search(r'<(\d+)级', tool_result)
+        wind = wind_match.group(1) if wind_match else "未知"
+        return weather, temp, wind
+
+    @staticmethod
+    def _weather_tip_prompt(location, weather, temp, wind):
+        return f"根据{location}的天气状况（{weather}，气温{temp}℃，风力{wind}级），给出一句温馨提示。要简短自然，不要重复天气相关信息，可以用emoji表情显得更加亲切。"
+
+    @staticmethod
+    def _format_weather(location, date, weather, temp, wind, tip):
+        # 根据日期参数生成不同的时间描述
+        date_desc = {
+            "today": f"今天是{datetime.now().strftime('%Y年%m月%d日')}",
+            "tomorrow": f"明天是{(datetime.now() + timedelta(days=1)).strftime('%Y年%m月%d日')}",
+            "after_tomorrow": f"后天是{(datetime.now() + timedelta(days=2)).strftime('%Y年%m月%d日')}"
+        }.get(date, f"今天是{datetime.now().strftime('%Y年%m月%d日')}")
+
+        # 返回格式化结果，使用两个换行符确保分隔 (温馨提示生成失败时只返回天气)
+        result = f"{date_desc}，{location}天气{weather}，气温{temp}℃，风力{wind}级。"
+        return f"{result}\n\n温馨提示：{tip}" if tip else result
+
+    def _tip_failed(self, error):
+        self.logger.warning(f"温馨提示生成失败, 只返回天气: {error}")
+        return ""
+
     def _handle_weather_query(self, query, history=None, params=None):
         """处理天气查询"""
         history = history or []
@@ -91,41 +184,37 @@ class LangchainMiddleware:
             location = params.get("location", "")
             date = params.get("date", "today")
             tool_result = tool.invoke(f"{location},{date}")
-            
-            # 解析天气数据
-            # 尝试匹配温度范围（最低温~最高温）
-            temp_range_match = re.search(r'温度(-?\d+)~(-?\d+)℃', tool_result)
-            if temp_range_match:
-                temp_min = temp_range_match.group(1)
-                temp_max = temp_range_match.group(2)
-                temp = f"{temp_min}~{temp_max}"
-            else:
-                # 如果没有温度范围，尝试匹配单个温度
-                temp_match = re.search(r'温度(-?\d+)℃', tool_result)
-                temp = temp_match.group(1) if temp_match else "未知"
-            
-            weather_conditions = ["晴", "阴", "多云", "雨", "雪"]
-            weather = next((w for w in weather_conditions if w in tool_result), "未知")
-            
-            wind_match = re.search(r'<(\d+)级', tool_result)
-            wind = wind_match.group(1) if wind_match else "未知"
+            weather, temp, wind = self._parse_weather_result(tool_result)
             
             # 生成温馨提示
-            tip_prompt = f"根据{location}的天气状况（{weather}，气温{temp}℃，风力{wind}级），给出一句温馨提示。要简短自然，不要重复天气相关信息，可以用emoji表情显得更加亲切。"
             # --- 修改：可以考虑将 history 传给 generate_response，但需调整 prompt ---
-            tip = self.llm_service.generate_response(tip_prompt, history=[], prompt_type="weather_tip", max_length=50) # 暂时不传 history
+            try: tip = self.llm_service.generate_response(self._weather_tip_prompt(location, weather, temp, wind), history=[], prompt_type="weather_tip", max_length=50) # 暂时不传 history
+            except GenerationError as e: tip = self._tip_failed(e)
             # --- 修改结束 ---
+            return self._format_weather(location, date, weather, temp, wind, tip)
             
-            # 根据日期参数生成不同的时间描述
-            date_desc = {
-                "today": f"今天是{datetime.now().strftime('%Y年%m月%d日')}",
-                "tomorrow": f"明天是{(datetime.now() + timedelta(days=1)).strftime('%Y年%m月%d日')}",
-                "after_tomorrow": f"后天是{(datetime.now() + timedelta(days=2)).strftime('%Y年%m月%d日')}"
-            }.get(date, f"今天是{datetime.now().strftime('%Y年%m月%d日')}")
-            
-            # 返回格式化结果，使用两个换行符确保分隔
-            return f"{date_desc}，{location}天气{weather}，气温{temp}℃，风力{wind}级。\n\n温馨提示：{tip}"
-            
+        except (ServerBusyError, GenerationCancelled): raise # 生成名额已满或已取消/超时, 由上层处理
+        except Exception as e:
+            self.logger.error(f"处理天气查询失败: {e}", exc_info=True)
+            return self._error_response(e, f"天气查询失败: {str(e)}")
+
+    async def _ahandle_weather_query(self, query, history=None, params=None):
+        """处理天气查询 (异步): 参数解析在本地完成, 网页请求不占用线程, 温馨提示在生成线程池中生成"""
+        try:
+            if not params:
+                weather_params = self.llm_service._extract_weather_params(query)
+                if not weather_params:
+                    return "无法解析天气查询参数"
+                params = weather_params.get("data", {})
+            location = params.get("location", "")
+            date = params.get("date", "today")
+            tool_result = await aget_weather(f"{location},{date}")
+            weather, temp, wind = self._parse_weather_result(tool_result)
+            try: tip = await self._run_generation(self.llm_service.generate_response, self._weather_tip_prompt(location, weather, temp, wind),
+                                                  history=[], prompt_type="weather_tip", max_length=50)
+            except GenerationError as e: tip = self._tip_failed(e)
+            return self._format_weather(location, date, weather, temp, wind, tip)
+        except (asyncio.CancelledError, ServerBusyError, GenerationCancelled): raise
         except Exception as e:
             self.logger.error(f"处理天气查询失败: {e}", exc_info=True)
-            return f"天气查询失败: {str(e)}" 
\ No newline at end of file
+            return self._error_response(e, f"天气查询失败: {str(e)}")
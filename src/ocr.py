@@ -0,0 +1,99 @@
+import os, threading, multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Dict, List, Callable, Iterator, Tuple, Any
+from src.utils import Config, setup_logger
+
+DEFAULT_OCR_CFG = {
+    "lang": "chi_sim+eng", # tesseract 语言包
+    "dpi": 200,            # PDF 渲染分辨率
+    "workers": 0,          # 进程数, 0 表示 CPU 核数
+    "max_inflight": 0,     # 同时在途的页面数上限 (控制内存), 0 表示 2 倍进程数
+    "grayscale": True,     # 灰度化
+    "binarize": False,     # 二值化
+    "threshold": 160,      # 二值化阈值
+    "min_page_chars": 30   # PDF 页面可提取文字少于该值且含图片时才 OCR
+}
+
+def _worker_init() -> None:
+    """OCR 子进程初始化: 限制 tesseract 内部线程, 避免与进程池争抢 CPU"""
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+def preprocess_image(image: Any, opts: Dict[str, Any]) -> Any:
+    """OCR 前的图像预处理 (灰度 / 二值化)"""
+    if opts.get("grayscale") or opts.get("binarize"): image = image.convert("L")
+    if opts.get("binarize"):
+        threshold = int(opts.get("threshold", 160))
+        image = image.point(lambda p: 255 if p > threshold else 0)
+    return image
+
+def ocr_image(image: Any, opts: Dict[str, Any]) -> str:
+    """对单张 PIL 图像执行 OCR"""
+    import pytesseract
+    return pytesseract.image_to_string(preprocess_image(image, opts), lang=opts.get("lang", DEFAULT_OCR_CFG["lang"]))
+
+def _ocr_image_file(path: str, opts: Dict[str, Any]) -> str:
+    from PIL import Image
+    with Image.open(path) as img: return ocr_image(img, opts)
+
+def _ocr_pdf_page(pdf_path: str, page_number: int, opts: Dict[str, Any]) -> str:
+    """在子进程中渲染 PDF 的单页并 OCR (页码从 1 开始), 每次只有一页位图驻留内存"""
+    from pdf2image import convert_from_path
+    images = convert_from_path(pdf_path, dpi=int(opts.get("dpi", 200)), first_page=page_number, last_page=page_number,
+                               grayscale=bool(opts.get("grayscale")))
+    return ocr_image(images[0], opts) if images else ""
+
+class OCREngine:
+    """并行 OCR 引擎: 页面在进程池中按需渲染与识别, 结果按页序流式返回"""
+    _pool = None # 进程内共享的进程池
+    _pool_lock = threading.Lock()
+
+    def __init__(self):
+        self.logger = setup_logger('log')
+        self.opts = {**DEFAULT_OCR_CFG, **(Config().get().get('ocr') or {})}
+        self.workers = int(self.opts["workers"]) or os.cpu_count() or 1
+        self.max_inflight = int(self.opts["max_inflight"]) or self.workers * 2
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with OCREngine._pool_lock:
+            if OCREngine._pool is None:
+                self.logger.info(f"创建 OCR 进程池: {self.workers} 个进程")
+                # spawn: 不继承父进程已启动的线程与锁 (嵌入服务、Streamlit 线程等), 避免 fork 后死锁
+                OCREngine._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_worker_init,
+                                                      mp_context=multiprocessing.get_context("spawn"))
+            return OCREngine._pool
+
+    def _ordered_map(self, fn: Callable, arg_list: List[Tuple], progress: Optional[Callable[[int, int], None]] = None) -> Iterator[str]:
+        """在进程池中执行任务，限制在途任务数，并按提交顺序产出结果"""
+        pool, total, done = self._get_pool(), len(arg_list), 0
+        pending, args_iter = deque(), iter(arg_list)
+        for args in args_iter:
+            pending.append(pool.submit(fn, *args))
+            if len(pending) >= self.max_inflight: break
+        while pending:
+            future = pending.popleft()
+            try: text = future.result()
+            except Exception as e:
+                self.logger.error(f"OCR 任务失败: {e}", exc_info=True)
+                text = ""
+            next_args = next(args_iter, None)
+            if next_args is not None: pending.append(pool.submit(fn, *next_args))
+            done += 1
+            if progress: progress(done, total)
+            yield text
+
+    def ocr_image(self, image: Any) -> str:
+        """在当前进程中识别单张图像"""
+        return ocr_image(image, self.opts)
+
+    def submit_pdf_page(self, pdf_path: str, page_number: int) -> Any:
+        """提交单页 OCR 任务, 返回 Future"""
+        return self._get_pool().submit(_ocr_pdf_page, pdf_path, page_number, self.opts)
+
+    def ocr_pdf_page(self, pdf_path: str, page_number: int) -> str:
+        """在当前进程中识别 PDF 单页 (调用方本身已在子进程中时使用)"""
+        return _ocr_pdf_page(pdf_path, page_number, self.opts)
+
+    def iter_images(self, image_paths: List[str], progress: Optional[Callable[[int, int], None]] = None) -> Iterator[str]:
+        """并行识别多张图片, 按输入顺序产出文本"""
+        return self._ordered_map(_ocr_image_file, [(path, self.opts) for path in image_paths], progress)
@@ -0,0 +1,124 @@
+import os, re, json, time
+from typing import Optional, Dict, List, Any
+from langchain_core.embeddings import Embeddings
+from src.utils import setup_logger
+
+ONNX_EXPORT_VERSION = 1 # 导出逻辑变化时递增, 磁盘上旧版本的产物会重新导出
+META_FILE = "meta.json"
+
+def artifact_dir(model_name: str, root: str) -> str:
+    """模型导出产物的缓存目录 (root/<模型名>)"""
+    return os.path.join(root, re.sub(r'[^0-9A-Za-z_\-.]', '_', model_name))
+
+def read_meta(path: str) -> Optional[Dict[str, Any]]:
+    """导出完成后才写入 meta.json, 不存在说明尚未导出或导出中断"""
+    try:
+        with open(os.path.join(path, META_FILE), 'r', encoding='utf-8') as f: return json.load(f)
+    except (OSError, ValueError): return None
+
+def export_onnx(model_name: str, output_dir: str, quantize: bool = True, opset: int = 14) -> Dict[str, Any]:
+    """将 sentence-transformers 模型导出为 ONNX，可选 int8 动态量化 (权重 int8, 激活运行时量化)，返回 meta
+
+    池化方式 (CLS / 平均) 与是否归一化从模型的 sentence-transformers 配置读取，推理时在 numpy 中完成，
+    输出与 HuggingFaceEmbeddings 一致。
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    logger = setup_logger('log')
+    model = SentenceTransformer(model_name, device='cpu')
+    transformer, tokenizer = model[0].auto_model.eval(), model.tokenizer
+    pooling = next((module for module in model if type(module).__name__ == 'Pooling'), None)
+    if pooling is None or pooling.pooling_mode_cls_token: pooling_mode = "cls"
+    elif pooling.pooling_mode_mean_tokens: pooling_mode = "mean"
+    else: raise ValueError(f"不支持的池化方式: {pooling.get_pooling_mode_str()}")
+    input_names = list(tokenizer.model_input_names)
+
+    class _Encoder(torch.nn.Module):
+        """按位置参数接收输入, 只输出 last_hidden_state"""
+        def __init__(self, inner):
+            super().__init__()
+            self.inner = inner
+        def forward(self, *inputs):
+            return self.inner(**dict(zip(input_names, inputs))).last_hidden_state
+
+    os.makedirs(output_dir, exist_ok=True)
+    if os.path.exists(os.path.join(output_dir, META_FILE)): os.remove(os.path.join(output_dir, META_FILE)) # 导出期间视为未完成
+    fp32_path = os.path.join(output_dir, "model.onnx")
+    sample = tokenizer(["导出示例文本", "sample"], padding=True, return_tensors='pt')
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+    logger.info(f"导出 ONNX 模型: {model_name} → {fp32_path} (pooling={pooling_mode})")
+    with torch.no_grad():
+        torch.onnx.export(_Encoder(transformer), tuple(sample[name] for name in input_names), fp32_path, input_names=input_names,
+                          output_names=["last_hidden_state"], dynamic_axes=dynamic_axes, opset_version=opset, do_constant_folding=True)
+    model_file = "model.onnx"
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(fp32_path, os.path.join(output_dir, "model.int8.onnx"), weight_type=QuantType.QInt8)
+        model_file = "model.int8.onnx"
+        logger.info(f"int8 动态量化完成: {os.path.join(output_dir, model_file)}")
+    tokenizer.save_pretrained(output_dir)
+    meta = {"model_name": model_name, "version": ONNX_EXPORT_VERSION, "file": model_file, "quantized": quantize,
+            "pooling": pooling_mode, "normalize": any(type(module).__name__ == 'Normalize' for module in model),
+            "max_seq_length": model.max_seq_length, "input_names": input_names, "created_at": time.time()}
+    tmp_path = os.path.join(output_dir, META_FILE + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, os.path.join(output_dir, META_FILE))
+    return meta
+
+class OnnxEmbeddings(Embeddings):
+    """onnxruntime 推理的嵌入模型 (CPU)，接口与 HuggingFaceEmbeddings 相同"""
+
+    def __init__(self, path: str, threads: int = 0, batch_size: int = 32):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+        self.meta = read_meta(path)
+        if self.meta is None: raise FileNotFoundError(f"ONNX 模型未导出: {path}")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads: options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(os.path.join(path, self.meta["file"]), options, providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(path)
+        self.batch_size = batch_size
+
+    @classmethod
+    def load_or_export(cls, model_name: str, root: str, quantize: bool = True, threads: int = 0, batch_size: int = 32) -> "OnnxEmbeddings":
+        """读取缓存的导出产物; 不存在或与当前配置不符时先导出"""
+        path = artifact_dir(model_name, root)
+        meta = read_meta(path)
+        if not meta or meta.get("model_name") != model_name or meta.get("version") != ONNX_EXPORT_VERSION or meta.get("quantized") != quantize:
+            export_onnx(model_name, path, quantize=quantize)
+        return cls(path, threads=threads, batch_size=batch_size)
+
+    def _encode(self, texts: List[str]) -> Any:
+        import numpy as np
+        encoded = self.tokenizer(texts, padding=True, truncation=True, max_length=self.meta["max_seq_length"], return_tensors='np')
+        hidden = self.session.run(None, {name: encoded[name].astype('int64') for name in self.meta["input_names"]})[0]
+        if self.meta["pooling"] == "cls": vectors = hidden[:, 0]
+        else:
+            mask = encoded["attention_mask"][..., None].astype('float32')
+            vectors = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.meta["normalize"]: vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        texts = [text.replace("\n", " ") for text in texts] # 与 HuggingFaceEmbeddings 的预处理一致
+        vectors = []
+        for i in range(0, len(texts), self.batch_size): vectors.extend(self._encode(texts[i:i + self.batch_size]).tolist())
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+def parity_check(reference: Embeddings, candidate: Embeddings, texts: List[str]) -> Dict[str, Any]:
+    """对比两个嵌入模型在同一批文本上的输出: 逐条余弦相似度与各自的耗时"""
+    import numpy as np
+    start = time.perf_counter()
+    expected = np.asarray(reference.embed_documents(texts), dtype='float32')
+    reference_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    actual = np.asarray(candidate.embed_documents(texts), dtype='float32')
+    candidate_ms = (time.perf_counter() - start) * 1000
+    cosine = (expected * actual).sum(axis=1) / np.maximum(np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1), 1e-12)
+    return {"texts": len(texts), "min_cosine": round(float(cosine.min()), 6), "mean_cosine": round(float(cosine.mean()), 6),
+            "reference_ms": round(reference_ms, 1), "candidate_ms": round(candidate_ms, 1),
+            "speedup": round(reference_ms / candidate_ms, 2) if candidate_ms else 0.0}
@@ -1,9 +1,15 @@
-import os, json
+import asyncio, hashlib
 from src.utils import Config, setup_logger
 from src.llm_service import LLMService
 from src.middleware import LangchainMiddleware
 from src.resume_rag import ResumeRAG
-import difflib
+from src.kb_jobs import KnowledgeBaseJobQueue
+from src.fixed_qa_index import FixedQAIndex
+from src.answer_store import AnswerStore
+from src.query_pipeline import QueryPipeline, format_rag_context
+from src.retrieval_service import RetrievalClient
+from src.admission import ServerBusyError, request_options
+from src.cancellation import DEFAULT_CANCELLATION_CFG, CancellationToken, GenerationCancelled, cancellation_scope
 
 class QASystem:
     _instance = None
@@ -18,8 +24,11 @@ class QASystem:
             try:
                 self.llm_service = LLMService() # 初始化LLM服务
                 self.middleware = LangchainMiddleware(self.llm_service) # 初始化中间件
-                self.resume_rag = ResumeRAG() # 初始化简历RAG系统
-                self.fixed_qa_data = self._load_fixed_qa()
+                self.resume_rag = self._create_retrieval() # 简历RAG系统 (本地, 或独立检索服务的客户端)
+                self.jobs = KnowledgeBaseJobQueue() # 后台知识库构建任务
+                self.fixed_qa = FixedQAIndex(Config().get().get('fixed_qa'), embeddings=self.resume_rag.embeddings) # 固定问答索引 (文件变化时自动重新加载)
+                self.answers = AnswerStore(Config().get().get('answer_store'), embeddings=self.resume_rag.embeddings) # 离线预计算回答
+                self.pipeline = QueryPipeline(self) # 分阶段查询流水线
                 self.initialized = True
                 self.logger.info("问答系统初始化完成 (包含固定问答)")
                 
@@ -27,111 +36,114 @@ class QASystem:
                 self.logger.error(f"问答系统初始化失败: {e}", exc_info=True)
                 raise
     
-    def _load_fixed_qa(self, filepath="src/fixed_qa.json"):
-        """加载固定问答数据"""
+    def _create_retrieval(self):
+        """retrieval_service.enabled 时连接独立的检索服务 (多个应用进程共享一份模型与索引)，服务不可用时退回本地 ResumeRAG"""
+        if (Config().get().get('retrieval_service') or {}).get('enabled'):
+            client = RetrievalClient()
+            if client.ping():
+                self.logger.info(f"使用检索服务: {client.address}")
+                return client
+            self.logger.warning(f"检索服务 {client.address} 不可用，改为在本进程加载 ResumeRAG")
+        return ResumeRAG()
+
+    def process_query(self, query, history=None, use_rag=True, rag_k=3, tenant_id=None, on_text=None, on_queue=None, cancel_token=None):
+        """处理用户查询的主入口: 路由 → 固定问答 → 缓存 → 预计算回答 → 检索 → 生成 (tenant_id 指定检索的简历知识库)
+
+        命中固定问答或预计算回答时直接返回，不做检索; 回答中的 timings 为各阶段耗时 (ms)。
+        on_text 为流式回调: RAG 生成时逐段收到新生成的文本, 其他情况只返回最终结果。
+        on_queue 为排队位置回调: 生成名额已满需要排队时收到当前位置 (获得名额时为 0); 队列已满时返回 type 为 busy 的回答。
+        cancel_token 被取消 (用户提交新问题、会话关闭) 时生成在下一个解码步停止, 返回 type 为 cancelled 的回答;
+        超过 cancellation.deadline 时返回部分回答 (partial)、固定问答兜底 (fallback) 或超时提示 (timeout)。
+        检索到内容的 RAG 生成与进行中的相同生成 (问题、检索内容与对话历史均相同) 合并, 共享结果与流式文本 (见 QueryPipeline)。
+        """
+        self.logger.info(f"处理查询: {query}, use_rag={use_rag}, rag_k={rag_k}, tenant={tenant_id}, history_len={len(history) if history else 0}")
+        token = self._cancel_token(cancel_token)
         try:
-            if os.path.exists(filepath):
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.logger.info(f"成功加载固定问答数据: {filepath}")
-                    return data.get("fixed_answers", [])
-            else:
-                self.logger.warning(f"固定问答文件未找到: {filepath}")
-                return []
+            with request_options(on_position=on_queue), cancellation_scope(token):
+                return self.pipeline.run(query, history=history, use_rag=use_rag, rag_k=rag_k, tenant_id=tenant_id, on_text=on_text)
+        except ServerBusyError as e: return self._busy_response(e)
+        except GenerationCancelled as e: return self._cancelled_response(query, e)
         except Exception as e:
-            self.logger.error(f"加载固定问答数据失败: {e}", exc_info=True)
-            return []
-
-    def _check_fixed_qa(self, query, threshold=0.7):
-        """检查查询是否匹配固定问答 (使用 SequenceMatcher)"""
-        if not self.fixed_qa_data: return None
-        best_match_answer, highest_similarity = None, 0
-        matched_predefined_q = None
-        cleaned_query = ''.join(filter(str.isalnum, query)).lower()
-        for item in self.fixed_qa_data:
-            for predefined_q in item.get("questions", []):
-                cleaned_predefined_q = ''.join(filter(str.isalnum, predefined_q)).lower()
-                similarity = difflib.SequenceMatcher(None, cleaned_query, cleaned_predefined_q).ratio()
-                if similarity > highest_similarity:
-                    highest_similarity = similarity
-                    if similarity >= threshold:
-                        best_match_answer = item.get("answer")
-                        matched_predefined_q = predefined_q
-        if best_match_answer:
-             log_msg = f"查询 '{query}' 命中固定问答 (匹配问题: '{matched_predefined_q}', 相似度: {highest_similarity:.2f})"
-             self.logger.info(log_msg)
-             # 只返回 response 和 type，rag_context 将使用实际检索结果
-             return {
-                 "response": best_match_answer,
-                 "type": "fixed_answer"
-             }
-        return None
+            self.logger.error(f"查询处理失败: {e}", exc_info=True)
+            return { "type": "error", "error": str(e), "response": f"抱歉...错误: {str(e)}" }
 
-    def process_query(self, query, history=None, use_rag=True, rag_k=3):
-        """处理用户查询的主入口 (RAG模式下先检索再检查固定问答)"""
-        self.logger.info(f"处理查询: {query}, use_rag={use_rag}, rag_k={rag_k}, history_len={len(history) if history else 0}")
-        history = history or []
+    async def aprocess_query(self, query, history=None, use_rag=True, rag_k=3, tenant_id=None, on_text=None, on_queue=None, cancel_token=None):
+        """process_query 的异步版本 (在事件循环中调用): 天气查询为异步网络请求, 嵌入与生成在各自的线程池中执行
 
+        调用方取消 (如客户端断开) 时 CancelledError 向上传播, 尚未开始的嵌入与检索任务随之取消, 正在进行的生成经取消令牌停止。
+        """
+        self.logger.info(f"处理查询 (async): {query}, use_rag={use_rag}, rag_k={rag_k}, tenant={tenant_id}, history_len={len(history) if history else 0}")
+        token = self._cancel_token(cancel_token)
         try:
-            if use_rag:
-                # --- 修改：步骤 1: 先执行 RAG 检索 ---
-                self.logger.info("RAG 模式：执行知识库检索...")
-                context_docs = self.resume_rag.search(query, k=rag_k)
-                rag_context_for_display = "" # 初始化用于显示的 rag_context
-                llm_context = "" # 初始化传递给 LLM 的 context
-                if context_docs:
-                    self.logger.info(f"检索到相关上下文: {len(context_docs)}条")
-                    llm_context = "\n".join([doc.page_content for doc in context_docs])
-                    rag_context_for_display = f"找到 {len(context_docs)} 条相关内容：\n\n" + "\n\n---\n\n".join(
-                        f"**相关度 {i+1}**：\n{doc.page_content}" for i, doc in enumerate(context_docs)
-                    )
-                else: self.logger.info("未找到相关上下文 (RAG)")
-                # --- RAG 检索结束 ---
+            with request_options(on_position=on_queue), cancellation_scope(token):
+                return await self.pipeline.arun(query, history=history, use_rag=use_rag, rag_k=rag_k, tenant_id=tenant_id, on_text=on_text)
+        except asyncio.CancelledError:
+            self.logger.info(f"查询已取消: {query}")
+            token.cancel("caller cancelled")
+            raise
+        except ServerBusyError as e: return self._busy_response(e)
+        except GenerationCancelled as e: return self._cancelled_response(query, e)
+        except Exception as e:
+            self.logger.error(f"查询处理失败: {e}", exc_info=True)
+            return { "type": "error", "error": str(e), "response": f"抱歉...错误: {str(e)}" }
 
-                # --- 修改：步骤 2: 检查固定问答 ---
-                fixed_response = self._check_fixed_qa(query, threshold=0.7)
-                if fixed_response:
-                    self.logger.info("命中固定问答，将使用预设答案，但展示实际检索到的上下文。")
-                    fixed_response["rag_context"] = rag_context_for_display # 使用实际检索的上下文
-                    return fixed_response
-                # --- 固定问答检查结束 ---
+    def _cancel_token(self, cancel_token):
+        """调用方的取消令牌 (没有时新建), 截止时间收紧到 cancellation.deadline"""
+        cfg = {**DEFAULT_CANCELLATION_CFG, **(Config().get().get('cancellation') or {})}
+        return (cancel_token or CancellationToken()).limit(cfg['deadline'])
 
-                # 如果未命中固定问答，继续 RAG 流程 (使用已检索的上下文)
-                self.logger.info("未命中固定问答，继续执行 LLM RAG 处理")
-                if llm_context: # 确保有上下文传递给 LLM
-                    response_from_middleware = self.middleware.process_query(
-                        query, history=history, rag_context=llm_context
-                    )
-                    final_response = response_from_middleware
-                    if isinstance(response_from_middleware, str): final_response = {"response": response_from_middleware}
-                    final_response["rag_context"] = rag_context_for_display # 添加用于显示的上下文
-                    return final_response
-                else:
-                    # RAG 模式但未检索到上下文，且未命中固定问答
-                    self.logger.info("RAG 模式但无上下文且未命中固定答案，转为通用处理")
-                    return self.middleware.process_query(query, history=history, rag_context=None)
+    def _cancelled_response(self, query, error):
+        self.logger.info(f"查询生成已取消 ({error.reason}): {query}")
+        return {"type": "cancelled", "response": "", "reason": error.reason}
 
-            # 如果没有启用RAG，使用普通处理 (调用中间件)
-            response = self.middleware.process_query(query, history=history, rag_context=None)
-            return response
+    def _busy_response(self, error):
+        self.logger.warning(f"生成繁忙，拒绝查询: {error}")
+        return {"type": "busy", "response": str(error), "retry_after": error.retry_after}
 
-        except Exception as e:
-            self.logger.error(f"查询处理失败: {e}", exc_info=True)
-            return { "type": "error", "error": str(e), "response": f"抱歉...错误: {str(e)}" }
+    def get_rag_context(self, query, tenant_id=None, k=3):
+        """按需检索并返回用于展示的检索内容 (固定问答命中时, 用户展开检索内容才调用)"""
+        return format_rag_context(self.resume_rag.search(query, k=k, tenant_id=tenant_id))
     
-    def upload_resume(self, text_content, images=None):
-        """上传并构建简历知识库"""
-        self.logger.info("上传简历并构建知识库")
+    def upload_resume(self, text_content, images=None, tenant_id=None, wait=False):
+        """上传简历并提交后台构建任务 (tenant_id 为简历/租户 ID, 各自独立存储)
+
+        立即返回 job_id, 通过 get_upload_status 轮询进度; 构建期间的查询继续使用该租户已发布的旧版本。
+        wait=True 时阻塞到构建结束 (脚本使用)。
+        """
+        self.logger.info(f"上传简历并提交知识库构建任务: tenant={tenant_id}")
         try:
-            success = self.resume_rag.build_knowledge_base(text_content, images)
-            return {
-                "success": success,
-                "message": "简历上传成功并已构建知识库" if success else "简历上传失败"
-            }
+            job_id = self.jobs.submit(
+                tenant_id, lambda progress: self.resume_rag.build_knowledge_base(text_content, images, tenant_id=tenant_id, progress=progress),
+                description="等待构建知识库", content_key=self._upload_key(text_content, images) # 内容不同的上传排在进行中的构建之后
+            )
+            if wait:
+                job = self.jobs.wait(job_id)
+                success = bool(job) and job["status"] == KnowledgeBaseJobQueue.SUCCEEDED
+                return {"success": success, "job_id": job_id, "message": "简历上传成功并已构建知识库" if success else "简历上传失败"}
+            return {"success": True, "job_id": job_id, "message": "简历已提交，正在后台构建知识库"}
         except Exception as e:
             self.logger.error(f"简历上传失败: {e}", exc_info=True)
             return {
                 "success": False,
                 "error": str(e),
                 "message": f"简历上传失败: {str(e)}"
-            } 
\ No newline at end of file
+            }
+
+    @staticmethod
+    def _upload_key(text_content, images=None):
+        """上传内容 (文本 + 图片字节) 的摘要, 相同内容的重复上传合并为一个构建任务"""
+        digest = hashlib.sha256((text_content or "").encode('utf-8'))
+        for image in images or []:
+            data = image if isinstance(image, (bytes, bytearray)) else image.getvalue() if hasattr(image, "getvalue") else str(image).encode('utf-8')
+            digest.update(b"\0" + bytes(data))
+        return digest.hexdigest()
+
+    def get_upload_status(self, job_id):
+        """查询知识库构建任务状态: status (queued/running/succeeded/failed), progress, message, error"""
+        return self.jobs.status(job_id) or {"job_id": job_id, "status": KnowledgeBaseJobQueue.FAILED, "progress": 0.0,
+                                            "message": "任务不存在或已过期", "error": None}
+
+    def reset_rag(self, tenant_id=None):
+        """从内存中卸载指定租户的知识库 (磁盘数据保留, 再次查询时重新加载)"""
+        self.resume_rag.unload(tenant_id)
+        self.logger.info(f"已卸载租户知识库: {tenant_id}")
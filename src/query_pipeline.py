@@ -0,0 +1,336 @@
+import time, json, asyncio, hashlib, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, List, Tuple, Callable, Any
+from src.utils import Config, setup_logger
+from src.fixed_qa_index import normalize
+from src.admission import AdmissionController, ServerBusyError
+from src.cancellation import DEFAULT_CANCELLATION_CFG, DeadlineExceeded
+from src.singleflight import DEFAULT_SINGLEFLIGHT_CFG, SingleFlight, flight_key
+
+DEFAULT_PIPELINE_CFG = {
+    "workers": 4,            # 并发阶段使用的线程数
+    "generation_workers": 1, # 异步路径中同时执行模型生成的线程数 (共享同一个本地模型)
+    "cache_enabled": True,   # 是否缓存 RAG 生成的回答
+    "cache_max_entries": 256,
+    "cache_ttl": 600         # 秒
+}
+
+def format_rag_context(docs: List[Any]) -> str:
+    """检索结果的展示文本"""
+    if not docs: return ""
+    return f"找到 {len(docs)} 条相关内容：\n\n" + "\n\n---\n\n".join(
+        f"**相关度 {i+1}**：\n{doc.page_content}" for i, doc in enumerate(docs)
+    )
+
+class ResponseCache:
+    """回答缓存 (LRU + TTL)，键包含知识库内容版本，知识库变化后自动失效"""
+
+    def __init__(self, max_entries: int = 256, ttl: float = 600):
+        self.max_entries, self.ttl = max_entries, ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None: return None
+            if time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries: self._entries.popitem(last=False)
+
+class QueryContext:
+    """一次查询在各阶段之间传递的状态"""
+
+    def __init__(self, query: str, history: List[Dict[str, Any]], use_rag: bool, rag_k: int, tenant_id: Optional[str],
+                 on_text: Optional[Callable[[str], None]] = None):
+        self.query, self.history, self.use_rag, self.rag_k, self.tenant_id = query, history, use_rag, rag_k, tenant_id
+        self.on_text = on_text  # 流式回调 (RAG 生成时逐段输出)
+        self.route = None       # general / rag / rag_no_kb
+        self.cache_key = None
+        self.query_vector = None
+        self.docs = []
+        self.timings: Dict[str, float] = {} # 阶段名 → 耗时 (ms)
+        self.pending: Dict[str, Any] = {}    # 并发执行中的任务 (Future / asyncio.Task)
+
+class QueryPipeline:
+    """分阶段的查询流水线: 路由 → 固定问答 → 缓存 → 预计算回答 → 准入 → 检索 → 生成
+
+    各阶段按声明顺序执行，任一阶段返回结果即结束 (跳过后续更昂贵的阶段)。回答缓存的键包含知识库内容版本,
+    只在路由确定走 RAG 后查找, 固定问答与通用问答不访问知识库。
+    RAG 模式下查询向量在固定问答的 n-gram 匹配同时于线程池中预先计算; 命中固定问答时不做检索，
+    检索内容在用户展开时再通过 QASystem.get_rag_context 获取。需要生成的 RAG 查询在检索前检查生成名额,
+    队列已满时直接抛出 ServerBusyError, 不做检索 (缓存、固定问答与预计算回答不受限制)。
+    检索到内容的 RAG 生成不采样, 与进行中的相同生成 (问题、检索内容与对话历史均相同) 合并; 通用问答会采样, 不合并。
+    arun 为异步版本: 阶段顺序相同, 阻塞调用放入线程池, 调用方取消时未完成的任务一并取消。
+    """
+    _executor = None # 进程内共享的线程池
+    _executor_lock = threading.Lock()
+
+    def __init__(self, system: Any):
+        cfg = {**DEFAULT_PIPELINE_CFG, **(Config().get().get('query_pipeline') or {})}
+        self.system = system
+        self.logger = setup_logger('log')
+        self.workers = int(cfg['workers'])
+        self.cache = ResponseCache(int(cfg['cache_max_entries']), float(cfg['cache_ttl'])) if cfg['cache_enabled'] else None
+        flight_cfg = {**DEFAULT_SINGLEFLIGHT_CFG, **(Config().get().get('singleflight') or {})}
+        self.flights = SingleFlight() if flight_cfg['enabled'] and flight_cfg['queries'] else None # 相同的并发 RAG 生成合并
+        # (阶段名, 处理函数, 是否执行): 处理函数返回非 None 即作为最终回答
+        self.stages: List[Tuple[str, Callable[[QueryContext], Any], Callable[[QueryContext], bool]]] = [
+            ("route", self._route, lambda ctx: True),
+            ("fixed_qa", self._fixed_qa, lambda ctx: ctx.use_rag),
+            ("cache", self._cache_lookup, self._cache_enabled),
+            ("precomputed", self._precomputed, self._answers_enabled),
+            ("admission", self._admission_check, lambda ctx: ctx.route == "rag"),
+            ("retrieve", self._retrieve, lambda ctx: ctx.route == "rag"),
+            ("generate", self._generate, lambda ctx: True),
+        ]
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with QueryPipeline._executor_lock:
+            if QueryPipeline._executor is None:
+                QueryPipeline._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="query-stage")
+            return QueryPipeline._executor
+
+    def _start(self, ctx: QueryContext, name: str, fn: Callable, *args: Any) -> None:
+        """在线程池中提前启动一个任务 (耗时记入 ctx.timings[name])"""
+        def timed():
+            start = time.perf_counter()
+            try: return fn(*args)
+            finally: ctx.timings[name] = (time.perf_counter() - start) * 1000
+        ctx.pending[name] = self._get_executor().submit(timed)
+
+    def _cancel_pending(self, ctx: QueryContext) -> None:
+        for future in ctx.pending.values(): future.cancel() # 尚未开始的任务直接取消, 已开始的结果被丢弃
+
+    async def _in_executor(self, fn: Callable, *args: Any) -> Any:
+        """在阶段线程池中执行阻塞调用"""
+        return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+
+    async def _timed(self, ctx: QueryContext, name: str, awaitable: Any) -> Any:
+        start = time.perf_counter()
+        try: return await awaitable
+        finally: ctx.timings[name] = (time.perf_counter() - start) * 1000
+
+    def run(self, query: str, history: Optional[List[Dict[str, Any]]] = None, use_rag: bool = True,
+            rag_k: int = 3, tenant_id: Optional[str] = None, on_text: Optional[Callable[[str], None]] = None) -> Any:
+        ctx = QueryContext(query, history or [], use_rag, rag_k, tenant_id, on_text)
+        result = None
+        try:
+            for name, stage, enabled in self.stages:
+                if not enabled(ctx): continue
+                start = time.perf_counter()
+                result = stage(ctx)
+                ctx.timings[name] = (time.perf_counter() - start) * 1000
+                if result is not None: break
+        finally:
+            self._cancel_pending(ctx)
+        return self._finish(ctx, result)
+
+    async def arun(self, query: str, history: Optional[List[Dict[str, Any]]] = None, use_rag: bool = True,
+                   rag_k: int = 3, tenant_id: Optional[str] = None, on_text: Optional[Callable[[str], None]] = None) -> Any:
+        """run 的异步版本 (在事件循环中调用)"""
+        ctx = QueryContext(query, history or [], use_rag, rag_k, tenant_id, on_text)
+        result = None
+        try:
+            await self._timed(ctx, "route", self._in_executor(self._route, ctx))
+            stages = [("fixed_qa", self._afixed_qa, lambda ctx: ctx.use_rag), ("cache", self._acache_lookup, self._cache_enabled),
+                      ("precomputed", self._aprecomputed, self._answers_enabled),
+                      ("admission", self._aadmission_check, lambda ctx: ctx.route == "rag"), ("retrieve", self._aretrieve, lambda ctx: ctx.route == "rag"), ("generate", self._agenerate, lambda ctx: True)]
+            for name, stage, enabled in stages:
+                if result is not None: break
+                if enabled(ctx): result = await self._timed(ctx, name, stage(ctx))
+        finally:
+            self._cancel_pending(ctx)
+        return self._finish(ctx, result)
+
+    def _finish(self, ctx: QueryContext, result: Any) -> Any:
+        timings = ctx.timings.copy() # 已放弃的并发任务可能仍在写入
+        self.logger.info("查询各阶段耗时: " + ", ".join(f"{name}={ms:.1f}ms" for name, ms in timings.items()))
+        if isinstance(result, str): result = {"response": result}
+        if isinstance(result, dict): result = {**result, "timings": {name: round(ms, 2) for name, ms in timings.items()}}
+        return result
+
+    # --- 各阶段 ---
+    def _cache_enabled(self, ctx: QueryContext) -> bool:
+        """只缓存 RAG 生成的回答; 键需要知识库内容版本 (冷租户会加载索引或请求检索服务), 所以只在 RAG 路由上计算"""
+        return self.cache is not None and ctx.route == "rag"
+
+    def _cache_lookup(self, ctx: QueryContext) -> Any:
+        signature = json.dumps([normalize(ctx.query), ctx.tenant_id, ctx.rag_k, self.system.resume_rag.generation(ctx.tenant_id),
+                                [(m.get("role"), str(m.get("content"))) for m in ctx.history]], ensure_ascii=False)
+        ctx.cache_key = hashlib.sha256(signature.encode('utf-8')).hexdigest()
+        cached = self.cache.get(ctx.cache_key)
+        if cached is not None:
+            self.logger.info(f"回答缓存命中: {ctx.query}")
+            return {**cached, "cached": True}
+        return None
+
+    async def _acache_lookup(self, ctx: QueryContext) -> Any:
+        return await self._in_executor(self._cache_lookup, ctx)
+
+    def _route(self, ctx: QueryContext) -> Any:
+        """RAG 模式且租户知识库存在时走检索, 否则走通用处理"""
+        if not ctx.use_rag: ctx.route = "general"
+        elif self.system.resume_rag.has_knowledge_base(ctx.tenant_id): ctx.route = "rag"
+        else: ctx.route = "rag_no_kb"
+        return None
+
+    def _query_vector(self, ctx: QueryContext) -> Any:
+        if ctx.query_vector is None and "embed_query" in ctx.pending: ctx.query_vector = ctx.pending["embed_query"].result()
+        return ctx.query_vector
+
+    def _fixed_qa(self, ctx: QueryContext) -> Any:
+        """精确命中直接返回; 否则 n-gram 匹配与查询向量计算并发进行, 命中即返回, 不再检索"""
+        fixed_qa = self.system.fixed_qa
+        match = fixed_qa.match_exact(ctx.query)
+        if match is None and (ctx.route == "rag" or fixed_qa.uses_embedding or self._answers_enabled(ctx)):
+            self._start(ctx, "embed_query", self.system.resume_rag.embed_query, ctx.query) # 检索 / 向量匹配需要, 提前开始
+        if match is None: match = fixed_qa.match_text(ctx.query)
+        if match is None and fixed_qa.uses_embedding: match = fixed_qa.match_vector(self._query_vector(ctx))
+        return self._fixed_response(ctx, match)
+
+    async def _afixed_qa(self, ctx: QueryContext) -> Any:
+        fixed_qa = self.system.fixed_qa
+        match = fixed_qa.match_exact(ctx.query)
+        if match is None and (ctx.route == "rag" or fixed_qa.uses_embedding or self._answers_enabled(ctx)):
+            ctx.pending["embed_query"] = asyncio.ensure_future(self._timed(ctx, "embed_query", self.system.resume_rag.aembed_query(ctx.query)))
+        if match is None: match = fixed_qa.match_text(ctx.query)
+        if match is None and fixed_qa.uses_embedding: match = fixed_qa.match_vector(await self._aquery_vector(ctx))
+        return self._fixed_response(ctx, match)
+
+    async def _aquery_vector(self, ctx: QueryContext) -> Any:
+        """等待预先计算的查询向量, 未预先计算时异步计算"""
+        if ctx.query_vector is None:
+            pending = ctx.pending.get("embed_query")
+            ctx.query_vector = await pending if pending is not None else await self.system.resume_rag.aembed_query(ctx.query)
+        return ctx.query_vector
+
+    def _fixed_response(self, ctx: QueryContext, match: Optional[Dict[str, Any]]) -> Any:
+        if match is None: return None
+        self.logger.info(f"查询 '{ctx.query}' 命中固定问答 (匹配问题: '{match['question']}', 相似度: {match['score']:.2f}, 方式: {match['method']})")
+        response = {"response": match["answer"], "type": "fixed_answer", "rag_context": None}
+        if ctx.route == "rag": response["rag_query"] = {"query": ctx.query, "tenant_id": ctx.tenant_id, "k": ctx.rag_k} # 检索内容按需获取
+        return response
+
+    def _answers_enabled(self, ctx: QueryContext) -> bool:
+        """预计算回答只用于无对话历史、且针对其对应知识库的查询"""
+        answers = self.system.answers
+        return answers.enabled and not ctx.history and ctx.tenant_id == answers.tenant_id
+
+    def _precomputed(self, ctx: QueryContext) -> Any:
+        """命中离线预计算的回答即返回; 模型或知识库已变化时提交后台重新生成"""
+        answers = self.system.answers
+        current, mode, match = self._precomputed_exact(ctx)
+        if match is None:
+            if ctx.query_vector is None and "embed_query" not in ctx.pending: ctx.query_vector = self.system.resume_rag.embed_query(ctx.query)
+            match = answers.match(ctx.query, mode, current, query_vector=self._query_vector(ctx))
+        return self._precomputed_response(ctx, match)
+
+    async def _aprecomputed(self, ctx: QueryContext) -> Any:
+        answers = self.system.answers
+        current, mode, match = await self._in_executor(self._precomputed_exact, ctx) # 读取指纹与回答文件可能阻塞, 查询向量同时在计算
+        if match is None: match = answers.match(ctx.query, mode, current, query_vector=await self._aquery_vector(ctx))
+        return self._precomputed_response(ctx, match)
+
+    def _precomputed_exact(self, ctx: QueryContext) -> Tuple[Dict[str, Any], str, Optional[Dict[str, Any]]]:
+        """当前指纹 (已变化时提交后台重新生成) 与按问题文本的精确匹配"""
+        answers = self.system.answers
+        current = answers.fingerprint(self.system, ctx.tenant_id)
+        if answers.is_stale(current): answers.schedule_refresh(self.system, current)
+        mode = "rag" if ctx.route == "rag" else "general"
+        return current, mode, answers.match(ctx.query, mode, current)
+
+    def _precomputed_response(self, ctx: QueryContext, match: Optional[Dict[str, Any]]) -> Any:
+        if match is None: return None
+        self.logger.info(f"查询 '{ctx.query}' 命中预计算回答 (匹配问题: '{match['question']}', 相似度: {match['score']:.2f})")
+        return {**match["answer"], "precomputed": True}
+
+    def generate(self, query: str, use_rag: bool = True, rag_k: int = 3, tenant_id: Optional[str] = None,
+                 query_vector: Any = None) -> Dict[str, Any]:
+        """跳过缓存、固定问答与预计算回答，直接检索并生成 (离线预计算回答使用)"""
+        ctx = QueryContext(query, [], use_rag, rag_k, tenant_id)
+        ctx.query_vector = query_vector
+        self._route(ctx)
+        if ctx.route == "rag": self._retrieve(ctx)
+        response = self._generate(ctx)
+        return {"response": response} if isinstance(response, str) else response
+
+    def _admission_check(self, ctx: QueryContext) -> Any:
+        """生成名额与队列都已满时提前拒绝 (省去检索)"""
+        admission = AdmissionController.shared()
+        if admission is not None and admission.saturated():
+            self.logger.info(f"生成队列已满，拒绝查询: {ctx.query}")
+            raise ServerBusyError()
+        return None
+
+    async def _aadmission_check(self, ctx: QueryContext) -> Any:
+        return self._admission_check(ctx)
+
+    def _retrieve(self, ctx: QueryContext) -> Any:
+        ctx.docs = self.system.resume_rag.search(ctx.query, k=ctx.rag_k, tenant_id=ctx.tenant_id, query_vector=self._query_vector(ctx))
+        self.logger.info(f"检索到相关上下文: {len(ctx.docs)}条" if ctx.docs else "未找到相关上下文 (RAG)")
+        return None
+
+    async def _aretrieve(self, ctx: QueryContext) -> Any:
+        query_vector = await self._aquery_vector(ctx)
+        ctx.docs = await self._in_executor(lambda: self.system.resume_rag.search(ctx.query, k=ctx.rag_k, tenant_id=ctx.tenant_id, query_vector=query_vector))
+        self.logger.info(f"检索到相关上下文: {len(ctx.docs)}条" if ctx.docs else "未找到相关上下文 (RAG)")
+        return None
+
+    def _generate(self, ctx: QueryContext) -> Any:
+        middleware = self.system.middleware
+        try:
+            if not ctx.docs:
+                if ctx.use_rag: self.logger.info("RAG 模式但无上下文且未命中固定答案，转为通用处理")
+                return middleware.process_query(ctx.query, history=ctx.history, rag_context=None)
+            rag_context = "\n".join(doc.page_content for doc in ctx.docs)
+            generate = lambda on_text: middleware.process_query(ctx.query, history=ctx.history, rag_context=rag_context, on_text=on_text)
+            if self.flights is None: response = generate(ctx.on_text)
+            else: # 已确定走 RAG 且检索到内容: 输入相同的生成是确定性的, 可以合并
+                key = flight_key(normalize(ctx.query), rag_context, [(m.get("role"), str(m.get("content"))) for m in ctx.history])
+                response = self.flights.do(key, generate, ctx.on_text)
+                if isinstance(response, dict): response = dict(response) # 各调用方拿到各自的副本 (之后会添加检索内容等字段)
+        except DeadlineExceeded as e: return self._deadline_response(ctx, e)
+        return self._rag_response(ctx, response)
+
+    async def _agenerate(self, ctx: QueryContext) -> Any:
+        """生成在中间件的生成线程池中执行; 非 RAG 的天气查询使用异步网络请求"""
+        middleware = self.system.middleware
+        try:
+            if not ctx.docs:
+                if ctx.use_rag: self.logger.info("RAG 模式但无上下文且未命中固定答案，转为通用处理")
+                return await middleware.aprocess_query(ctx.query, history=ctx.history, rag_context=None)
+            response = await middleware.aprocess_query(ctx.query, history=ctx.history, rag_context="\n".join(doc.page_content for doc in ctx.docs), on_text=ctx.on_text)
+        except DeadlineExceeded as e: return self._deadline_response(ctx, e)
+        return self._rag_response(ctx, response)
+
+    def _deadline_response(self, ctx: QueryContext, error: DeadlineExceeded) -> Dict[str, Any]:
+        """生成超过截止时间: 返回已生成的部分回答, 没有时用更低阈值匹配固定问答兜底 (均不缓存)"""
+        if error.partial.strip():
+            self.logger.info(f"查询 '{ctx.query}' 生成超时，返回部分回答 ({len(error.partial)} 字)")
+            response = {"response": f"{error.partial.rstrip()}\n\n(回答生成超时，以上为部分内容)", "type": "partial"}
+        else:
+            cfg = {**DEFAULT_CANCELLATION_CFG, **(Config().get().get('cancellation') or {})}
+            match = self.system.fixed_qa.match_text(ctx.query, threshold=cfg['fallback_threshold'])
+            if match is not None:
+                self.logger.info(f"查询 '{ctx.query}' 生成超时，使用固定问答兜底")
+                return {**self._fixed_response(ctx, match), "type": "fallback"}
+            self.logger.info(f"查询 '{ctx.query}' 生成超时，且没有可用的兜底回答")
+            response = {"response": "抱歉，回答生成超时，请稍后重试或换个问法。", "type": "timeout"}
+        if ctx.docs: response["rag_context"] = format_rag_context(ctx.docs)
+        return response
+
+    def _rag_response(self, ctx: QueryContext, response: Any) -> Any:
+        if isinstance(response, str): response = {"response": response}
+        response["rag_context"] = format_rag_context(ctx.docs) # 添加用于显示的上下文
+        if self.cache is not None and ctx.cache_key and response.get("type") != "error": self.cache.put(ctx.cache_key, response)
+        return response
@@ -0,0 +1,235 @@
+import os, time, queue, itertools, threading, multiprocessing
+from concurrent.futures import Future
+from typing import Optional, Dict, List, Tuple, Callable, Any
+from langchain_core.embeddings import Embeddings
+from src.utils import Config, setup_logger
+from src.cancellation import CancellationToken, GenerationCancelled, DeadlineExceeded, cancellation_scope
+
+DEFAULT_REPLICA_POOL_CFG = {
+    "enabled": False,          # 启用后模型生成 (与嵌入) 在多个副本子进程中执行, 本进程不加载模型
+    "replicas": 2,             # 副本进程数
+    "threads_per_replica": 0,  # 每个副本绑定的核数 (= torch 线程数), 0 表示可用核数 / replicas
+    "embedding": True,         # 副本同时加载嵌入模型, 嵌入计算也分发到副本
+    "start_timeout": 600       # 等待全部副本加载完模型的最长时间 (秒)
+}
+
+def available_cores() -> List[int]:
+    """当前进程可用的 CPU 核 (受 taskset / cgroup 限制)"""
+    if hasattr(os, 'sched_getaffinity'): return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def partition_cores(replicas: int, threads_per_replica: int = 0, cores: Optional[List[int]] = None) -> List[List[int]]:
+    """把可用核切分为 replicas 组互不重叠的核集合"""
+    cores = available_cores() if cores is None else sorted(cores)
+    if replicas < 1: raise ValueError("副本数至少为 1")
+    per = threads_per_replica or max(1, len(cores) // replicas)
+    if per * replicas > len(cores): raise ValueError(f"{replicas} 个副本 × {per} 线程超过可用核数 {len(cores)}")
+    return [cores[i * per:(i + 1) * per] for i in range(replicas)]
+
+def _replica_main(index: int, cores: List[int], load_embedding: bool, requests: Any, responses: Any, control: Any) -> None:
+    """副本进程: 绑定核并限制线程数后加载模型, 依次执行请求
+
+    每个副本在自己的内存中持有一份完整权重 (加载时转换为 float16, 不与其他副本共享页), 内存占用随副本数线性增长;
+    权重文件只在加载阶段经页缓存读取。各副本的常驻内存可用 scripts/bench_replicas.py 查看。
+    control 队列接收要取消的请求 ID: 正在执行的生成在下一个解码步停止, 尚未开始的请求直接跳过。
+    """
+    threads = len(cores)
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"): os.environ[name] = str(threads) # 须在导入 torch 之前设置
+    if hasattr(os, 'sched_setaffinity'): os.sched_setaffinity(0, cores)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+        try: torch.set_num_interop_threads(1) # 请求串行执行, 不需要算子间并行
+        except RuntimeError: pass
+        from src.llm_service import LLMService
+        from src.embedding_service import create_embedding_model
+        llm = LLMService(use_replicas=False)
+        embeddings = create_embedding_model(Config().get('embedding'), threads=threads) if load_embedding else None
+    except Exception as e:
+        responses.put(("failed", index, None, f"{type(e).__name__}: {e}", 0.0))
+        return
+    cancelled, running, lock = set(), {}, threading.Lock()
+    def watch_control():
+        while True:
+            request_id = control.get()
+            if request_id is None: return
+            with lock:
+                cancelled.add(request_id)
+                token = running.get(request_id)
+            if token is not None: token.cancel("cancelled by caller")
+    threading.Thread(target=watch_control, name="replica-control", daemon=True).start()
+    responses.put(("ready", index, None, os.getpid(), 0.0))
+    while True:
+        request = requests.get()
+        if request is None: break
+        request_id, kind, args, kwargs, stream, timeout = request
+        start = time.perf_counter()
+        token = CancellationToken(timeout=timeout)
+        with lock:
+            if request_id in cancelled: token.cancel("cancelled by caller")
+            running[request_id] = token
+        try:
+            if kind == "embed": result = embeddings.embed_documents(*args)
+            else:
+                if stream: kwargs["on_text"] = lambda text: responses.put(("text", index, request_id, text, 0.0))
+                with cancellation_scope(token): result = llm.generate_response(*args, **kwargs)
+            responses.put(("result", index, request_id, result, time.perf_counter() - start))
+        except GenerationCancelled as e:
+            value = {"reason": e.reason, "partial": e.partial if isinstance(e, DeadlineExceeded) else None}
+            responses.put(("cancelled", index, request_id, value, time.perf_counter() - start))
+        except Exception as e:
+            responses.put(("error", index, request_id, f"{type(e).__name__}: {e}", time.perf_counter() - start))
+        finally:
+            with lock:
+                running.pop(request_id, None)
+                cancelled.discard(request_id)
+
+class ReplicaPool:
+    """多进程模型副本池: 每个副本是独立进程, 绑定互不重叠的核, torch 线程数等于核数
+
+    单进程内并发请求的 torch 线程池会争抢同一批核, 吞吐反而下降; 副本各自独占核, 请求分发给在途请求最少的副本。
+    生成的流式输出 (on_text) 从副本逐段转发回本进程。ReplicaPool.shared() 返回按配置创建的进程内共享实例。
+    """
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, cfg: Optional[Dict[str, Any]] = None):
+        self.cfg = {**DEFAULT_REPLICA_POOL_CFG, **(Config().get().get('replica_pool') or {}), **(cfg or {})}
+        self.logger = setup_logger('log')
+        self.core_sets = partition_cores(int(self.cfg['replicas']), int(self.cfg['threads_per_replica']))
+        self.embedding = bool(self.cfg['embedding'])
+        context = multiprocessing.get_context("spawn") # 子进程重新导入 torch, 不继承本进程的线程池状态
+        self._responses = context.Queue()
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._futures: Dict[int, Tuple[int, Future, Optional[Callable[[str], None]]]] = {}
+        self._closed = False
+        self._replicas: List[Dict[str, Any]] = []
+        self.logger.info(f"启动模型副本: {len(self.core_sets)} 个, 核分配 {self.core_sets}, embedding={self.embedding}")
+        for index, cores in enumerate(self.core_sets):
+            requests, control = context.Queue(), context.Queue()
+            process = context.Process(target=_replica_main, args=(index, cores, self.embedding, requests, self._responses, control),
+                                      name=f"model-replica-{index}", daemon=True)
+            process.start()
+            self._replicas.append({"index": index, "cores": cores, "process": process, "requests": requests, "control": control, "pid": None, "alive": True,
+                                   "inflight": 0, "completed": 0, "cancelled": 0, "errors": 0, "busy_s": 0.0})
+        try: self._wait_ready(float(self.cfg['start_timeout']))
+        except Exception:
+            self.close()
+            raise
+        threading.Thread(target=self._collect_loop, name="replica-collector", daemon=True).start()
+
+    @classmethod
+    def shared(cls) -> "ReplicaPool":
+        with cls._shared_lock:
+            if cls._shared is None: cls._shared = cls()
+            return cls._shared
+
+    def _wait_ready(self, timeout: float) -> None:
+        deadline, waiting = time.monotonic() + timeout, {replica["index"] for replica in self._replicas}
+        while waiting:
+            try: kind, index, _, value, _ = self._responses.get(timeout=max(0.1, deadline - time.monotonic()))
+            except queue.Empty: raise TimeoutError(f"模型副本 {sorted(waiting)} 在 {timeout:.0f} 秒内未完成加载")
+            if kind == "failed": raise RuntimeError(f"模型副本 {index} 加载失败: {value}")
+            if kind == "ready":
+                self._replicas[index]["pid"] = value
+                waiting.discard(index)
+                self.logger.info(f"模型副本 {index} 已就绪 (pid={value}, cores={self._replicas[index]['cores']})")
+
+    # --- 请求 ---
+    def submit(self, kind: str, args: Tuple[Any, ...], kwargs: Optional[Dict[str, Any]] = None,
+               on_text: Optional[Callable[[str], None]] = None, cancel_token: Optional[Any] = None) -> Future:
+        """提交到在途请求最少的副本 (kind: generate / embed); cancel_token 被取消时通知副本停止, 截止时间随请求传递"""
+        if kind == "embed" and not self.embedding: raise RuntimeError("副本未加载嵌入模型 (replica_pool.embedding=false)")
+        future = Future()
+        with self._lock:
+            if self._closed: raise RuntimeError("副本池已关闭")
+            alive = [replica for replica in self._replicas if replica["alive"]]
+            if not alive: raise RuntimeError("没有可用的模型副本")
+            replica = min(alive, key=lambda r: r["inflight"])
+            request_id = next(self._ids)
+            replica["inflight"] += 1
+            self._futures[request_id] = (replica["index"], future, on_text)
+        replica["requests"].put((request_id, kind, args, kwargs or {}, on_text is not None, cancel_token.remaining() if cancel_token else None))
+        if cancel_token is not None:
+            remove = cancel_token.on_cancel(lambda: future.done() or replica["control"].put(request_id))
+            future.add_done_callback(lambda _: remove()) # 请求结束后注销, 会话令牌上不累积回调
+        return future
+
+    def generate(self, *args: Any, on_text: Optional[Callable[[str], None]] = None, cancel_token: Optional[Any] = None, **kwargs: Any) -> str:
+        """LLMService.generate_response, 在副本中执行 (取消与超时以 GenerationCancelled / DeadlineExceeded 抛出)"""
+        return self.submit("generate", args, kwargs, on_text, cancel_token).result()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.submit("embed", (list(texts),)).result()
+
+    # --- 结果 ---
+    def _collect_loop(self) -> None:
+        while not self._closed:
+            try: kind, index, request_id, value, elapsed = self._responses.get(timeout=1.0)
+            except queue.Empty:
+                self._reap_dead()
+                continue
+            except (EOFError, OSError): return
+            if kind == "text":
+                entry = self._futures.get(request_id)
+                if entry and entry[2]:
+                    try: entry[2](value)
+                    except Exception as e: self.logger.error(f"流式回调失败: {e}", exc_info=True)
+                continue
+            with self._lock:
+                entry = self._futures.pop(request_id, None)
+                replica = self._replicas[index]
+                replica["inflight"] -= 1
+                replica["completed" if kind == "result" else "cancelled" if kind == "cancelled" else "errors"] += 1
+                replica["busy_s"] += elapsed
+            if entry is None: continue
+            if kind == "result": entry[1].set_result(value)
+            elif kind == "cancelled":
+                entry[1].set_exception(DeadlineExceeded(value["partial"]) if value["partial"] is not None else GenerationCancelled(value["reason"]))
+            else: entry[1].set_exception(RuntimeError(f"模型副本 {index} 执行失败: {value}"))
+
+    def _reap_dead(self) -> None:
+        """副本进程意外退出时, 分发给它的请求以错误结束, 后续请求不再分发给它"""
+        for replica in self._replicas:
+            if not replica["alive"] or replica["process"].is_alive(): continue
+            with self._lock:
+                replica["alive"] = False
+                failed = [(request_id, entry) for request_id, entry in self._futures.items() if entry[0] == replica["index"]]
+                for request_id, _ in failed: self._futures.pop(request_id)
+                replica["inflight"] = 0
+            self.logger.error(f"模型副本 {replica['index']} 进程已退出 (exitcode={replica['process'].exitcode})")
+            for _, entry in failed: entry[1].set_exception(RuntimeError(f"模型副本 {replica['index']} 进程已退出"))
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """各副本的核分配、在途请求数、完成数与累计计算时间"""
+        with self._lock:
+            return [{**{key: replica[key] for key in ("index", "pid", "cores", "alive", "inflight", "completed", "cancelled", "errors")},
+                     "busy_s": round(replica["busy_s"], 3)} for replica in self._replicas]
+
+    def close(self, timeout: float = 10) -> None:
+        with self._lock:
+            self._closed = True
+            pending, self._futures = list(self._futures.values()), {}
+        for replica in self._replicas:
+            try:
+                replica["requests"].put(None)
+                replica["control"].put(None)
+            except (OSError, ValueError): pass
+        for replica in self._replicas:
+            replica["process"].join(timeout)
+            if replica["process"].is_alive(): replica["process"].terminate()
+        for _, future, _ in pending:
+            if not future.done(): future.set_exception(RuntimeError("副本池已关闭"))
+
+class ReplicaEmbeddings(Embeddings):
+    """由副本进程计算向量 (EmbeddingService 合并批次后分发到在途请求最少的副本)"""
+
+    def __init__(self, pool: ReplicaPool):
+        self.pool = pool
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.pool.embed_documents(texts) if texts else []
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
@@ -1,21 +1,24 @@
-import os
-from PIL import Image
-import pytesseract
-import torch # 导入 torch
+import os, shutil
 from langchain_core.documents import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
 from src.utils import Config, setup_logger
+from src.embedding_service import EmbeddingService
+from src.vector_store import VectorStore
+from src.kb_registry import KnowledgeBaseRegistry
+from src.kb_jobs import KnowledgeBaseJobQueue
+from src.chunking import split_text
+from src.ocr import OCREngine
+from src.upload_cache import UploadCache
 
 class ResumeRAG:
     def __init__(self):
         self.cfg = Config() # 获取配置
         self.embedding_cfg = self.cfg.get('embedding')
         self.vector_db_path = self.cfg.get('vector_db')['path']
+        self.index_cfg = self.cfg.get('vector_db').get('index', {}) # 索引类型: flat / hnsw / ivfpq
         self.logger = setup_logger('log')
         self.embeddings = None
-        self.vector_db = None
+        self.registry = KnowledgeBaseRegistry() # 进程级多租户向量库 (LRU)
+        self.upload_cache = UploadCache() # 按内容缓存分块与向量
         # 确定嵌入模型设备 (优先配置, 否则默认CPU)
         self.embedding_device = self.embedding_cfg.get('device', 'cpu') 
         self.logger.info(f"嵌入模型将加载到设备: {self.embedding_device}")
@@ -36,27 +39,17 @@ class ResumeRAG:
                 self.logger.info("FAISS安装完成，请重启应用")
                 raise ImportError("需要重启应用以加载新安装的依赖")
                 
-            # 加载嵌入模型, 明确指定设备
-            self.embeddings = HuggingFaceEmbeddings(
-                model_name=self.embedding_cfg['model_name'],
-                model_kwargs={'device': self.embedding_device} # 明确指定设备
-            )
+            # 进程内共享的嵌入服务 (只加载一次模型, 并发查询合并为批次)
+            self.embeddings = EmbeddingService()
             self.logger.info(f"嵌入模型加载完成到设备: {self.embedding_device}")
             
             # 确保向量库目录存在
             os.makedirs(os.path.dirname(self.vector_db_path), exist_ok=True)
             
-            # 加载向量库（如果存在）
-            if os.path.exists(self.vector_db_path):
-                self.logger.info(f"加载向量库: {self.vector_db_path}")
-                self.vector_db = FAISS.load_local(
-                    self.vector_db_path, 
-                    self.embeddings, # 使用已配置好设备的实例
-                    allow_dangerous_deserialization=True
-                )
-                self.logger.info("向量库加载成功")
-            else:
-                self.logger.info("向量库不存在，需要先构建知识库")
+            # 预加载默认知识库（如果存在）: 索引按 mmap 加载, 分块文本按 id 惰性读取; 其他租户首次查询时再加载
+            default_db = self.registry.get(None, self.embeddings)
+            if default_db: self.logger.info(f"默认向量库加载成功, 共{default_db.ntotal}个向量")
+            else: self.logger.info("向量库不存在，需要先构建知识库")
         except Exception as e:
             self.logger.error(f"初始化失败: {e}", exc_info=True)
             raise
@@ -65,9 +58,7 @@ class ResumeRAG:
         """使用OCR提取图片文本"""
         try:
             self.logger.info(f"处理简历图片: {image_path}")
-            img = Image.open(image_path)
-            text = pytesseract.image_to_string(img, lang='chi_sim+eng')
-            return text
+            return next(OCREngine().iter_images([image_path]), "")
         except Exception as e:
             self.logger.error(f"图片处理失败: {e}", exc_info=True) # 添加 exc_info
             return ""
@@ -82,48 +73,165 @@ class ResumeRAG:
             self.logger.error(f"文本处理失败: {e}", exc_info=True) # 添加 exc_info
             return ""
     
-    def build_knowledge_base(self, text_content, images=None):
-        """构建知识库"""
+    @property
+    def vector_db(self):
+        """默认知识库 (兼容旧接口)"""
+        return self.registry.get(None, self.embeddings)
+
+    def build_knowledge_base(self, text_content, images=None, tenant_id=None, progress=None):
+        """构建知识库 (tenant_id 为空时写入默认知识库)
+
+        新索引写入独立的版本目录，完成后原子切换; 构建期间查询继续使用旧版本。
+        progress(比例, 说明) 为可选的进度回调。
+        """
+        report = progress or (lambda fraction, message="": None)
         try:
-            self.logger.info("开始构建知识库")
+            self.logger.info(f"开始构建知识库: tenant={tenant_id or KnowledgeBaseRegistry.DEFAULT_TENANT}")
             all_text = text_content
-            
-            # 处理图片（如果有）
+
+            # 处理图片（如果有）: 多张图片在 OCR 进程池中并行识别
             if images:
-                for img_path in images:
-                    img_text = self.process_resume_image(img_path)
+                self.logger.info(f"OCR 识别 {len(images)} 张简历图片")
+                report(0.05, "识别简历图片")
+                for img_text in OCREngine().iter_images(list(images), progress=lambda done, total: report(0.05 + 0.25 * done / total, f"识别简历图片 {done}/{total}")):
                     all_text += "\n" + img_text
-            
-            # 切分文本
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=self.embedding_cfg['chunk_size'],
-                chunk_overlap=self.embedding_cfg['chunk_overlap']
-            )
-            docs = text_splitter.create_documents([all_text])
-            self.logger.info(f"文本已切分为{len(docs)}个块")
-            
-            if not self.embeddings:
-                 self.logger.error("嵌入模型未初始化，无法构建知识库。")
-                 return False
-            self.vector_db = FAISS.from_documents(docs, self.embeddings)
-            # 确保目录存在
-            os.makedirs(os.path.dirname(self.vector_db_path), exist_ok=True)
-            self.vector_db.save_local(self.vector_db_path)
-            self.logger.info(f"知识库已保存至: {self.vector_db_path}")
+
+            content_key = UploadCache.content_key(all_text, self.embedding_cfg)
+            # 该租户已由相同内容构建过: 直接复用, 无需重新切分和嵌入
+            if tenant_id and self.registry.exists(tenant_id):
+                with self.registry.lease(tenant_id, self.embeddings) as existing:
+                    if existing and existing.meta.get('content_key') == content_key and not (existing.delta_count or existing.tombstone_ratio):
+                        self.logger.info(f"租户 {tenant_id} 的知识库内容未变化，直接复用")
+                        return True
+
+            cached = self.upload_cache.get_chunks(content_key)
+            if cached:
+                docs, vectors = cached
+            else:
+                # 切分文本 (与离线入库共用切分逻辑)
+                report(0.3, "切分文本")
+                docs = split_text(all_text, embedding_cfg=self.embedding_cfg)
+                self.logger.info(f"文本已切分为{len(docs)}个块")
+
+                if not self.embeddings:
+                     self.logger.error("嵌入模型未初始化，无法构建知识库。")
+                     return False
+                report(0.4, f"向量化 {len(docs)} 个文本块")
+                vectors = self.embeddings.embed_documents([doc.page_content for doc in docs])
+                self.upload_cache.put_chunks(content_key, docs, vectors)
+            self._tag_candidate(docs, tenant_id)
+            report(0.8, "写入索引")
+            with self.registry.tenant_lock(tenant_id): # 同一租户的重建串行化; 查询不获取该锁, 继续使用旧版本
+                version, version_path = self.registry.new_version(tenant_id)
+                try: store = VectorStore.build(version_path, docs, vectors, self.index_cfg, extra_meta={"content_key": content_key})
+                except Exception:
+                    shutil.rmtree(version_path, ignore_errors=True) # 未发布的半成品版本直接删除
+                    raise
+                self.registry.publish(tenant_id, version, store)
+            report(1.0, "知识库已发布")
+            self.logger.info(f"知识库已保存至: {version_path}")
             return True
         except Exception as e:
             self.logger.error(f"构建知识库失败: {e}", exc_info=True)
             return False
     
-    def search(self, query, k=3):
-        """检索相关内容"""
+    @staticmethod
+    def _tag_candidate(docs, tenant_id):
+        """未指定候选人的分块归属于该租户 (分块缓存按内容共享, 候选人在写入前补充)"""
+        for doc in docs: doc.metadata.setdefault('candidate_id', tenant_id or KnowledgeBaseRegistry.DEFAULT_TENANT)
+
+    # --- 增量更新: 只追加写入文档存储, 不重建索引; 删除比例或增量规模过大时在后台合并 ---
+    def add_documents(self, docs, tenant_id=None, vectors=None):
+        """向知识库追加分块 (metadata 中的 source 作为来源, candidate_id 默认为租户)，返回稳定的分块 id; 知识库不存在时新建"""
         try:
-            if not self.vector_db:
-                self.logger.warning("向量库未初始化，无法执行检索")
-                return []
-            
-            self.logger.info(f"执行检索: {query}, k={k}")
-            results = self.vector_db.similarity_search(query, k=k)
+            if vectors is None: vectors = self.embeddings.embed_documents([doc.page_content for doc in docs])
+            self._tag_candidate(docs, tenant_id)
+            with self.registry.tenant_lock(tenant_id), self.registry.lease(tenant_id, self.embeddings) as store:
+                if store is None:
+                    version, version_path = self.registry.new_version(tenant_id)
+                    store = VectorStore.build(version_path, docs, vectors, self.index_cfg)
+                    self.registry.publish(tenant_id, version, store)
+                    return store.base_ids()
+                ids = store.add_documents(docs, vectors)
+            self.logger.info(f"已追加 {len(ids)} 个分块: tenant={tenant_id or KnowledgeBaseRegistry.DEFAULT_TENANT}")
+            self._schedule_compaction(tenant_id, store)
+            return ids
+        except Exception as e:
+            self.logger.error(f"追加分块失败: {e}", exc_info=True)
+            return []
+
+    def delete_by_source(self, source, tenant_id=None):
+        """删除某来源的全部分块，返回删除数量"""
+        try:
+            with self.registry.tenant_lock(tenant_id), self.registry.lease(tenant_id, self.embeddings) as store:
+                if store is None: return 0
+                count = store.delete_by_source(source)
+            self.logger.info(f"已删除来源 {source} 的 {count} 个分块: tenant={tenant_id or KnowledgeBaseRegistry.DEFAULT_TENANT}")
+            self._schedule_compaction(tenant_id, store)
+            return count
+        except Exception as e:
+            self.logger.error(f"删除分块失败: {e}", exc_info=True)
+            return 0
+
+    def update_source(self, source, text, tenant_id=None, metadata=None):
+        """以新文本替换某来源的分块 (只切分和嵌入该来源)，返回新分块的 id"""
+        try:
+            docs = split_text(text, {**(metadata or {}), "source": source}, embedding_cfg=self.embedding_cfg)
+            vectors = self.embeddings.embed_documents([doc.page_content for doc in docs])
+            self._tag_candidate(docs, tenant_id)
+            with self.registry.tenant_lock(tenant_id), self.registry.lease(tenant_id, self.embeddings) as store:
+                if store is None: return self.add_documents(docs, tenant_id, vectors)
+                ids = store.update_source(source, docs, vectors)
+            self.logger.info(f"来源 {source} 已更新为 {len(ids)} 个分块: tenant={tenant_id or KnowledgeBaseRegistry.DEFAULT_TENANT}")
+            self._schedule_compaction(tenant_id, store)
+            return ids
+        except Exception as e:
+            self.logger.error(f"更新来源失败: {e}", exc_info=True)
+            return []
+
+    def _schedule_compaction(self, tenant_id, store):
+        """删除比例或增量规模超过阈值时提交后台合并任务"""
+        cfg = self.cfg.get('vector_db').get('compaction', {})
+        if store.needs_compaction(float(cfg.get('tombstone_ratio', 0.2)), int(cfg.get('max_delta', 20000))):
+            self.logger.info(f"租户 {tenant_id or KnowledgeBaseRegistry.DEFAULT_TENANT} 需要合并: 删除比例 {store.tombstone_ratio:.2f}, 增量 {store.delta_count} 条")
+            KnowledgeBaseJobQueue().submit(tenant_id, lambda progress: self.registry.compact(tenant_id) is not None,
+                                           description="等待合并向量库", kind="compact")
+
+    def embed_query(self, query):
+        """查询向量"""
+        return self.embeddings.embed_query(query)
+
+    async def aembed_query(self, query):
+        """查询向量 (异步, 经嵌入服务合并批次, 不阻塞事件循环)"""
+        return await self.embeddings.aembed_query(query)
+
+    def has_knowledge_base(self, tenant_id=None):
+        """租户知识库是否存在 (已加载或磁盘上存在)"""
+        return self.registry.exists(tenant_id)
+
+    def generation(self, tenant_id=None):
+        """租户知识库的内容版本 (任何写入后变化, 用于缓存失效)，不存在返回 None"""
+        with self.registry.lease(tenant_id, self.embeddings) as store: return store.generation if store else None
+
+    def unload(self, tenant_id=None):
+        """从内存中卸载租户知识库 (磁盘数据保留)"""
+        self.registry.evict(tenant_id)
+
+    def search(self, query, k=3, tenant_id=None, query_vector=None, filters=None):
+        """检索相关内容 (tenant_id 为空时检索默认知识库; query_vector 为已计算好的查询向量)
+
+        filters 按分块元数据限定检索范围, 如 {"candidate_id": "张三.md", "section": "projects"} 或 {"skills": ["python", "rag"]}；
+        过滤在向量检索内部完成, 只计算满足条件的分块。
+        """
+        try:
+            with self.registry.lease(tenant_id, self.embeddings) as vector_db: # 检索期间被淘汰或替换的实例在检索结束后才关闭
+                if not vector_db:
+                    self.logger.warning(f"租户 {tenant_id or KnowledgeBaseRegistry.DEFAULT_TENANT} 的向量库未初始化，无法执行检索")
+                    return []
+
+                self.logger.info(f"执行检索: {query}, k={k}, tenant={tenant_id or KnowledgeBaseRegistry.DEFAULT_TENANT}, filters={filters}")
+                if query_vector is None: query_vector = self.embed_query(query)
+                results = [doc for doc, _ in vector_db.search(query_vector, k=k, filters=filters)]
             self.logger.info(f"检索到{len(results)}条结果")
             return results
         except Exception as e:
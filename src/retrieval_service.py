@@ -0,0 +1,329 @@
+import os, json, time, queue, socket, struct, threading, socketserver
+from typing import Optional, Dict, List, Tuple, Callable, Any
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from src.utils import Config, setup_logger
+
+DEFAULT_RETRIEVAL_SERVICE_CFG = {
+    "enabled": False,            # 启用后 QASystem 通过客户端访问独立的检索服务, 本进程不加载嵌入模型与向量库
+    "address": "127.0.0.1:7862", # host:port 或 unix:<socket 文件路径>
+    "pool_size": 4,              # 客户端保留的空闲连接数
+    "timeout": 30                # 单次请求超时 (秒), 构建知识库不受限制
+}
+
+# 协议: 每帧为 [长度 u32][操作码或状态 u8][JSON 头长度 u32][JSON 头][二进制负载]，整数为大端序
+# 向量以 little-endian float32 矩阵放在二进制负载中, 不经过 JSON
+OP_PING, OP_EMBED, OP_SEARCH, OP_INFO, OP_BUILD, OP_UNLOAD, OP_STATS, OP_ADD, OP_DELETE, OP_UPDATE = range(1, 11)
+STATUS_OK, STATUS_ERROR = 0, 1
+_PREFIX = struct.Struct('>IBI')
+MAX_FRAME = 64 * 1024 * 1024
+
+def parse_address(address: str) -> Tuple[int, Any]:
+    """"unix:<路径>" → (AF_UNIX, 路径); "host:port" → (AF_INET, (host, port))"""
+    if address.startswith("unix:"): return socket.AF_UNIX, address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+def encode_frame(code: int, header: Dict[str, Any], payload: bytes = b"") -> bytes:
+    body = json.dumps(header, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+    return _PREFIX.pack(_PREFIX.size - 4 + len(body) + len(payload), code, len(body)) + body + payload
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = sock.recv(min(size - len(buffer), 1 << 20))
+        if not chunk: raise ConnectionError("连接已关闭")
+        buffer += chunk
+    return bytes(buffer)
+
+def read_frame(sock: socket.socket) -> Tuple[int, Dict[str, Any], bytes]:
+    """读取一帧，返回 (操作码或状态, JSON 头, 二进制负载)"""
+    length, code, header_length = _PREFIX.unpack(_recv_exact(sock, _PREFIX.size))
+    if length > MAX_FRAME: raise ValueError(f"帧过大: {length} 字节")
+    data = _recv_exact(sock, length - (_PREFIX.size - 4))
+    return code, json.loads(data[:header_length].decode('utf-8')), data[header_length:]
+
+def _pack_vectors(vectors: Any) -> Tuple[int, bytes]:
+    import numpy as np
+    matrix = np.asarray(vectors, dtype='<f4')
+    return (matrix.shape[1] if matrix.ndim == 2 else 0), matrix.tobytes()
+
+def _unpack_vectors(payload: bytes, count: int) -> Any:
+    import numpy as np
+    return np.frombuffer(payload, dtype='<f4').reshape(count, -1)
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class _ThreadingUnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+class _ConnectionHandler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        self.server.service.serve_connection(self.request)
+
+class RetrievalServer:
+    """独立的检索服务: 一个进程持有嵌入模型与全部向量库，多个应用进程通过本地 socket 查询
+
+    每个连接一个线程, 连接上可连续发送多个请求; 并发查询的嵌入计算由 EmbeddingService 合并为批次，
+    一帧中的多个查询 (search_batch) 只做一次前向计算。
+    """
+
+    def __init__(self, address: Optional[str] = None, rag: Any = None):
+        cfg = {**DEFAULT_RETRIEVAL_SERVICE_CFG, **(Config().get().get('retrieval_service') or {})}
+        self.address = address or cfg['address']
+        self.logger = setup_logger('log')
+        if rag is None:
+            from src.resume_rag import ResumeRAG
+            rag = ResumeRAG()
+        self.rag = rag
+        self._server = None
+        self._stats_lock = threading.Lock()
+        self._stats = {"connections": 0, "requests": 0, "queries": 0, "errors": 0, "busy_s": 0.0}
+        self._handlers: Dict[int, Callable[[Dict[str, Any], bytes], Tuple[Dict[str, Any], bytes]]] = {
+            OP_PING: lambda header, payload: ({"pong": True}, b""),
+            OP_EMBED: self._embed,
+            OP_SEARCH: self._search,
+            OP_INFO: self._info,
+            OP_BUILD: self._build,
+            OP_UNLOAD: self._unload,
+            OP_STATS: lambda header, payload: (self.stats(), b""),
+            OP_ADD: self._add,
+            OP_DELETE: self._delete,
+            OP_UPDATE: self._update,
+        }
+
+    # --- 请求处理 ---
+    def _embed(self, header: Dict[str, Any], payload: bytes) -> Tuple[Dict[str, Any], bytes]:
+        texts = header["texts"]
+        dim, data = _pack_vectors(self.rag.embeddings.embed_documents(texts))
+        return {"count": len(texts), "dim": dim}, data
+
+    def _search(self, header: Dict[str, Any], payload: bytes) -> Tuple[Dict[str, Any], bytes]:
+        queries = header["queries"]
+        vectors = _unpack_vectors(payload, len(queries)) if payload else self.rag.embeddings.embed_documents(queries) # 同一帧的查询一次前向
+        results = []
+        for query, vector in zip(queries, vectors):
+            docs = self.rag.search(query, k=int(header.get("k", 3)), tenant_id=header.get("tenant_id"),
+                                   query_vector=[float(x) for x in vector], filters=header.get("filters"))
+            results.append([{"page_content": doc.page_content, "metadata": doc.metadata} for doc in docs])
+        with self._stats_lock: self._stats["queries"] += len(queries)
+        return {"results": results}, b""
+
+    def _info(self, header: Dict[str, Any], payload: bytes) -> Tuple[Dict[str, Any], bytes]:
+        tenant_id = header.get("tenant_id")
+        return {"exists": self.rag.has_knowledge_base(tenant_id), "generation": self.rag.generation(tenant_id)}, b""
+
+    def _build(self, header: Dict[str, Any], payload: bytes) -> Tuple[Dict[str, Any], bytes]:
+        success = self.rag.build_knowledge_base(header.get("text", ""), header.get("images") or None, tenant_id=header.get("tenant_id"))
+        return {"success": bool(success)}, b""
+
+    def _unload(self, header: Dict[str, Any], payload: bytes) -> Tuple[Dict[str, Any], bytes]:
+        self.rag.unload(header.get("tenant_id"))
+        return {}, b""
+
+    # --- 增量更新 ---
+    def _add(self, header: Dict[str, Any], payload: bytes) -> Tuple[Dict[str, Any], bytes]:
+        docs = [Document(page_content=item["page_content"], metadata=item["metadata"]) for item in header["docs"]]
+        vectors = _unpack_vectors(payload, len(docs)) if payload else None
+        return {"ids": [int(i) for i in self.rag.add_documents(docs, header.get("tenant_id"), vectors)]}, b""
+
+    def _delete(self, header: Dict[str, Any], payload: bytes) -> Tuple[Dict[str, Any], bytes]:
+        return {"count": self.rag.delete_by_source(header["source"], header.get("tenant_id"))}, b""
+
+    def _update(self, header: Dict[str, Any], payload: bytes) -> Tuple[Dict[str, Any], bytes]:
+        ids = self.rag.update_source(header["source"], header["text"], header.get("tenant_id"), header.get("metadata"))
+        return {"ids": [int(i) for i in ids]}, b""
+
+    def serve_connection(self, sock: socket.socket) -> None:
+        """在一个连接上循环处理请求，直到客户端关闭连接"""
+        if sock.family == socket.AF_INET: sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self._stats_lock: self._stats["connections"] += 1
+        while True:
+            try: code, header, payload = read_frame(sock)
+            except (ConnectionError, OSError): return
+            start = time.monotonic()
+            try:
+                handler = self._handlers.get(code)
+                if handler is None: raise ValueError(f"未知操作码: {code}")
+                response, data = handler(header, payload)
+                status = STATUS_OK
+            except Exception as e:
+                self.logger.error(f"检索服务请求失败 (op={code}): {e}", exc_info=True)
+                response, data, status = {"error": str(e)}, b"", STATUS_ERROR
+            with self._stats_lock:
+                self._stats["requests"] += 1
+                self._stats["errors"] += status == STATUS_ERROR
+                self._stats["busy_s"] += time.monotonic() - start
+            try: sock.sendall(encode_frame(status, response, data))
+            except OSError: return
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock: stats = dict(self._stats)
+        stats["busy_s"] = round(stats["busy_s"], 3)
+        embedding_stats = getattr(self.rag.embeddings, "stats", None)
+        if embedding_stats: stats["embedding"] = embedding_stats()
+        return stats
+
+    # --- 运行 ---
+    def serve_forever(self) -> None:
+        family, address = parse_address(self.address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(address): os.remove(address) # 上次未正常退出留下的 socket 文件
+            self._server = _ThreadingUnixServer(address, _ConnectionHandler)
+        else: self._server = _ThreadingTCPServer(address, _ConnectionHandler)
+        self._server.service = self
+        self.logger.info(f"检索服务已启动: {self.address}")
+        try: self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if family == socket.AF_UNIX and os.path.exists(address): os.remove(address)
+
+    def shutdown(self) -> None:
+        if self._server: self._server.shutdown()
+
+class RemoteEmbeddings(Embeddings):
+    """通过检索服务计算向量 (固定问答、预计算回答等组件使用)"""
+
+    def __init__(self, client: "RetrievalClient"):
+        self.client = client
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts: return []
+        response, payload = self.client.request(OP_EMBED, {"texts": list(texts)})
+        return _unpack_vectors(payload, response["count"]).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+class RetrievalClient:
+    """检索服务客户端: 与 ResumeRAG 相同的 search / embed_query / has_knowledge_base / build_knowledge_base 接口，
+    以及增量更新 add_documents / delete_by_source / update_source (在服务端执行)
+
+    连接按需建立并放回连接池复用; 池中连接失效 (服务重启) 时换新连接重试一次。
+    """
+
+    def __init__(self, address: Optional[str] = None, pool_size: Optional[int] = None, timeout: Optional[float] = None):
+        cfg = {**DEFAULT_RETRIEVAL_SERVICE_CFG, **(Config().get().get('retrieval_service') or {})}
+        self.address = address or cfg['address']
+        self.pool_size = int(pool_size if pool_size is not None else cfg['pool_size'])
+        self.timeout = float(timeout if timeout is not None else cfg['timeout'])
+        self.logger = setup_logger('log')
+        self.embeddings = RemoteEmbeddings(self)
+        self._idle: "queue.LifoQueue[socket.socket]" = queue.LifoQueue()
+
+    def _connect(self) -> socket.socket:
+        family, address = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try: sock.connect(address)
+        except OSError:
+            sock.close()
+            raise
+        if family == socket.AF_INET: sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _release(self, sock: socket.socket) -> None:
+        if self._idle.qsize() < self.pool_size: self._idle.put(sock)
+        else: sock.close()
+
+    def request(self, code: int, header: Dict[str, Any], payload: bytes = b"", timeout: Any = "default") -> Tuple[Dict[str, Any], bytes]:
+        """发送一个请求并等待响应 (timeout=None 表示不限时)，服务端出错时抛出 RuntimeError"""
+        for attempt in range(2):
+            try: sock, reused = self._idle.get_nowait(), True
+            except queue.Empty: sock, reused = self._connect(), False
+            try:
+                sock.settimeout(self.timeout if timeout == "default" else timeout)
+                sock.sendall(encode_frame(code, header, payload))
+                status, response, data = read_frame(sock)
+            except socket.timeout:
+                sock.close()
+                raise
+            except (ConnectionError, OSError):
+                sock.close()
+                if reused and attempt == 0: continue # 空闲连接可能已被服务端关闭
+                raise
+            self._release(sock)
+            if status != STATUS_OK: raise RuntimeError(f"检索服务错误: {response.get('error')}")
+            return response, data
+
+    def close(self) -> None:
+        while True:
+            try: self._idle.get_nowait().close()
+            except queue.Empty: return
+
+    def ping(self) -> bool:
+        try: return bool(self.request(OP_PING, {})[0].get("pong"))
+        except Exception: return False
+
+    # --- 与 ResumeRAG 相同的接口 ---
+    def embed_query(self, query: str) -> List[float]:
+        return self.embeddings.embed_query(query)
+
+    async def aembed_query(self, query: str) -> List[float]:
+        return await self.embeddings.aembed_query(query) # Embeddings 默认实现: 在线程池中执行 embed_query
+
+    def search_batch(self, queries: List[str], k: int = 3, tenant_id: Optional[str] = None,
+                     query_vectors: Optional[List[Any]] = None, filters: Optional[Dict[str, Any]] = None) -> List[List[Document]]:
+        """一次请求检索多个查询 (服务端合并计算查询向量)"""
+        payload = _pack_vectors(query_vectors)[1] if query_vectors is not None else b""
+        response, _ = self.request(OP_SEARCH, {"queries": list(queries), "k": k, "tenant_id": tenant_id, "filters": filters}, payload)
+        return [[Document(page_content=item["page_content"], metadata=item["metadata"]) for item in items] for items in response["results"]]
+
+    def search(self, query: str, k: int = 3, tenant_id: Optional[str] = None, query_vector: Any = None,
+               filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        try:
+            return self.search_batch([query], k=k, tenant_id=tenant_id, query_vectors=None if query_vector is None else [query_vector], filters=filters)[0]
+        except Exception as e:
+            self.logger.error(f"远程检索失败: {e}", exc_info=True)
+            return []
+
+    def has_knowledge_base(self, tenant_id: Optional[str] = None) -> bool:
+        return bool(self.request(OP_INFO, {"tenant_id": tenant_id})[0]["exists"])
+
+    def generation(self, tenant_id: Optional[str] = None) -> Optional[str]:
+        return self.request(OP_INFO, {"tenant_id": tenant_id})[0]["generation"]
+
+    def build_knowledge_base(self, text_content: str, images: Optional[List[str]] = None, tenant_id: Optional[str] = None,
+                             progress: Optional[Callable[[float, str], None]] = None) -> bool:
+        """在检索服务进程中构建知识库 (图片路径需在服务端可访问), 阻塞到构建结束"""
+        report = progress or (lambda fraction, message="": None)
+        try:
+            report(0.05, "提交到检索服务构建")
+            success = self.request(OP_BUILD, {"text": text_content, "images": list(images or []), "tenant_id": tenant_id}, timeout=None)[0]["success"]
+            report(1.0, "知识库已发布" if success else "构建失败")
+            return success
+        except Exception as e:
+            self.logger.error(f"远程构建知识库失败: {e}", exc_info=True)
+            return False
+
+    def add_documents(self, docs: List[Document], tenant_id: Optional[str] = None, vectors: Any = None) -> List[int]:
+        """向服务端知识库追加分块 (已计算的向量随请求发送)，返回分块 id; 失败返回空列表"""
+        try:
+            payload = _pack_vectors(vectors)[1] if vectors is not None else b""
+            items = [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in docs]
+            return self.request(OP_ADD, {"docs": items, "tenant_id": tenant_id}, payload, timeout=None)[0]["ids"]
+        except Exception as e:
+            self.logger.error(f"远程追加分块失败: {e}", exc_info=True)
+            return []
+
+    def delete_by_source(self, source: str, tenant_id: Optional[str] = None) -> int:
+        try: return int(self.request(OP_DELETE, {"source": source, "tenant_id": tenant_id}, timeout=None)[0]["count"])
+        except Exception as e:
+            self.logger.error(f"远程删除分块失败: {e}", exc_info=True)
+            return 0
+
+    def update_source(self, source: str, text: str, tenant_id: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None) -> List[int]:
+        """在服务端以新文本替换某来源的分块 (切分和嵌入在服务端完成)"""
+        try: return self.request(OP_UPDATE, {"source": source, "text": text, "tenant_id": tenant_id, "metadata": metadata}, timeout=None)[0]["ids"]
+        except Exception as e:
+            self.logger.error(f"远程更新来源失败: {e}", exc_info=True)
+            return []
+
+    def unload(self, tenant_id: Optional[str] = None) -> None:
+        self.request(OP_UNLOAD, {"tenant_id": tenant_id})
+
+    def stats(self) -> Dict[str, Any]:
+        return self.request(OP_STATS, {})[0]
@@ -0,0 +1,99 @@
+import json, hashlib, threading
+from typing import Optional, Dict, List, Callable, Any
+from src.cancellation import GenerationCancelled, current_token
+
+DEFAULT_SINGLEFLIGHT_CFG = {
+    "enabled": True,     # 相同的并发请求合并为一次计算
+    "queries": True,     # QueryPipeline 生成阶段: 检索到内容的 RAG 查询 (中间件处理 + 生成) 合并
+    "generation": True   # LLMService.generate_response 层: 不采样 (do_sample=False) 的生成合并
+}
+
+def flight_key(*parts: Any) -> str:
+    """由请求参数得到合并键 (参数需可 JSON 序列化, 其他类型按 str 处理)"""
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+class _Call:
+    """一次进行中的计算: 已输出的文本片段与最终结果"""
+    __slots__ = ("cond", "chunks", "done", "result", "error")
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.chunks: List[str] = []
+        self.done, self.result, self.error = False, None, None
+
+    def publish(self, text: str) -> None:
+        with self.cond:
+            self.chunks.append(text)
+            self.cond.notify_all()
+
+class SingleFlight:
+    """相同 key 的并发调用只执行一次: 第一个调用执行 fn, 其余调用等待并共享其结果、异常与流式文本
+
+    只合并同时进行中的调用 (结束后即移除, 不是缓存)。跟随者先补发已输出的文本片段, 再随执行者逐段收到后续片段。
+    执行者被取消 (如其会话提交了新问题) 时, 自身未取消的跟随者重新发起计算; 跟随者等待时同样响应自己的取消令牌。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._stats = {"leaders": 0, "coalesced": 0}
+
+    def do(self, key: str, fn: Callable[[Optional[Callable[[str], None]]], Any], on_text: Optional[Callable[[str], None]] = None) -> Any:
+        """执行 fn(on_text) 或等待进行中的同 key 调用; fn 的流式回调会转发给所有调用方"""
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader: call = self._calls[key] = _Call()
+                self._stats["leaders" if leader else "coalesced"] += 1
+            if leader: return self._lead(key, call, fn, on_text)
+            try: return self._follow(call, on_text)
+            except GenerationCancelled as e:
+                if e is not call.error: raise # 自己的令牌被取消
+                token = current_token()
+                if token is not None: token.raise_if_stopped(partial="".join(call.chunks))
+                on_text = self._skip(on_text, len(call.chunks)) # 执行者被取消: 重新发起, 已转发的片段不重复输出
+
+    def _lead(self, key: str, call: _Call, fn: Callable, on_text: Optional[Callable[[str], None]]) -> Any:
+        def publish(text: str) -> None:
+            call.publish(text)
+            if on_text: on_text(text)
+        try:
+            call.result = fn(publish) # 总是流式输出, 中途加入的跟随者也能收到文本
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock: del self._calls[key]
+            with call.cond:
+                call.done = True
+                call.cond.notify_all()
+
+    def _follow(self, call: _Call, on_text: Optional[Callable[[str], None]]) -> Any:
+        token, sent = current_token(), 0
+        while True:
+            with call.cond:
+                while not call.done and len(call.chunks) == sent and not (token is not None and token.should_stop()):
+                    call.cond.wait(0.5)
+                chunks, done = call.chunks[sent:], call.done
+            sent += len(chunks)
+            if on_text:
+                for text in chunks: on_text(text) # 在锁外回调
+            if done: break
+            if token is not None and not chunks: token.raise_if_stopped(partial="".join(call.chunks[:sent]))
+        if call.error is not None: raise call.error
+        return call.result
+
+    @staticmethod
+    def _skip(on_text: Optional[Callable[[str], None]], count: int) -> Optional[Callable[[str], None]]:
+        """跳过前 count 个片段的回调 (重新生成的确定性输出与已转发的内容相同)"""
+        if on_text is None or count == 0: return on_text
+        skipped = [0]
+        def forward(text: str) -> None:
+            if skipped[0] < count: skipped[0] += 1
+            else: on_text(text)
+        return forward
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock: return {**self._stats, "inflight": len(self._calls)}
@@ -1,4 +1,4 @@
-import requests, json, hashlib, hmac, base64, time
+import requests, json, hashlib, hmac, base64, time, asyncio
 from datetime import datetime
 from langchain_core.tools import tool
 from src.utils import Config, setup_logger
@@ -6,6 +6,8 @@ from bs4 import BeautifulSoup
 import re
 from typing import Optional
 import logging
+try: import aiohttp
+except ImportError: aiohttp = None # 可选依赖: 未安装时 aget_weather 在线程池中执行同步请求
 
 logger = logging.getLogger(__name__)
 
@@ -304,82 +306,95 @@ class WeatherTool:
         # 对于未知城市，返回随机天气
         return {"location": location, "date": date, "weather": "未知，数据暂缺"}
 
-# 注册工具函数
-@tool
-def get_weather(input_str: str) -> str:
-    """查询指定地点的天气情况。输入格式：地点,日期。日期可选值：today/tomorrow/after_tomorrow"""
-    logger.info(f"查询天气: {input_str}")
-    
-    # 参数验证
+WEATHER_TIMEOUT = 10 # 天气网页请求超时 (秒)
+
+def _parse_weather_input(input_str: str):
+    """解析 "地点,日期" 输入，返回 (地点, 日期, 城市代码, 错误信息)"""
     if not input_str or ',' not in input_str:
-        return "参数错误：请提供正确的查询格式，如'北京,today'"
-    
-    # 解析参数
+        return None, None, None, "参数错误：请提供正确的查询格式，如'北京,today'"
     location, date = input_str.split(',', 1)
     location = location.strip()
     date = date.strip().lower()
-    
-    # 验证地点
     if not location:
-        return "参数错误：地点不能为空"
-    
-    # 验证日期
+        return None, None, None, "参数错误：地点不能为空"
     valid_dates = ['today', 'tomorrow', 'after_tomorrow']
     if date not in valid_dates:
-        return f"参数错误：日期必须是 {'/'.join(valid_dates)} 之一"
-    
-    # 使用WeatherTool类的city_code_map
-    weather_tool = WeatherTool()
-    city_codes = weather_tool.city_code_map
-    
-    # 检查城市是否支持
+        return None, None, None, f"参数错误：日期必须是 {'/'.join(valid_dates)} 之一"
+    city_codes = WeatherTool().city_code_map # 使用WeatherTool类的city_code_map
     if location not in city_codes:
-        return f"暂不支持查询该地区，当前支持的城市: {', '.join(sorted(city_codes.keys()))}"
-    
+        return None, None, None, f"暂不支持查询该地区，当前支持的城市: {', '.join(sorted(city_codes.keys()))}"
+    return location, date, city_codes[location], None
+
+WEATHER_HEADERS = {'User-Agent': 'Mozilla/5.0'}
+
+def _weather_request(input_str: str):
+    """解析输入并构建天气网页请求，返回 (地点, 日期, URL, 错误信息)"""
+    location, date, city_code, error = _parse_weather_input(input_str)
+    if error: return None, None, None, error
+    return location, date, f'http://www.weather.com.cn/weather/{city_code}.shtml', None
+
+def _weather_response(location: str, date: str, status: int, html: str) -> str:
+    """处理天气网页响应: 非 200 返回错误信息，否则提取天气"""
+    if status != 200:
+        return f"获取天气数据失败，HTTP状态码: {status}"
+    return _parse_weather_page(location, date, html)
+
+def _weather_error(prefix: str, e: Exception) -> str:
+    error_msg = f"{prefix}: {str(e) or type(e).__name__}"
+    logger.error(error_msg)
+    return error_msg
+
+def _parse_weather_page(location: str, date: str, html: str) -> str:
+    """从中国天气网 7 日预报页面中提取指定日期的天气"""
+    soup = BeautifulSoup(html, 'html.parser')
+    weather_div = soup.find('div', {'id': '7d'})
+    if not weather_div:
+        return "解析天气数据失败：找不到天气信息"
+    weather_list = weather_div.find('ul').find_all('li')
+    day_index = {'today': 0, 'tomorrow': 1, 'after_tomorrow': 2}
+    weather_data = weather_list[day_index[date]]
+    date_text = weather_data.find('h1').text
+    weather_text = weather_data.find('p', {'class': 'wea'}).text
+    temperature = weather_data.find('p', {'class': 'tem'}).text.strip()
+    wind = weather_data.find('p', {'class': 'win'}).text.strip()
+    result = f"{location}{date_text}天气：{weather_text}，温度{temperature}，{wind}"
+    logger.info(f"天气查询结果: {result}")
+    return result
+
+def _fetch_weather(input_str: str) -> str:
+    """同步查询天气 (requests)"""
+    location, date, url, error = _weather_request(input_str)
+    if error: return error
     try:
-        # 构建URL
-        url = f'http://www.weather.com.cn/weather/{city_codes[location]}.shtml'
-        
-        # 发送请求
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        response = requests.get(url, headers=headers, timeout=10)
+        response = requests.get(url, headers=WEATHER_HEADERS, timeout=WEATHER_TIMEOUT)
         response.encoding = response.apparent_encoding
-        
-        if response.status_code != 200:
-            return f"获取天气数据失败，HTTP状态码: {response.status_code}"
-        
-        # 解析HTML
-        soup = BeautifulSoup(response.text, 'html.parser')
-        weather_div = soup.find('div', {'id': '7d'})
-        if not weather_div:
-            return "解析天气数据失败：找不到天气信息"
-        
-        # 获取天气数据
-        weather_list = weather_div.find('ul').find_all('li')
-        
-        # 根据日期选择数据
-        day_index = {'today': 0, 'tomorrow': 1, 'after_tomorrow': 2}
-        weather_data = weather_list[day_index[date]]
-        
-        # 提取信息
-        date_text = weather_data.find('h1').text
-        weather_text = weather_data.find('p', {'class': 'wea'}).text
-        temperature = weather_data.find('p', {'class': 'tem'}).text.strip()
-        wind = weather_data.find('p', {'class': 'win'}).text.strip()
-        
-        # 格式化返回结果
-        result = f"{location}{date_text}天气：{weather_text}，温度{temperature}，{wind}"
-        logger.info(f"天气查询结果: {result}")
-        return result
-        
-    except requests.RequestException as e:
-        error_msg = f"请求天气数据失败: {str(e)}"
-        logger.error(error_msg)
-        return error_msg
-    except Exception as e:
-        error_msg = f"处理天气数据时出错: {str(e)}"
-        logger.error(error_msg)
-        return error_msg
+        return _weather_response(location, date, response.status_code, response.text)
+    except requests.RequestException as e: return _weather_error("请求天气数据失败", e)
+    except Exception as e: return _weather_error("处理天气数据时出错", e)
+
+# 注册工具函数
+@tool
+def get_weather(input_str: str) -> str:
+    """查询指定地点的天气情况。输入格式：地点,日期。日期可选值：today/tomorrow/after_tomorrow"""
+    logger.info(f"查询天气: {input_str}")
+    return _fetch_weather(input_str)
+
+async def aget_weather(input_str: str) -> str:
+    """get_weather 的异步版本: 用 aiohttp 请求网页, 等待网络时不占用线程; 调用方取消时请求随之中止"""
+    logger.info(f"查询天气 (async): {input_str}")
+    if aiohttp is None:
+        logger.warning("aiohttp 未安装，天气查询改在线程池中同步执行 (pip install aiohttp)")
+        return await asyncio.get_running_loop().run_in_executor(None, _fetch_weather, input_str)
+    location, date, url, error = _weather_request(input_str)
+    if error: return error
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=WEATHER_TIMEOUT), headers=WEATHER_HEADERS) as session:
+            async with session.get(url) as response:
+                status = response.status
+                html = (await response.read()).decode(response.charset or 'utf-8', errors='replace')
+        return _weather_response(location, date, status, html)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e: return _weather_error("请求天气数据失败", e)
+    except Exception as e: return _weather_error("处理天气数据时出错", e)
 
 # 添加单元测试
 if __name__ == "__main__":
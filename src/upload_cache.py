@@ -0,0 +1,128 @@
+import os, json, shutil, hashlib, threading
+from typing import Optional, Dict, List, Tuple, Any
+import numpy as np
+from langchain_core.documents import Document
+from src.utils import Config, setup_logger
+from src.chunking import CHUNKER_VERSION
+
+class UploadCache:
+    """上传文件去重缓存 (磁盘, 内容寻址, 按总大小淘汰最久未使用的条目)
+
+    files/<文件哈希>/text.txt                 - 提取出的文本 (免去重复的 PDF 解析 / OCR)
+    chunks/<内容键>/chunks.json, vectors.npy  - 分块与向量 (免去重复的切分与嵌入)
+    内容键由文本哈希、嵌入模型与切分参数共同决定，配置变化后自动失效。
+    """
+    _lock = threading.Lock() # 进程内串行化写入与淘汰
+    EVICT_TARGET = 0.9 # 超过上限时淘汰到上限的该比例, 留出余量, 避免缓存满后每次写入都扫描目录
+    _sizes: Dict[str, int] = {} # 缓存目录 → 条目总大小 (首次写入时扫描一次, 之后随写入累加, 淘汰时按扫描结果校正)
+
+    def __init__(self):
+        cfg = Config().get().get('upload_cache') or {}
+        self.logger = setup_logger('log')
+        self.enabled = cfg.get('enabled', True)
+        self.root = cfg.get('path', 'data/upload_cache')
+        self.max_bytes = int(cfg.get('max_mb', 512)) * 1024 * 1024
+
+    @staticmethod
+    def file_hash(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def content_key(text: str, embedding_cfg: Dict[str, Any]) -> str:
+        """文本 + 嵌入/切分配置 (含切分逻辑版本) 的内容键"""
+        signature = json.dumps({**{k: embedding_cfg.get(k) for k in sorted(embedding_cfg) if k != 'device'}, "chunker_version": CHUNKER_VERSION},
+                               sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256((signature + "\0" + text).encode('utf-8')).hexdigest()
+
+    def _entry(self, kind: str, key: str) -> str:
+        return os.path.join(self.root, kind, key)
+
+    def _touch(self, entry: str) -> None:
+        try: os.utime(entry) # 目录 mtime 作为最近使用时间
+        except OSError: pass
+
+    def get_text(self, file_hash: str) -> Optional[str]:
+        """按文件哈希取提取文本"""
+        path = os.path.join(self._entry("files", file_hash), "text.txt")
+        if not self.enabled or not os.path.exists(path): return None
+        with open(path, 'r', encoding='utf-8') as f: text = f.read()
+        self._touch(os.path.dirname(path))
+        self.logger.info(f"上传缓存命中 (文本): {file_hash[:16]}")
+        return text
+
+    def put_text(self, file_hash: str, text: str) -> None:
+        if not self.enabled: return
+        self._write("files", file_hash, {"text.txt": text})
+
+    def get_chunks(self, key: str) -> Optional[Tuple[List[Document], Any]]:
+        """按内容键取分块与向量"""
+        entry = self._entry("chunks", key)
+        chunks_path, vectors_path = os.path.join(entry, "chunks.json"), os.path.join(entry, "vectors.npy")
+        if not self.enabled or not (os.path.exists(chunks_path) and os.path.exists(vectors_path)): return None
+        with open(chunks_path, 'r', encoding='utf-8') as f:
+            docs = [Document(page_content=c["page_content"], metadata=c.get("metadata", {})) for c in json.load(f)]
+        vectors = np.load(vectors_path)
+        self._touch(entry)
+        self.logger.info(f"上传缓存命中 (分块与向量): {key[:16]}, {len(docs)} 个分块")
+        return docs, vectors
+
+    def put_chunks(self, key: str, docs: List[Document], vectors: Any) -> None:
+        if not self.enabled: return
+        chunks = [{"page_content": d.page_content, "metadata": d.metadata} for d in docs]
+        self._write("chunks", key, {"chunks.json": json.dumps(chunks, ensure_ascii=False), "vectors.npy": np.asarray(vectors, dtype='float32')})
+
+    def _write(self, kind: str, key: str, files: Dict[str, Any]) -> None:
+        """写入条目 (先写临时目录再改名, 读取方不会看到半成品), 随后按容量淘汰"""
+        entry = self._entry(kind, key)
+        tmp_entry = f"{entry}.tmp{os.getpid()}_{threading.get_ident()}"
+        try:
+            os.makedirs(tmp_entry, exist_ok=True)
+            for name, content in files.items():
+                if isinstance(content, str):
+                    with open(os.path.join(tmp_entry, name), 'w', encoding='utf-8') as f: f.write(content)
+                else: np.save(os.path.join(tmp_entry, name), content)
+            with self._lock:
+                total = self._total_size()
+                if os.path.exists(entry):
+                    total -= self._entry_size(entry)
+                    shutil.rmtree(entry)
+                os.replace(tmp_entry, entry)
+                UploadCache._sizes[self.root] = total = total + self._entry_size(entry)
+                if total > self.max_bytes: self._evict() # 未超过上限时不扫描目录
+        except Exception as e:
+            self.logger.error(f"写入上传缓存失败: {e}", exc_info=True)
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+    @staticmethod
+    def _entry_size(entry: str) -> int:
+        return sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+
+    def _scan(self) -> List[Tuple[float, int, str]]:
+        """扫描全部条目, 返回 (最近使用时间, 大小, 目录)"""
+        entries = []
+        for kind in ("files", "chunks"):
+            kind_dir = os.path.join(self.root, kind)
+            if not os.path.isdir(kind_dir): continue
+            for name in os.listdir(kind_dir):
+                entry = os.path.join(kind_dir, name)
+                if '.tmp' in name or not os.path.isdir(entry): continue
+                entries.append((os.path.getmtime(entry), self._entry_size(entry), entry))
+        return entries
+
+    def _total_size(self) -> int:
+        if self.root not in UploadCache._sizes: UploadCache._sizes[self.root] = sum(size for _, size, _ in self._scan())
+        return UploadCache._sizes[self.root]
+
+    def _evict(self) -> None:
+        """总大小超过上限时按最近使用时间淘汰 (重新扫描, 同时校正其他进程写入造成的偏差)"""
+        entries = self._scan()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            UploadCache._sizes[self.root] = total
+            return
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes * self.EVICT_TARGET: break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            self.logger.info(f"上传缓存淘汰: {entry}")
+        UploadCache._sizes[self.root] = total
@@ -0,0 +1,676 @@
+import os, json, time, uuid, shutil, sqlite3, threading
+import numpy as np
+import faiss
+from typing import Optional, Dict, List, Tuple, Iterator, Any
+from langchain_core.documents import Document
+from src.utils import setup_logger
+
+class SQLiteDocstore:
+    """基于 SQLite 的紧凑文档存储 (按 id 惰性读取分块文本, 替代 pickle 的 index.pkl)
+
+    chunks         - 分块文本、元数据, 以及从元数据冗余出的可过滤列 (source / candidate_id / section)
+    chunk_skills   - 分块的技能标签 (小写)
+    delta_vectors  - 构建之后追加的分块向量 (合并前不写入 FAISS 索引文件)
+    tombstones     - 已删除分块的 id (检索时过滤, 合并时物理删除)
+    """
+    FILTER_COLUMNS = ("source", "candidate_id", "section")
+    FILTER_KEYS = FILTER_COLUMNS + ("skills",)
+    SCHEMA = (
+        "CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks (source)",
+        "CREATE INDEX IF NOT EXISTS idx_chunks_candidate ON chunks (candidate_id, section)",
+        "CREATE INDEX IF NOT EXISTS idx_chunks_section ON chunks (section)",
+        "CREATE TABLE IF NOT EXISTS delta_vectors (id INTEGER PRIMARY KEY, vector BLOB NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS tombstones (seq INTEGER PRIMARY KEY AUTOINCREMENT, id INTEGER NOT NULL UNIQUE)"
+    )
+
+    def __init__(self, path: str, readonly: bool = False):
+        self.path = path
+        self.readonly = readonly
+        self._lock = threading.Lock() # sqlite 连接跨线程共享，读写串行化
+        if readonly:
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+            if not self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunk_skills'").fetchone():
+                self._conn.close() # 旧版本创建的文档存储: 先以读写方式补齐表结构
+                self._migrate(sqlite3.connect(path), close=True)
+                self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._migrate(self._conn)
+
+    @classmethod
+    def _migrate(cls, conn: sqlite3.Connection, close: bool = False) -> None:
+        """建表, 并为旧文档存储补充可过滤列、技能标签表与增量/删除标记表"""
+        conn.execute("CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT NOT NULL, metadata TEXT, "
+                     "source TEXT, candidate_id TEXT, section TEXT)")
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(chunks)")}
+        for column in cls.FILTER_COLUMNS:
+            if column in columns: continue
+            conn.execute(f"ALTER TABLE chunks ADD COLUMN {column} TEXT")
+            try: conn.execute(f"UPDATE chunks SET {column} = json_extract(metadata, '$.{column}')")
+            except sqlite3.OperationalError: pass # sqlite 未编译 JSON1 扩展时旧分块没有该列的值
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunk_skills'").fetchone():
+            conn.execute("CREATE TABLE chunk_skills (skill TEXT NOT NULL, id INTEGER NOT NULL, PRIMARY KEY (skill, id)) WITHOUT ROWID")
+            try: conn.execute("INSERT OR IGNORE INTO chunk_skills SELECT lower(skills.value), chunks.id FROM chunks, json_each(chunks.metadata, '$.skills') AS skills")
+            except sqlite3.OperationalError: pass
+        for statement in cls.SCHEMA: conn.execute(statement)
+        conn.commit()
+        if close: conn.close()
+
+    def _insert(self, docs: List[Document], vectors: Any = None) -> List[int]:
+        """在当前事务中写入分块 (及增量向量), 返回分配的 id"""
+        ids, cur = [], self._conn.cursor()
+        for i, doc in enumerate(docs):
+            metadata = doc.metadata or {}
+            cur.execute("INSERT INTO chunks (text, metadata, source, candidate_id, section) VALUES (?, ?, ?, ?, ?)",
+                        (doc.page_content, json.dumps(metadata, ensure_ascii=False),
+                         *(None if metadata.get(column) is None else str(metadata[column]) for column in self.FILTER_COLUMNS)))
+            ids.append(cur.lastrowid)
+            skills = {str(skill).lower() for skill in metadata.get('skills') or ()}
+            if skills: cur.executemany("INSERT OR IGNORE INTO chunk_skills (skill, id) VALUES (?, ?)", [(skill, cur.lastrowid) for skill in skills])
+            if vectors is not None:
+                cur.execute("INSERT INTO delta_vectors (id, vector) VALUES (?, ?)", (cur.lastrowid, np.asarray(vectors[i], dtype='float32').tobytes()))
+        return ids
+
+    def _tombstone_source(self, source: str) -> List[int]:
+        """在当前事务中标记某来源的全部有效分块为已删除"""
+        ids = [row[0] for row in self._conn.execute(
+            "SELECT id FROM chunks WHERE source = ? AND id NOT IN (SELECT id FROM tombstones)", (source,)).fetchall()]
+        self._conn.executemany("INSERT OR IGNORE INTO tombstones (id) VALUES (?)", [(i,) for i in ids])
+        return ids
+
+    def add(self, docs: List[Document], vectors: Any = None) -> List[int]:
+        """写入分块，返回分配的整数 id (即 FAISS 中的向量 id)；给出 vectors 时作为增量向量在同一事务中写入"""
+        with self._lock:
+            ids = self._insert(docs, vectors)
+            self._conn.commit()
+        return ids
+
+    def delete_by_source(self, source: str) -> List[int]:
+        """标记删除某来源的全部分块，返回被删除的 id"""
+        with self._lock:
+            ids = self._tombstone_source(source)
+            self._conn.commit()
+        return ids
+
+    def replace_source(self, source: str, docs: List[Document], vectors: Any) -> Tuple[List[int], List[int]]:
+        """以新分块替换某来源 (删除与追加在一次提交中完成, 读取方不会看到中间状态)，返回 (删除的 id, 新增的 id)"""
+        with self._lock:
+            deleted = self._tombstone_source(source)
+            added = self._insert(docs, vectors)
+            self._conn.commit()
+        return deleted, added
+
+    def get(self, ids: List[int]) -> Dict[int, Document]:
+        """按 id 批量取回分块文本"""
+        if not ids: return {}
+        placeholders = ",".join("?" * len(ids))
+        with self._lock:
+            rows = self._conn.execute(f"SELECT id, text, metadata FROM chunks WHERE id IN ({placeholders})", [int(i) for i in ids]).fetchall()
+        return {row[0]: Document(page_content=row[1], metadata=json.loads(row[2]) if row[2] else {}) for row in rows}
+
+    def filter_ids(self, filters: Dict[str, Any]) -> Any:
+        """满足过滤条件的有效分块 id (升序 int64 数组)
+
+        filters: {"candidate_id" / "section" / "source" / "skills": 值或值列表}; 同一键的多个值为"或", 不同键之间为"且"。
+        """
+        clauses, params = ["id NOT IN (SELECT id FROM tombstones)"], []
+        for key, value in filters.items():
+            if key not in self.FILTER_KEYS: raise ValueError(f"不支持的过滤条件: {key} (可选: {', '.join(self.FILTER_KEYS)})")
+            values = [value] if isinstance(value, (str, int)) else list(value)
+            if not values: return np.empty(0, dtype='int64')
+            placeholders = ",".join("?" * len(values))
+            if key == "skills":
+                clauses.append(f"id IN (SELECT id FROM chunk_skills WHERE skill IN ({placeholders}))")
+                params.extend(str(v).lower() for v in values)
+            else:
+                clauses.append(f"{key} IN ({placeholders})")
+                params.extend(str(v) for v in values)
+        with self._lock:
+            rows = self._conn.execute(f"SELECT id FROM chunks WHERE {' AND '.join(clauses)} ORDER BY id", params).fetchall()
+        return np.fromiter((row[0] for row in rows), dtype='int64', count=len(rows))
+
+    def iter_batches(self, batch_size: int = 1000) -> "Iterator[List[Tuple[int, Document]]]":
+        """按 id 顺序分批遍历全部分块"""
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute("SELECT id, text, metadata FROM chunks WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size)).fetchall()
+            if not rows: return
+            yield [(row[0], Document(page_content=row[1], metadata=json.loads(row[2]) if row[2] else {})) for row in rows]
+            last_id = rows[-1][0]
+
+    def changes_since(self, tombstone_seq: int, delta_id: int) -> Tuple[int, List[Tuple[int, int]], List[Tuple[int, bytes]]]:
+        """读取 (data_version, 新增删除标记 [(seq, id)], 新增增量向量 [(id, vector)])，在同一读事务中保证一致"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+                tombstones = self._conn.execute("SELECT seq, id FROM tombstones WHERE seq > ? ORDER BY seq", (tombstone_seq,)).fetchall()
+                delta = self._conn.execute("SELECT id, vector FROM delta_vectors WHERE id > ? ORDER BY id", (delta_id,)).fetchall()
+            finally: self._conn.execute("COMMIT")
+        return version, tombstones, delta
+
+    def data_version(self) -> int:
+        """其他连接提交变更后该值改变 (用于判断是否需要同步增量)"""
+        with self._lock: return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def copy_compacted(self, path: str, tombstone_ids: Any, delta_ids: Any) -> None:
+        """复制为新的文档存储, 物理删除 tombstone_ids 中的分块并移除已并入索引的 delta_ids 增量 (分块 id 与自增序列保持不变)
+
+        只处理合并时读取到的删除标记与增量: 读取之后 (其他进程) 提交的写入在复制中原样保留, 新向量库加载后作为增量同步。
+        """
+        target = sqlite3.connect(path)
+        with self._lock: self._conn.backup(target)
+        target.execute("CREATE TEMP TABLE compacted_tombstones (id INTEGER PRIMARY KEY)")
+        target.execute("CREATE TEMP TABLE compacted_delta (id INTEGER PRIMARY KEY)")
+        target.executemany("INSERT OR IGNORE INTO compacted_tombstones (id) VALUES (?)", [(int(i),) for i in tombstone_ids])
+        target.executemany("INSERT OR IGNORE INTO compacted_delta (id) VALUES (?)", [(int(i),) for i in delta_ids])
+        target.execute("DELETE FROM chunk_skills WHERE id IN (SELECT id FROM compacted_tombstones)")
+        target.execute("DELETE FROM chunks WHERE id IN (SELECT id FROM compacted_tombstones)")
+        target.execute("DELETE FROM tombstones WHERE id IN (SELECT id FROM compacted_tombstones)")
+        target.execute("DELETE FROM delta_vectors WHERE id IN (SELECT id FROM compacted_delta UNION SELECT id FROM compacted_tombstones)")
+        target.commit()
+        target.execute("DROP TABLE compacted_tombstones")
+        target.execute("DROP TABLE compacted_delta")
+        target.execute("VACUUM")
+        target.close()
+
+    def count(self) -> int:
+        """有效 (未删除) 分块数"""
+        with self._lock: return self._conn.execute("SELECT COUNT(*) FROM chunks WHERE id NOT IN (SELECT id FROM tombstones)").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock: self._conn.close()
+
+DEFAULT_INDEX_CFG = {
+    "type": "flat",          # flat / hnsw / ivfpq / sq8 (int8 标量量化) / binary (按维二值化, 汉明距离)
+    "hnsw_m": 32,            # HNSW 每个节点的邻居数
+    "ef_construction": 200,  # HNSW 建图时的候选集大小
+    "ef_search": 64,         # HNSW 检索时的候选集大小
+    "nlist": 256,            # IVF 聚类中心数
+    "nprobe": 16,            # IVF 检索时访问的聚类数
+    "pq_m": 16,              # PQ 子空间数 (需整除向量维度)
+    "pq_nbits": 8,           # 每个子空间的编码位数
+    "filter_exact_max": 20000, # 过滤后的候选数不超过该值时按 id 读取原始向量精确计算, 否则在 ANN 检索中用 ID 选择器过滤
+    "rescore_factor": 4      # 压缩索引 (sq8 / binary / ivfpq) 先取 k * rescore_factor 个候选, 再用原始向量精确重排; 0 关闭
+}
+COMPRESSED_INDEX_TYPES = ("sq8", "binary", "ivfpq") # 索引中保存的是压缩编码, 检索结果需要重排
+
+def build_index(vectors: Any, index_cfg: Optional[Dict[str, Any]] = None) -> Tuple[Any, Dict[str, Any]]:
+    """按配置创建并训练 FAISS 索引 (IDMap2 包装)，返回 (未添加向量的索引, 实际生效的配置)
+
+    训练样本不足时 (IVF 需至少 nlist 个, PQ 需至少 2**pq_nbits 个) 自动退回 flat。
+    """
+    logger = setup_logger('log')
+    cfg = {**DEFAULT_INDEX_CFG, **(index_cfg or {})}
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    n, dim = vectors.shape
+    index_type = cfg['type'].lower()
+    if index_type == 'hnsw':
+        base = faiss.IndexHNSWFlat(dim, cfg['hnsw_m'])
+        base.hnsw.efConstruction = cfg['ef_construction']
+    elif index_type == 'ivfpq':
+        min_train = max(cfg['nlist'], 2 ** cfg['pq_nbits'])
+        if dim % cfg['pq_m'] != 0:
+            logger.warning(f"pq_m={cfg['pq_m']} 不能整除向量维度 {dim}，退回 flat 索引")
+            return build_index(vectors, {**cfg, "type": "flat"})
+        if n < min_train:
+            logger.warning(f"训练样本 {n} 条少于 IVF-PQ 所需的 {min_train} 条，退回 flat 索引")
+            return build_index(vectors, {**cfg, "type": "flat"})
+        quantizer = faiss.IndexFlatL2(dim)
+        base = faiss.IndexIVFPQ(quantizer, dim, cfg['nlist'], cfg['pq_m'], cfg['pq_nbits'])
+        logger.info(f"训练 IVF-PQ 索引: nlist={cfg['nlist']}, pq_m={cfg['pq_m']}, 样本数={n}")
+        base.train(vectors)
+    elif index_type == 'sq8':
+        base = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit) # 每维 1 字节
+        base.train(vectors)
+    elif index_type == 'binary':
+        base = faiss.IndexLSH(dim, dim, False, True) # 不旋转, 每维按训练样本的中位数阈值二值化 (每维 1 位)
+        base.train(vectors)
+    elif index_type == 'flat':
+        base = faiss.IndexFlatL2(dim)
+    else:
+        raise ValueError(f"不支持的索引类型: {cfg['type']}")
+    cfg['type'] = index_type
+    index = faiss.IndexIDMap2(base)
+    apply_search_params(index, cfg)
+    return index, cfg
+
+def apply_search_params(index: Any, index_cfg: Dict[str, Any]) -> None:
+    """设置检索期参数 (HNSW efSearch / IVF nprobe)"""
+    index_type = index_cfg.get('type', 'flat')
+    params = faiss.ParameterSpace()
+    if index_type == 'hnsw': params.set_index_parameter(index, "efSearch", int(index_cfg.get('ef_search', DEFAULT_INDEX_CFG['ef_search'])))
+    elif index_type == 'ivfpq': params.set_index_parameter(index, "nprobe", int(index_cfg.get('nprobe', DEFAULT_INDEX_CFG['nprobe'])))
+
+def search_parameters(index_cfg: Dict[str, Any], selector: Any) -> Any:
+    """带 ID 选择器的单次检索参数 (传入参数时索引上设置的 efSearch / nprobe 不生效, 需在此重新指定)"""
+    index_type = index_cfg.get('type', 'flat')
+    if index_type == 'hnsw':
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = int(index_cfg.get('ef_search', DEFAULT_INDEX_CFG['ef_search']))
+    elif index_type == 'ivfpq':
+        params = faiss.SearchParametersIVF()
+        params.nprobe = int(index_cfg.get('nprobe', DEFAULT_INDEX_CFG['nprobe']))
+    else: params = faiss.SearchParameters()
+    params.sel = selector
+    return params
+
+# --- 版本化目录: <root>/versions/<版本号>/ 存放各次构建, <root>/CURRENT 指向当前版本 ---
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+
+def read_current_version(root: str) -> Optional[str]:
+    """读取当前版本号 (未版本化的目录返回 None)"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), 'r', encoding='utf-8') as f: return f.read().strip() or None
+    except FileNotFoundError: return None
+
+def resolve_store_path(root: str) -> str:
+    """知识库根目录 → 当前版本的向量库目录 (兼容未版本化的旧目录)"""
+    version = read_current_version(root)
+    return os.path.join(root, VERSIONS_DIR, version) if version else root
+
+_version_lock = threading.Lock()
+_last_version_us = 0 # 本进程上次分配的版本时间戳 (微秒)
+
+def new_version_path(root: str) -> Tuple[str, str]:
+    """分配新的版本目录, 返回 (版本号, 目录)
+
+    版本号为 <年月日时分秒><微秒>-<随机后缀>, 按字符串排序即按创建先后 (本进程内严格递增; 旧的秒级版本号排在其前)。
+    """
+    global _last_version_us
+    with _version_lock: now_us = _last_version_us = max(time.time_ns() // 1000, _last_version_us + 1)
+    seconds, micros = divmod(now_us, 1000000)
+    version = f"{time.strftime('%Y%m%d%H%M%S', time.localtime(seconds))}{micros:06d}-{uuid.uuid4().hex[:6]}"
+    return version, os.path.join(root, VERSIONS_DIR, version)
+
+def publish_version(root: str, version: str, keep: int = 2) -> None:
+    """原子地将 CURRENT 指向新版本 (写临时文件后 os.replace), 并清理更早的旧版本
+
+    已加载旧版本的读取方继续使用其 mmap/文件句柄，直到下次加载新版本。
+    """
+    os.makedirs(root, exist_ok=True)
+    tmp_path = os.path.join(root, f"{CURRENT_FILE}.tmp{os.getpid()}")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(root, CURRENT_FILE))
+    versions_dir = os.path.join(root, VERSIONS_DIR)
+    old_versions = sorted(v for v in os.listdir(versions_dir) if v < version) # 只清理更早的版本, 不影响并发构建中的新版本
+    for old in old_versions[:max(0, len(old_versions) - max(0, keep - 1))]:
+        shutil.rmtree(os.path.join(versions_dir, old), ignore_errors=True)
+
+def _sample_rows(arrays: List[Any], size: int, seed: int = 0) -> Any:
+    """从若干个 (可能是 mmap 的) 向量数组中均匀抽取训练样本"""
+    total = sum(len(a) for a in arrays)
+    sample_ids = np.sort(np.random.default_rng(seed).choice(total, size=min(size, total), replace=False))
+    offsets = np.cumsum([0] + [len(a) for a in arrays])
+    return np.concatenate([np.asarray(arrays[s][sample_ids[(sample_ids >= offsets[s]) & (sample_ids < offsets[s + 1])] - offsets[s]], dtype='float32')
+                           for s in range(len(arrays))])
+
+class VectorStore:
+    """内存映射的 FAISS 索引 + SQLite 文档存储
+
+    目录结构:
+        vectors.faiss    - IDMap2 包装的 FAISS 索引 (flat / hnsw / ivfpq / sq8 / binary)，按 mmap 方式加载，多进程共享页缓存
+        vectors.npy      - 原始向量 (与 ids.npy 按行对应, mmap), 用于压缩索引的精确重排、过滤检索和合并时精确重建索引
+        docstore.sqlite  - 分块文本与元数据，检索命中后按 id 惰性读取; 增量追加的向量与删除标记也记录在其中
+        meta.json        - 索引类型与参数、向量维度和数量
+
+    增量更新只追加写 SQLite，不重写索引文件: 追加的向量放在内存中的 flat 增量索引里，删除的分块在检索时过滤。
+    增量或删除比例过大时由 compact() 合并为新的目录。
+    """
+    INDEX_FILE = "vectors.faiss"
+    VECTORS_FILE = "vectors.npy"
+    IDS_FILE = "ids.npy"
+    DOCSTORE_FILE = "docstore.sqlite"
+    META_FILE = "meta.json"
+    LEGACY_PKL_FILE = "index.pkl" # LangChain FAISS.save_local 的旧格式
+
+    def __init__(self, path: str, index: Any, docstore: SQLiteDocstore, meta: Optional[Dict[str, Any]] = None):
+        self.path = path
+        self.version = os.path.basename(os.path.normpath(path)) # 版本化目录下即版本号
+        self.index = index
+        self.docstore = docstore
+        self.meta = meta or {}
+        self.logger = setup_logger('log')
+        self._state_lock = threading.RLock() # 保护增量索引与删除标记
+        self._data_version = None
+        self._deleted = set()   # 已删除的分块 id
+        self._tombstone_seq = 0 # 已同步的删除标记位置
+        self._delta = None      # 增量向量的 flat 索引 (IDMap2)
+        self._delta_last_id = 0 # 已同步的增量分块 id
+        self._writer = None     # 增量写入使用的读写连接 (按需打开)
+        self._base_cache = None # 过滤检索使用的 (升序 ids, 原始向量, 行号) mmap 视图
+        self.search_cfg = dict(self.meta.get('index', {})) # 检索期参数
+        self._refresh()
+
+    @property
+    def ntotal(self) -> int:
+        """有效 (未删除) 向量数"""
+        return self.index.ntotal + self.delta_count - len(self._deleted)
+
+    @property
+    def delta_count(self) -> int:
+        return self._delta.ntotal if self._delta is not None else 0
+
+    @property
+    def tombstone_ratio(self) -> float:
+        total = self.index.ntotal + self.delta_count
+        return len(self._deleted) / total if total else 0.0
+
+    @property
+    def generation(self) -> str:
+        """内容版本标识: 版本目录 + 已同步的增量/删除位置, 任何内容变化都会改变该值"""
+        self._refresh()
+        return f"{self.version}:{self._delta_last_id}:{self._tombstone_seq}"
+
+    def needs_compaction(self, tombstone_ratio: float = 0.2, max_delta: int = 20000) -> bool:
+        """删除比例或增量规模超过阈值时需要合并"""
+        return self.tombstone_ratio > tombstone_ratio or self.delta_count > max_delta
+
+    @classmethod
+    def exists(cls, path: str) -> bool:
+        return os.path.exists(os.path.join(path, cls.INDEX_FILE)) and os.path.exists(os.path.join(path, cls.DOCSTORE_FILE))
+
+    @classmethod
+    def has_legacy(cls, path: str) -> bool:
+        return os.path.exists(os.path.join(path, cls.LEGACY_PKL_FILE))
+
+    @staticmethod
+    def _read_index(index_path: str, mmap: bool = True) -> Any:
+        """读取索引，优先使用 mmap (不支持时回退为普通读取)"""
+        if mmap:
+            # IO_FLAG_MMAP_IFC 为较新 faiss 提供的零拷贝 flat 索引映射，旧版本退回 IO_FLAG_MMAP
+            for flag_name in ("IO_FLAG_MMAP_IFC", "IO_FLAG_MMAP"):
+                flag = getattr(faiss, flag_name, None)
+                if flag is None: continue
+                try: return faiss.read_index(index_path, flag | faiss.IO_FLAG_READ_ONLY)
+                except Exception: continue
+            setup_logger('log').warning(f"当前 faiss 不支持以 mmap 方式加载 {index_path}，回退为普通加载")
+        return faiss.read_index(index_path)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, index_cfg: Optional[Dict[str, Any]] = None) -> "VectorStore":
+        """加载向量库 (索引 mmap, 文档存储只读)；index_cfg 中的检索参数优先于构建时保存的参数"""
+        index = cls._read_index(os.path.join(path, cls.INDEX_FILE), mmap=mmap)
+        docstore = SQLiteDocstore(os.path.join(path, cls.DOCSTORE_FILE), readonly=True)
+        meta_path = os.path.join(path, cls.META_FILE)
+        meta = {}
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f: meta = json.load(f)
+        search_cfg = dict(meta.get('index', {}))
+        if index_cfg: search_cfg.update({key: index_cfg[key] for key in ('ef_search', 'nprobe', 'filter_exact_max', 'rescore_factor') if key in index_cfg})
+        apply_search_params(index, search_cfg)
+        store = cls(path, index, docstore, meta)
+        store.search_cfg = search_cfg
+        return store
+
+    @classmethod
+    def _write(cls, path: str, docstore_tmp_path: str, batches: Iterator[Tuple[Any, Any]], train_sample: Any, total: int,
+               index_cfg: Optional[Dict[str, Any]] = None, extra_meta: Optional[Dict[str, Any]] = None) -> "VectorStore":
+        """训练索引并逐批添加 (id, 向量)，同时写出原始向量; 全部写入临时文件后再替换，避免留下半成品"""
+        index, effective_cfg = build_index(train_sample, index_cfg)
+        dim = int(train_sample.shape[1])
+        tmp = {name: os.path.join(path, name + ".tmp") for name in (cls.INDEX_FILE, cls.VECTORS_FILE, cls.IDS_FILE, cls.META_FILE)}
+        vectors_out = np.lib.format.open_memmap(tmp[cls.VECTORS_FILE], mode='w+', dtype='float32', shape=(total, dim))
+        ids_out = np.lib.format.open_memmap(tmp[cls.IDS_FILE], mode='w+', dtype='int64', shape=(total,))
+        position = 0
+        for ids, vectors in batches:
+            ids, vectors = np.asarray(ids, dtype='int64'), np.ascontiguousarray(vectors, dtype='float32')
+            index.add_with_ids(vectors, ids)
+            vectors_out[position:position + len(ids)], ids_out[position:position + len(ids)] = vectors, ids
+            position += len(ids)
+        if position != total: raise ValueError(f"写入的向量数量({position})与预期({total})不一致")
+        vectors_out.flush(), ids_out.flush()
+        del vectors_out, ids_out
+        faiss.write_index(index, tmp[cls.INDEX_FILE])
+        with open(tmp[cls.META_FILE], 'w', encoding='utf-8') as f:
+            json.dump({**(extra_meta or {}), "index": effective_cfg, "dim": dim, "count": total}, f, ensure_ascii=False, indent=2)
+        os.replace(docstore_tmp_path, os.path.join(path, cls.DOCSTORE_FILE))
+        for name, tmp_path in tmp.items(): os.replace(tmp_path, os.path.join(path, name))
+        return cls.load(path)
+
+    @classmethod
+    def _new_docstore(cls, path: str) -> Tuple[SQLiteDocstore, str]:
+        os.makedirs(path, exist_ok=True)
+        tmp_docstore_path = os.path.join(path, cls.DOCSTORE_FILE) + ".tmp"
+        if os.path.exists(tmp_docstore_path): os.remove(tmp_docstore_path)
+        return SQLiteDocstore(tmp_docstore_path), tmp_docstore_path
+
+    @classmethod
+    def build(cls, path: str, docs: List[Document], vectors: Any, index_cfg: Optional[Dict[str, Any]] = None,
+              extra_meta: Optional[Dict[str, Any]] = None) -> "VectorStore":
+        """由分块与向量构建向量库并落盘 (需要时先训练索引)，返回以 mmap 方式重新加载的实例
+
+        extra_meta 会写入 meta.json (例如构建所用内容的键, 用于判断是否可直接复用)。
+        """
+        if not docs: raise ValueError("没有可写入向量库的分块")
+        vectors = np.ascontiguousarray(vectors, dtype='float32')
+        if vectors.ndim != 2: raise ValueError(f"向量应为二维数组, 实际形状为 {vectors.shape}")
+        if len(docs) != vectors.shape[0]: raise ValueError(f"分块数量({len(docs)})与向量数量({vectors.shape[0]})不一致")
+        docstore, tmp_docstore_path = cls._new_docstore(path)
+        ids = docstore.add(docs)
+        docstore.close()
+        return cls._write(path, tmp_docstore_path, iter([(ids, vectors)]), vectors, len(ids), index_cfg, extra_meta)
+
+    @classmethod
+    def build_from_shards(cls, path: str, shard_dirs: List[str], index_cfg: Optional[Dict[str, Any]] = None,
+                          train_size: int = 100000, batch_size: int = 10000) -> "VectorStore":
+        """合并离线入库产生的分片 (每个分片: docstore.sqlite + vectors.npy) 为一个向量库
+
+        向量以 mmap 方式分批读取, 内存占用与语料规模无关 (训练样本除外)。
+        """
+        logger = setup_logger('log')
+        shard_vectors = [np.load(os.path.join(d, "vectors.npy"), mmap_mode='r') for d in shard_dirs]
+        total = sum(len(v) for v in shard_vectors)
+        if total == 0: raise ValueError("分片中没有任何向量")
+        sample = _sample_rows(shard_vectors, train_size) # flat/hnsw 不需要训练, 仅用于确定维度
+        docstore, tmp_docstore_path = cls._new_docstore(path)
+        def batches():
+            for shard_dir, vectors in zip(shard_dirs, shard_vectors):
+                shard_store = SQLiteDocstore(os.path.join(shard_dir, cls.DOCSTORE_FILE), readonly=True)
+                position = 0
+                for batch in shard_store.iter_batches(batch_size): # 分片内 id 顺序与向量顺序一致
+                    yield docstore.add([doc for _, doc in batch]), vectors[position:position + len(batch)]
+                    position += len(batch)
+                shard_store.close()
+                logger.info(f"已合并分片 {shard_dir}: {position} 条")
+            docstore.close() # 替换文件前关闭
+        try: return cls._write(path, tmp_docstore_path, batches(), sample, total, index_cfg)
+        finally: docstore.close()
+
+    @classmethod
+    def migrate_legacy(cls, path: str, embeddings: Any, index_cfg: Optional[Dict[str, Any]] = None, target_path: Optional[str] = None) -> "VectorStore":
+        """将 LangChain 旧格式 (index.faiss + index.pkl) 一次性转换为新格式 (默认写回原目录)"""
+        from langchain_community.vectorstores import FAISS # 仅迁移时需要
+        legacy = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+        docs = [legacy.docstore.search(legacy.index_to_docstore_id[i]) for i in range(legacy.index.ntotal)]
+        vectors = legacy.index.reconstruct_n(0, legacy.index.ntotal)
+        return cls.build(target_path or path, docs, vectors, index_cfg)
+
+    # --- 增量更新 ---
+    def _refresh(self) -> None:
+        """同步增量向量与删除标记: 文档存储有新提交时 (本进程或其他进程) 只读取新增的部分"""
+        with self._state_lock:
+            if self._data_version is not None and self.docstore.data_version() == self._data_version: return
+            self._data_version, tombstones, delta = self.docstore.changes_since(self._tombstone_seq, self._delta_last_id)
+            for seq, chunk_id in tombstones:
+                self._deleted.add(chunk_id)
+                self._tombstone_seq = seq
+            if delta:
+                if self._delta is None: self._delta = faiss.IndexIDMap2(faiss.IndexFlatL2(self.index.d))
+                self._delta.add_with_ids(np.stack([np.frombuffer(vector, dtype='float32') for _, vector in delta]),
+                                         np.asarray([chunk_id for chunk_id, _ in delta], dtype='int64'))
+                self._delta_last_id = delta[-1][0]
+
+    def _writable(self) -> SQLiteDocstore:
+        with self._state_lock:
+            if self._writer is None: self._writer = SQLiteDocstore(self.docstore.path)
+            return self._writer
+
+    def _check_vectors(self, docs: List[Document], vectors: Any) -> Any:
+        vectors = np.ascontiguousarray(vectors, dtype='float32').reshape(len(docs), -1)
+        if vectors.shape[1] != self.index.d: raise ValueError(f"向量维度({vectors.shape[1]})与索引维度({self.index.d})不一致")
+        return vectors
+
+    def add_documents(self, docs: List[Document], vectors: Any) -> List[int]:
+        """追加分块 (metadata 中的 source 作为来源)，返回分配的分块 id; 只追加写 SQLite, 不重写索引文件"""
+        if not docs: return []
+        ids = self._writable().add(docs, self._check_vectors(docs, vectors))
+        self._refresh()
+        return ids
+
+    def delete_by_source(self, source: str) -> int:
+        """删除某来源的全部分块 (写入删除标记)，返回删除的数量"""
+        ids = self._writable().delete_by_source(source)
+        self._refresh()
+        return len(ids)
+
+    def update_source(self, source: str, docs: List[Document], vectors: Any) -> List[int]:
+        """以新分块替换某来源的全部分块 (原子提交)，返回新分块的 id"""
+        docs = [Document(page_content=doc.page_content, metadata={**(doc.metadata or {}), "source": source}) for doc in docs]
+        _, ids = self._writable().replace_source(source, docs, self._check_vectors(docs, vectors) if docs else None)
+        self._refresh()
+        return ids
+
+    def _base_vectors(self) -> Tuple[Any, Any]:
+        """基础索引中的 (ids, 原始向量)，优先读取 mmap 的 vectors.npy"""
+        vectors_path, ids_path = os.path.join(self.path, self.VECTORS_FILE), os.path.join(self.path, self.IDS_FILE)
+        if os.path.exists(vectors_path) and os.path.exists(ids_path):
+            return np.load(ids_path, mmap_mode='r'), np.load(vectors_path, mmap_mode='r')
+        # 旧目录没有保存原始向量: 从索引重建 (flat / hnsw 为精确值)
+        self.logger.warning(f"{self.path} 缺少 {self.VECTORS_FILE}，从索引重建向量")
+        return faiss.vector_to_array(self.index.id_map), self.index.index.reconstruct_n(0, self.index.ntotal)
+
+    def base_ids(self) -> List[int]:
+        """基础索引中的分块 id"""
+        return [int(i) for i in self._base_vectors()[0]]
+
+    def compact(self, path: str, index_cfg: Optional[Dict[str, Any]] = None, train_size: int = 100000, batch_size: int = 10000) -> "VectorStore":
+        """合并为新的向量库目录: 物理删除已删除的分块并把增量向量并入索引 (分块 id 保持不变)
+
+        删除标记与增量在同一读事务中取快照, 新文档存储只移除快照中的部分; 其间其他进程提交的写入保留为新目录的增量。
+        """
+        _, tombstones, delta = self.docstore.changes_since(0, 0)
+        deleted = np.asarray([chunk_id for _, chunk_id in tombstones], dtype='int64')
+        read_delta_ids = delta_ids = np.asarray([chunk_id for chunk_id, _ in delta], dtype='int64')
+        delta_vectors = np.stack([np.frombuffer(vector, dtype='float32') for _, vector in delta]) if delta else np.empty((0, self.index.d), dtype='float32')
+        keep = ~np.isin(delta_ids, deleted)
+        delta_ids, delta_vectors = delta_ids[keep], delta_vectors[keep]
+        base_ids, base_vectors = self._base_vectors()
+        base_live = int((~np.isin(base_ids, deleted)).sum())
+        total = base_live + len(delta_ids)
+        if total == 0: raise ValueError("合并后没有任何向量")
+        sample = _sample_rows([a for a in (base_vectors, delta_vectors) if len(a)], train_size)
+        os.makedirs(path, exist_ok=True)
+        tmp_docstore_path = os.path.join(path, self.DOCSTORE_FILE) + ".tmp"
+        if os.path.exists(tmp_docstore_path): os.remove(tmp_docstore_path)
+        self.docstore.copy_compacted(tmp_docstore_path, deleted, read_delta_ids)
+        def batches():
+            for start in range(0, len(base_ids), batch_size):
+                ids = np.asarray(base_ids[start:start + batch_size])
+                live = ~np.isin(ids, deleted)
+                if live.any(): yield ids[live], np.asarray(base_vectors[start:start + batch_size])[live]
+            if len(delta_ids): yield delta_ids, delta_vectors
+        self.logger.info(f"合并向量库 {self.path} → {path}: 删除 {len(deleted)} 条, 并入增量 {len(delta_ids)} 条, 共 {total} 条")
+        return self._write(path, tmp_docstore_path, batches(), sample, total, index_cfg)
+
+    def _search_ids(self, query: Any, fetch: int, selector: Any = None) -> List[Tuple[int, float]]:
+        """在基础索引与增量索引中检索, 按距离合并 (含已删除的分块); selector 为 FAISS ID 选择器时只检索其中的 id"""
+        hits = []
+        if self.index.ntotal:
+            params = search_parameters(self.search_cfg, selector) if selector is not None else None
+            distances, ids = self.index.search(query, min(fetch, self.index.ntotal), params=params)
+            hits.extend((int(i), float(d)) for i, d in zip(ids[0], distances[0]) if i != -1)
+        with self._state_lock:
+            if self.delta_count:
+                params = search_parameters({"type": "flat"}, selector) if selector is not None else None
+                distances, ids = self._delta.search(query, min(fetch, self.delta_count), params=params)
+                hits.extend((int(i), float(d)) for i, d in zip(ids[0], distances[0]) if i != -1)
+        return sorted(hits, key=lambda hit: hit[1])[:fetch]
+
+    def _base_lookup(self) -> Optional[Tuple[Any, Any, Any]]:
+        """(升序 ids, 原始向量, 升序位置 → 行号) 的 mmap 视图; 旧目录没有 vectors.npy 时返回 None"""
+        if self._base_cache is None:
+            vectors_path, ids_path = os.path.join(self.path, self.VECTORS_FILE), os.path.join(self.path, self.IDS_FILE)
+            if not (os.path.exists(vectors_path) and os.path.exists(ids_path)): self._base_cache = False
+            else:
+                ids, vectors = np.load(ids_path, mmap_mode='r'), np.load(vectors_path, mmap_mode='r')
+                if len(ids) < 2 or bool(np.all(ids[1:] > ids[:-1])): self._base_cache = (ids, vectors, None) # 构建与合并写出的 id 本身有序
+                else:
+                    order = np.argsort(ids)
+                    self._base_cache = (np.asarray(ids)[order], vectors, order)
+        return self._base_cache or None
+
+    def _exact_search(self, query: Any, ids: Any, k: int) -> List[Tuple[int, float]]:
+        """只读取给定 id 的原始向量并精确计算 L2 距离 (与语料规模无关)"""
+        sorted_ids, base_vectors, order = self._base_lookup()
+        positions = np.minimum(np.searchsorted(sorted_ids, ids), max(len(sorted_ids) - 1, 0))
+        in_base = (sorted_ids[positions] == ids) if len(sorted_ids) else np.zeros(len(ids), dtype=bool)
+        rows = positions[in_base] if order is None else order[positions[in_base]]
+        rank = np.argsort(rows) # 按行号顺序读取 mmap
+        candidate_ids, vectors = list(ids[in_base][rank]), [np.asarray(base_vectors[rows[rank]], dtype='float32')]
+        with self._state_lock:
+            for chunk_id in ids[~in_base]: # 增量向量
+                if self._delta is None: break
+                try: vectors.append(self._delta.reconstruct(int(chunk_id)).reshape(1, -1))
+                except RuntimeError: continue # 尚未同步到内存的增量
+                candidate_ids.append(chunk_id)
+        if not candidate_ids: return []
+        distances = ((np.concatenate(vectors) - query) ** 2).sum(axis=1)
+        top = np.argsort(distances)[:k]
+        return [(int(candidate_ids[i]), float(distances[i])) for i in top]
+
+    @property
+    def rescore_factor(self) -> int:
+        """压缩索引的重排倍数 (非压缩索引或缺少原始向量时为 0)"""
+        if self.search_cfg.get('type', 'flat') not in COMPRESSED_INDEX_TYPES or not self._base_lookup(): return 0
+        return max(0, int(self.search_cfg.get('rescore_factor', DEFAULT_INDEX_CFG['rescore_factor'])))
+
+    def _rescore(self, query: Any, hits: List[Tuple[int, float]], k: int) -> List[Tuple[int, float]]:
+        """用 mmap 的原始向量对压缩索引的候选精确重排"""
+        if not self.rescore_factor or not hits: return hits[:k]
+        return self._exact_search(query, np.asarray([i for i, _ in hits], dtype='int64'), k)
+
+    def _search_filtered(self, query: Any, k: int, filters: Dict[str, Any]) -> List[Tuple[int, float]]:
+        """先在文档存储中按元数据选出候选 id (已排除删除的分块), 只在这些向量中检索"""
+        ids = self.docstore.filter_ids(filters)
+        if len(ids) == 0: return []
+        exact_max = int(self.search_cfg.get('filter_exact_max', DEFAULT_INDEX_CFG['filter_exact_max']))
+        if self._base_lookup() and (len(ids) <= exact_max or self.search_cfg.get('type') == 'binary'): # IndexLSH 不支持 ID 选择器
+            return self._exact_search(query, ids, k)
+        selector = faiss.IDSelectorBatch(ids) # 检索期间保持引用
+        return self._rescore(query, self._search_ids(query, k * max(1, self.rescore_factor), selector), k)
+
+    def search(self, vector: Any, k: int = 3, filters: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """按向量检索，返回 (分块, L2 距离) 列表; 已删除的分块被过滤 (不足 k 条时扩大候选数重试)
+
+        压缩索引 (sq8 / binary / ivfpq) 先取 k * rescore_factor 个候选，再用 mmap 的原始向量精确重排，返回精确距离。
+
+        filters 给出时只在满足元数据条件的分块中检索 (条件格式见 SQLiteDocstore.filter_ids)，
+        过滤在检索内部完成而不是对大量结果做后过滤。
+        """
+        self._refresh()
+        if self.ntotal <= 0: return []
+        query = np.ascontiguousarray(np.asarray(vector, dtype='float32').reshape(1, -1))
+        if filters:
+            live = self._search_filtered(query, k, filters)
+        else:
+            capacity = self.index.ntotal + self.delta_count
+            wanted = k * max(1, self.rescore_factor) # 压缩索引多取候选用于重排
+            fetch = wanted * 2 if self._deleted else wanted
+            while True:
+                hits = self._search_ids(query, fetch)
+                live = [(i, d) for i, d in hits if i not in self._deleted][:wanted]
+                if len(live) >= wanted or fetch >= capacity: break
+                fetch *= 2
+            live = self._rescore(query, live, k)
+        docs = self.docstore.get([i for i, _ in live])
+        return [(docs[i], d) for i, d in live if i in docs]
+
+    def close(self) -> None:
+        if self._writer is not None: self._writer.close()
+        self.docstore.close()
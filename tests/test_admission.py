@@ -0,0 +1,79 @@
+import sys, os, time, threading
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.admission import (AdmissionController, ServerBusyError, request_options,
+                           PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW, PRIORITY_BACKGROUND)
+from src.cancellation import CancellationToken, GenerationCancelled
+
+def test_priority_order():
+    """名额释放后按优先级 (同级按到达顺序) 交给排队的请求, 排队位置随之更新"""
+    print("开始测试优先级排队...")
+    admission, order, positions = AdmissionController(1, 4), [], {}
+    admission.acquire()
+    def worker(name, priority):
+        positions[name] = []
+        with request_options(on_position=positions[name].append):
+            with admission.admit(priority):
+                order.append(name)
+                time.sleep(0.05)
+    threads = []
+    for name, priority in [("rag", PRIORITY_LOW), ("gen-1", PRIORITY_NORMAL), ("tip", PRIORITY_HIGH), ("gen-2", PRIORITY_NORMAL)]:
+        thread = threading.Thread(target=worker, args=(name, priority))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.05) # 保证到达顺序
+    admission.release()
+    for thread in threads: thread.join(timeout=10)
+    print(f"执行顺序: {order}, 排队位置: {positions}")
+    assert order == ["tip", "gen-1", "gen-2", "rag"]
+    assert positions["tip"][-1] == 0 and positions["rag"][0] == 1 and positions["rag"][-1] == 0 # 后到的高优先级请求排到前面
+    assert admission.stats()["active"] == 0 and admission.stats()["waited"] == 4
+
+def test_shed_when_full():
+    """排队名额已满时立即拒绝; shed=False 的后台请求不受队列上限限制"""
+    print("\n开始测试队列满时拒绝...")
+    admission, done = AdmissionController(1, 1), []
+    admission.acquire()
+    waiter = threading.Thread(target=lambda: (admission.acquire(), done.append("queued"), admission.release()))
+    waiter.start()
+    time.sleep(0.05)
+    assert admission.saturated()
+    try:
+        admission.acquire()
+        assert False, "队列已满时应拒绝"
+    except ServerBusyError as e: print(f"拒绝: {e}")
+    background = threading.Thread(target=lambda: (admission.acquire(PRIORITY_BACKGROUND, shed=False), done.append("background"), admission.release()))
+    background.start()
+    time.sleep(0.05)
+    admission.release()
+    for thread in (waiter, background): thread.join(timeout=10)
+    print(f"完成: {done}, 统计: {admission.stats()}")
+    assert done == ["queued", "background"] and admission.stats()["rejected"] == 1
+
+def test_queue_timeout_and_cancel():
+    """排队超时按繁忙处理; 排队中的请求被取消时离开队列"""
+    print("\n开始测试排队超时与取消...")
+    admission = AdmissionController(1, 2, queue_timeout=0.2)
+    admission.acquire()
+    start = time.monotonic()
+    try:
+        admission.acquire()
+        assert False, "排队超时应抛出 ServerBusyError"
+    except ServerBusyError as e: print(f"超时: {e}, 等待 {time.monotonic() - start:.2f}s")
+    assert 0.15 <= time.monotonic() - start < 2 and admission.stats()["timeouts"] == 1
+
+    token = CancellationToken()
+    threading.Timer(0.1, token.cancel, ("new input",)).start()
+    start = time.monotonic()
+    try:
+        admission.acquire(shed=False, cancel_token=token)
+        assert False, "取消后应抛出 GenerationCancelled"
+    except GenerationCancelled as e: print(f"取消: {e.reason}, 等待 {time.monotonic() - start:.2f}s")
+    stats = admission.stats()
+    print(f"统计: {stats}")
+    assert time.monotonic() - start < 0.9 and stats["queued"] == 0 and not token._callbacks # 被唤醒离开队列, 回调已注销
+
+if __name__ == "__main__":
+    test_priority_order()
+    test_shed_when_full()
+    test_queue_timeout_and_cancel()
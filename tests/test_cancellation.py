@@ -0,0 +1,65 @@
+import sys, os, time, threading
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.cancellation import CancellationToken, GenerationCancelled, DeadlineExceeded, cancellation_scope, current_token
+
+def test_limit():
+    """limit 只会收紧截止时间; 未设置时不限制"""
+    print("开始测试截止时间收紧...")
+    token = CancellationToken()
+    assert token.deadline is None and token.remaining() is None and not token.should_stop()
+    token.limit(10)
+    first = token.deadline
+    token.limit(60) # 更晚的截止时间不生效
+    assert token.deadline == first
+    token.limit(0.1) # 更早的截止时间生效
+    print(f"剩余时间: {token.remaining():.2f}s")
+    assert token.deadline < first and token.remaining() <= 0.1
+    time.sleep(0.15)
+    assert token.expired() and token.should_stop() and not token.cancelled and token.remaining() == 0.0
+
+def test_deadline_partial():
+    """超过截止时间抛出 DeadlineExceeded 并携带部分回答; 取消优先于超时"""
+    print("\n开始测试超时的部分回答...")
+    token = CancellationToken(timeout=0.05)
+    token.raise_if_stopped(partial="未超时") # 截止前不抛出
+    time.sleep(0.1)
+    try:
+        token.raise_if_stopped(partial="半截回答")
+        assert False, "超时后应抛出 DeadlineExceeded"
+    except DeadlineExceeded as e:
+        print(f"超时: reason={e.reason}, partial={e.partial!r}")
+        assert isinstance(e, GenerationCancelled) and e.reason == "deadline" and e.partial == "半截回答"
+    token.cancel("new input")
+    try: token.raise_if_stopped(partial="半截回答")
+    except DeadlineExceeded: assert False, "已取消时应抛出 GenerationCancelled 而不是超时"
+    except GenerationCancelled as e: print(f"取消: {e.reason}")
+
+def test_callbacks_and_scope():
+    """取消回调只执行一次、可注销; alive 返回 False 视为取消; cancellation_scope 设置当前令牌"""
+    print("\n开始测试取消回调与作用域...")
+    token, calls = CancellationToken(), []
+    token.on_cancel(lambda: calls.append("kept"))
+    remove = token.on_cancel(lambda: calls.append("removed"))
+    remove()
+    threading.Thread(target=token.cancel, args=("closed",)).start()
+    time.sleep(0.05)
+    token.cancel("again")
+    token.on_cancel(lambda: calls.append("late")) # 已取消时立即执行
+    print(f"回调: {calls}, reason={token.reason}")
+    assert calls == ["kept", "late"] and token.reason == "closed"
+
+    alive = [True]
+    session = CancellationToken(alive=lambda: alive[0])
+    assert not session.should_stop()
+    alive[0] = False
+    assert session.cancelled and session.reason == "session closed"
+
+    assert current_token() is None
+    with cancellation_scope(session): assert current_token() is session
+    assert current_token() is None
+
+if __name__ == "__main__":
+    test_limit()
+    test_deadline_partial()
+    test_callbacks_and_scope()
@@ -0,0 +1,61 @@
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.chunking import MarkdownResumeChunker, classify_section, extract_skills
+
+RESUME = """# 张三
+## 教育背景
+成都大学 计算机科学与技术 本科
+## 项目经历
+### 简历问答系统
+- 基于 LangChain 与 FAISS 构建 RAG 知识库
+- 使用 LoRA 微调大模型
+## 工作经历
+### 某公司 算法实习生
+负责 Python 数据处理与 Docker 部署
+```
+# 代码中的井号不是标题
+```
+## 专业技能
+熟悉 PyTorch、SQL, 了解 Go
+"""
+
+def test_sections():
+    """按标题层级切分, 分块带标题路径前缀与段落类别; 代码块中的 # 不视为标题"""
+    print("开始测试段落切分与类别...")
+    docs = MarkdownResumeChunker(300, 50).split(RESUME, {"source": "张三.md"})
+    for doc in docs: print(f"[{doc.metadata['section']}] {doc.metadata['section_path']}: {doc.metadata['skills']}")
+    paths = [doc.metadata["section_path"] for doc in docs]
+    assert paths == ["张三 > 教育背景", "张三 > 项目经历 > 简历问答系统", "张三 > 工作经历 > 某公司 算法实习生", "张三 > 专业技能"]
+    assert [doc.metadata["section"] for doc in docs] == ["education", "projects", "work", "skills"]
+    assert all(doc.page_content.startswith(doc.metadata["section_path"] + "\n") for doc in docs)
+    assert all(doc.metadata["source"] == "张三.md" for doc in docs)
+    assert "# 代码中的井号不是标题" in docs[2].page_content
+    assert classify_section("项目经验") == "projects" and classify_section("Work Experience") == "work" and classify_section("其他") == "other"
+
+def test_skills():
+    """技能标签不区分大小写, 英文词要求词边界 (Go 不匹配 Google, C 不匹配 C++)"""
+    print("\n开始测试技能标签...")
+    docs = MarkdownResumeChunker(300, 50).split(RESUME)
+    skills = {doc.metadata["section"]: doc.metadata["skills"] for doc in docs}
+    print(f"技能标签: {skills}")
+    assert skills["projects"] == ["LangChain", "RAG", "FAISS", "LoRA", "大模型", "微调", "知识库"]
+    assert skills["work"] == ["Python", "Docker"] and skills["skills"] == ["Go", "SQL", "PyTorch"]
+    assert skills["education"] == []
+    assert extract_skills("使用 google 搜索, 熟悉 c++ 与 pytorch") == ["C++", "PyTorch"]
+
+def test_merge_short_subsections():
+    """同一上级标题下相邻的短小节合并为一个分块, 前缀改为上级路径; 列表项不跨分块拆分"""
+    print("\n开始测试短小节合并与列表项...")
+    text = "# 李四\n## 工作经历\n### 甲公司\n实习三个月\n### 乙公司\n实习两个月\n## 项目经历\n" + "\n".join(f"- 第{i}项 {'细节' * 10}" for i in range(6))
+    docs = MarkdownResumeChunker(100, 20).split(text)
+    for doc in docs: print(f"[{doc.metadata['section']}] {doc.page_content!r}")
+    assert docs[0].metadata["section_path"] == "李四 > 工作经历"
+    assert docs[0].page_content == "李四 > 工作经历\n甲公司\n实习三个月\n乙公司\n实习两个月"
+    items = [line for doc in docs[1:] for line in doc.page_content.splitlines()[1:]]
+    assert len(docs) > 2 and items == [f"- 第{i}项 {'细节' * 10}" for i in range(6)] # 每项完整出现一次
+
+if __name__ == "__main__":
+    test_sections()
+    test_skills()
+    test_merge_short_subsections()
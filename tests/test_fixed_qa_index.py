@@ -0,0 +1,77 @@
+import sys, os, json, time, difflib, tempfile
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.fixed_qa_index import FixedQAIndex, normalize
+
+FIXED_QA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "fixed_qa.json")
+
+def linear_scan(items, query, threshold=0.7):
+    """原实现: 对每个预设问题计算 SequenceMatcher"""
+    best_answer, highest = None, 0
+    cleaned_query = normalize(query)
+    for item in items:
+        for question in item.get("questions", []):
+            similarity = difflib.SequenceMatcher(None, cleaned_query, normalize(question)).ratio()
+            if similarity > highest:
+                highest = similarity
+                if similarity >= threshold: best_answer = item.get("answer")
+    return best_answer
+
+def test_matches_linear_scan():
+    """索引匹配结果与线性扫描一致"""
+    print("开始测试固定问答索引与线性扫描的一致性...")
+    with open(FIXED_QA_PATH, 'r', encoding='utf-8') as f: items = json.load(f)["fixed_answers"]
+    index = FixedQAIndex({"path": FIXED_QA_PATH})
+    queries = [q for item in items for q in item["questions"]]
+    queries += [q + "呢" for q in queries] + [q[1:] for q in queries] + ["今天天气怎么样", "你好", "", "？？？"]
+    mismatches = 0
+    for query in queries:
+        expected = linear_scan(items, query)
+        match = index.match(query)
+        actual = match["answer"] if match else None
+        if actual != expected:
+            mismatches += 1
+            print(f"不一致: {query!r} 索引={actual!r:.20} 线性扫描={expected!r:.20}")
+    print(f"共 {len(queries)} 个查询, 不一致 {mismatches} 个")
+    assert mismatches == 0
+
+def test_reload_on_change():
+    """JSON 文件修改后自动重新加载"""
+    print("\n开始测试固定问答文件变化后的自动重新加载...")
+    fd, path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        with open(path, 'w', encoding='utf-8') as f: json.dump({"fixed_answers": [{"questions": ["你是谁"], "answer": "A"}]}, f, ensure_ascii=False)
+        index = FixedQAIndex({"path": path, "check_interval": 0})
+        print(f"修改前: {index.match('你是谁')}")
+        assert index.match("你是谁")["answer"] == "A"
+        time.sleep(0.01)
+        with open(path, 'w', encoding='utf-8') as f: json.dump({"fixed_answers": [{"questions": ["你是谁"], "answer": "B"}, {"questions": ["你会什么"], "answer": "C"}]}, f, ensure_ascii=False)
+        os.utime(path, (time.time() + 1, time.time() + 1)) # 保证 mtime 变化
+        print(f"修改后: {index.match('你是谁')}, {index.match('你会什么呢')}")
+        assert index.match("你是谁")["answer"] == "B" and len(index) == 2
+        assert index.match("你会什么呢")["answer"] == "C"
+    finally:
+        os.remove(path)
+
+def test_large_faq():
+    """数千条问题时的匹配耗时"""
+    print("\n开始测试大规模固定问答的匹配耗时...")
+    fd, path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        items = [{"questions": [f"第{i}个问题关于项目{i % 97}的细节是什么", f"请介绍编号{i}的经历"], "answer": str(i)} for i in range(5000)]
+        with open(path, 'w', encoding='utf-8') as f: json.dump({"fixed_answers": items}, f, ensure_ascii=False)
+        index = FixedQAIndex({"path": path})
+        start = time.perf_counter()
+        match = index.match("第1234个问题关于项目70的细节是啥")
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"{len(index)} 个问题, 匹配结果: {match['answer'] if match else None}, 耗时 {elapsed:.2f} ms")
+        assert match and match["answer"] == "1234"
+    finally:
+        os.remove(path)
+
+if __name__ == "__main__":
+    test_matches_linear_scan()
+    test_reload_on_change()
+    test_large_faq()
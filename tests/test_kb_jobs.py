@@ -0,0 +1,61 @@
+import sys, os, time, threading
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.kb_jobs import KnowledgeBaseJobQueue
+
+def blocking_job(started, release, runs, name):
+    """记录执行顺序, 等待 release 后才结束的任务"""
+    def fn(progress):
+        runs.append(name)
+        started.set()
+        release.wait(timeout=10)
+        return True
+    return fn
+
+def test_same_content_merged():
+    """内容键相同的构建与进行中的任务合并"""
+    print("开始测试相同内容的构建任务合并...")
+    jobs, runs = KnowledgeBaseJobQueue(), []
+    started, release = threading.Event(), threading.Event()
+    first = jobs.submit("t-same", blocking_job(started, release, runs, "a"), content_key="k1")
+    started.wait(timeout=5)
+    second = jobs.submit("t-same", blocking_job(started, release, runs, "b"), content_key="k1")
+    release.set()
+    job = jobs.wait(first, timeout=10)
+    print(f"任务: {first}, {second}, 执行: {runs}, 状态: {job['status']}")
+    assert first == second and runs == ["a"] and job["status"] == KnowledgeBaseJobQueue.SUCCEEDED
+
+def test_different_content_queued():
+    """内容不同的构建排在进行中的任务之后执行, 排队中相同内容只保留一个"""
+    print("\n开始测试不同内容的构建任务排队...")
+    jobs, runs = KnowledgeBaseJobQueue(), []
+    started, release = threading.Event(), threading.Event()
+    first = jobs.submit("t-diff", blocking_job(started, release, runs, "a"), content_key="k1")
+    started.wait(timeout=5)
+    second = jobs.submit("t-diff", blocking_job(started, release, runs, "b"), content_key="k2")
+    third = jobs.submit("t-diff", blocking_job(started, release, runs, "c"), content_key="k2")
+    assert jobs.status(second)["status"] == KnowledgeBaseJobQueue.QUEUED and runs == ["a"] # 不与进行中的任务并发
+    release.set()
+    job = jobs.wait(second, timeout=10)
+    print(f"任务: {first}, {second}, {third}, 执行: {runs}, 后续任务状态: {job['status']}")
+    assert second != first and third == second and runs == ["a", "b"] and job["status"] == KnowledgeBaseJobQueue.SUCCEEDED
+
+def test_compaction_followup():
+    """合并进行中又有新的写入: 排队一次后续合并, 多次请求只合并为一个"""
+    print("\n开始测试合并任务的后续任务...")
+    jobs, runs = KnowledgeBaseJobQueue(), []
+    started, release = threading.Event(), threading.Event()
+    first = jobs.submit("t-compact", blocking_job(started, release, runs, "compact-1"), kind="compact")
+    started.wait(timeout=5)
+    followups = {jobs.submit("t-compact", blocking_job(started, release, runs, f"compact-{i}"), kind="compact") for i in range(2, 5)}
+    release.set()
+    followup = followups.pop()
+    jobs.wait(followup, timeout=10)
+    time.sleep(0.1)
+    print(f"后续任务: {followup} (共 {len(followups) + 1} 个), 执行: {runs}")
+    assert not followups and followup != first and runs == ["compact-1", "compact-2"]
+
+if __name__ == "__main__":
+    test_same_content_merged()
+    test_different_content_queued()
+    test_compaction_followup()
@@ -0,0 +1,41 @@
+import sys, os, shutil, tempfile
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from langchain_core.documents import Document
+from src.kb_registry import KnowledgeBaseRegistry
+from src.vector_store import VectorStore
+
+def test_tenant_dirs_distinct():
+    """不同租户 ID 映射到不同目录 (过滤字符后相同、大小写不同、形如哈希的 ID 都不冲突)"""
+    print("开始测试租户目录映射...")
+    tenants = ["张三.md", "李四.md", "a.b", "a_b", "A_b", "0123456789abcdef", "x" * 65, "x" * 64,
+               KnowledgeBaseRegistry.tenant_dirname("张三.md")]
+    names = [KnowledgeBaseRegistry.tenant_dirname(tenant) for tenant in tenants]
+    for tenant, name in zip(tenants, names): print(f"{tenant[:20]!r} → {name}")
+    assert len({name.lower() for name in names}) == len(tenants)
+    assert names[5] == "0123456789abcdef" and names[7] == "x" * 64 # 内容哈希 ID 原样使用
+    assert all(name == os.path.basename(name) and name not in (".", "..") for name in names)
+
+def test_colliding_tenants_isolated():
+    """旧映射下会共用目录的两个租户各自构建, 互不覆盖"""
+    print("\n开始测试租户隔离...")
+    registry, root = KnowledgeBaseRegistry(), tempfile.mkdtemp()
+    tenants_dir, registry.tenants_dir = registry.tenants_dir, root
+    try:
+        for i, tenant in enumerate(["张三.md", "李四.md"]):
+            version, path = registry.new_version(tenant)
+            store = VectorStore.build(path, [Document(page_content=tenant)], np.eye(1, 8, i, dtype='float32'))
+            registry.publish(tenant, version, store)
+        for tenant in ["张三.md", "李四.md"]: registry.evict(tenant)
+        texts = [registry.get(tenant).search(np.eye(1, 8, 0, dtype='float32')[0], k=1)[0][0].page_content for tenant in ["张三.md", "李四.md"]]
+        print(f"目录: {sorted(os.listdir(root))}, 检索结果: {texts}")
+        assert texts == ["张三.md", "李四.md"] and len(os.listdir(root)) == 2
+    finally:
+        for tenant in ["张三.md", "李四.md"]: registry.evict(tenant)
+        registry.tenants_dir = tenants_dir
+        shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_tenant_dirs_distinct()
+    test_colliding_tenants_isolated()
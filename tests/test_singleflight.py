@@ -0,0 +1,81 @@
+import sys, os, time, threading
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.singleflight import SingleFlight, flight_key
+from src.cancellation import CancellationToken, GenerationCancelled, cancellation_scope
+
+def run_concurrently(targets):
+    """同时启动多个调用, 返回各自的结果或异常"""
+    results = [None] * len(targets)
+    def call(i):
+        try: results[i] = targets[i]()
+        except Exception as e: results[i] = e
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(targets))]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02) # 保证第一个调用成为执行者
+    for thread in threads: thread.join(timeout=10)
+    return results
+
+def test_coalesces_concurrent_calls():
+    """相同 key 的并发调用只执行一次, 结果与流式文本共享"""
+    print("开始测试相同查询的并发合并...")
+    flights, calls = SingleFlight(), []
+    def generate(on_text):
+        calls.append(1)
+        for text in ["你", "好", "!"]:
+            on_text(text)
+            time.sleep(0.1)
+        return "你好!"
+    streams = [[] for _ in range(4)]
+    results = run_concurrently([lambda i=i: flights.do(flight_key("你好", None), generate, streams[i].append) for i in range(4)])
+    print(f"执行次数: {len(calls)}, 结果: {results}, 流式文本: {streams}, 统计: {flights.stats()}")
+    assert len(calls) == 1 and results == ["你好!"] * 4
+    assert all("".join(stream) == "你好!" for stream in streams) # 中途加入的调用也收到完整的文本
+    assert flights.stats() == {"leaders": 1, "coalesced": 3, "inflight": 0}
+
+def test_different_keys_and_errors():
+    """不同 key 各自执行; 执行者的异常传给所有等待者, 结束后不再合并"""
+    print("\n开始测试不同查询与异常传播...")
+    flights = SingleFlight()
+    def fail(on_text):
+        time.sleep(0.1)
+        raise ValueError("boom")
+    results = run_concurrently([lambda: flights.do("a", fail), lambda: flights.do("a", fail), lambda: flights.do("b", lambda on_text: "b")])
+    print(f"结果: {results!r}")
+    assert all(isinstance(result, ValueError) for result in results[:2]) and results[2] == "b"
+    assert flights.do("a", lambda on_text: "retry") == "retry"
+
+def test_leader_cancelled():
+    """执行者被取消时, 未取消的等待者重新执行; 等待者自己的取消令牌照常生效"""
+    print("\n开始测试执行者被取消后的重新执行...")
+    flights, calls = SingleFlight(), []
+    leader_token = CancellationToken()
+    def generate(on_text):
+        calls.append(1)
+        for text in ["一", "二", "三"]:
+            on_text(text)
+            time.sleep(0.1)
+            if len(calls) == 1: leader_token.raise_if_stopped()
+        return "一二三"
+    def leader():
+        with cancellation_scope(leader_token): return flights.do("k", generate)
+    stream = []
+    threading.Timer(0.15, leader_token.cancel, ("new input",)).start()
+    results = run_concurrently([leader, lambda: flights.do("k", generate, stream.append)])
+    print(f"执行次数: {len(calls)}, 结果: {results!r}, 流式文本: {stream}")
+    assert isinstance(results[0], GenerationCancelled) and results[1] == "一二三"
+    assert len(calls) == 2 and "".join(stream) == "一二三" # 重新执行时已转发的片段不重复输出
+
+    follower_token = CancellationToken(timeout=0.2)
+    def follower():
+        with cancellation_scope(follower_token): return flights.do("slow", lambda on_text: time.sleep(1) or "done")
+    start = time.monotonic()
+    results = run_concurrently([lambda: flights.do("slow", lambda on_text: time.sleep(1) or "done"), follower])
+    print(f"等待者超时: {results!r}, 等待 {time.monotonic() - start:.2f}s")
+    assert results[0] == "done" and isinstance(results[1], GenerationCancelled)
+
+if __name__ == "__main__":
+    test_coalesces_concurrent_calls()
+    test_different_keys_and_errors()
+    test_leader_cancelled()
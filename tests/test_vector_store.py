@@ -0,0 +1,85 @@
+import sys, os, shutil, tempfile
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from langchain_core.documents import Document
+from src.vector_store import VectorStore, SQLiteDocstore, new_version_path
+
+DIM = 16
+
+def make_docs(prefix, count, source=None, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(count, DIM)).astype('float32')
+    docs = [Document(page_content=f"{prefix}{i}", metadata={"source": source or f"{prefix}{i}"}) for i in range(count)]
+    return docs, vectors
+
+def texts(store, vectors, k=1):
+    return [store.search(vector, k=k)[0][0].page_content for vector in vectors]
+
+def test_delta_and_tombstones():
+    """增量分块可被检索, 删除的分块被过滤; 合并后结果不变"""
+    print("开始测试增量、删除标记与合并...")
+    root = tempfile.mkdtemp()
+    try:
+        docs, vectors = make_docs("base", 20)
+        store = VectorStore.build(os.path.join(root, "v1"), docs, vectors)
+        new_docs, new_vectors = make_docs("delta", 5, seed=1)
+        store.add_documents(new_docs, new_vectors)
+        store.delete_by_source("base3")
+        print(f"增量 {store.delta_count} 条, 删除比例 {store.tombstone_ratio:.3f}, 有效 {store.ntotal} 条")
+        assert store.delta_count == 5 and store.ntotal == 24
+        assert texts(store, new_vectors) == [doc.page_content for doc in new_docs]
+        assert "base3" not in [doc.page_content for doc, _ in store.search(vectors[3], k=3)]
+        compacted = store.compact(os.path.join(root, "v2"))
+        print(f"合并后: 基础索引 {compacted.index.ntotal} 条, 增量 {compacted.delta_count} 条, 删除比例 {compacted.tombstone_ratio}")
+        assert compacted.index.ntotal == 24 and compacted.delta_count == 0 and compacted.tombstone_ratio == 0
+        assert texts(compacted, new_vectors) == [doc.page_content for doc in new_docs]
+        assert "base3" not in [doc.page_content for doc, _ in compacted.search(vectors[3], k=3)]
+        store.close(), compacted.close()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+def test_compaction_keeps_concurrent_writes():
+    """合并读取快照之后 (其他进程) 提交的增量与删除不丢失, 在新目录中作为增量保留"""
+    print("\n开始测试合并期间的并发写入...")
+    root = tempfile.mkdtemp()
+    try:
+        docs, vectors = make_docs("base", 20)
+        store = VectorStore.build(os.path.join(root, "v1"), docs, vectors)
+        early_docs, early_vectors = make_docs("early", 3, seed=1)
+        store.add_documents(early_docs, early_vectors)
+        late_docs, late_vectors = make_docs("late", 3, seed=2)
+        read_base = store._base_vectors
+        def write_during_compaction(): # 快照之后、复制文档存储之前, 另一个连接提交写入
+            other = SQLiteDocstore(store.docstore.path)
+            other.add(late_docs, late_vectors)
+            other.delete_by_source("base5")
+            other.close()
+            return read_base()
+        store._base_vectors = write_during_compaction
+        compacted = store.compact(os.path.join(root, "v2"))
+        print(f"合并后: 基础索引 {compacted.index.ntotal} 条, 增量 {compacted.delta_count} 条, 有效 {compacted.ntotal} 条")
+        assert compacted.index.ntotal == 23 and compacted.delta_count == 3 and compacted.ntotal == 25
+        assert texts(compacted, early_vectors) == [doc.page_content for doc in early_docs]
+        assert texts(compacted, late_vectors) == [doc.page_content for doc in late_docs]
+        assert "base5" not in [doc.page_content for doc, _ in compacted.search(vectors[5], k=3)]
+        store.close(), compacted.close()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+def test_versions_and_empty_build():
+    """版本号按创建先后排序 (同一秒内也是); 空分块列表构建时给出明确错误"""
+    print("\n开始测试版本号排序与空构建...")
+    versions = [new_version_path("kb")[0] for _ in range(100)]
+    print(f"版本号示例: {versions[0]}")
+    assert versions == sorted(versions) and len(set(versions)) == len(versions)
+    root = tempfile.mkdtemp()
+    try:
+        VectorStore.build(os.path.join(root, "v1"), [], np.zeros((0, DIM), dtype='float32'))
+        assert False, "空构建应抛出 ValueError"
+    except ValueError as e: print(f"空构建: {e}")
+    finally: shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_delta_and_tombstones()
+    test_compaction_keeps_concurrent_writes()
+    test_versions_and_empty_build()